@@ -10,8 +10,111 @@ From files in '/lustre/storeB/project/IT/geout/machine-ocean/data_raw/metop', af
 import xarray as xr
 import numpy as np
 
+from dtype_policy import apply_dtype_policy
+from gradients import grid_spacing_km, plane_gradients
+from instrumentation import record_open, record_read, timer
+from nrcs_models import get_normalization_model
+from window_stats import size_suffix, window_bounds, window_stats
+
+BEAMS = ['fore', 'mid', 'aft']
+
+# Latitude spacing [degrees] above which a product is flagged as low
+# resolution (f_low_res)
+LOW_RESOLUTION_SPACING = 2
+
+# Quality flag masks: flag variable prefix -> largest accepted value.
+# f_usable is 0 (good), 1 (usable) or 2 (not usable), f_kp is 0 (good) or
+# 1 (poor) and f_land is the land fraction of the pixel
+FLAG_MASKS = {
+    'strict': {'f_usable_': 0, 'f_kp_': 0, 'f_land_': 0},
+    'usable': {'f_usable_': 1, 'f_land_': 0},
+}
+
+
+def open_ascat(ascat_fn):
+    """ Open an ASCAT dataset, recording the opening time and file size
+    (see `instrumentation`).
+    """
+    record_open(ascat_fn)
+    with timer('ascat.open_dataset'):
+        return xr.open_dataset(ascat_fn)
+
+
+def load_window(data, stage):
+    """ Read a lazy selection of an ASCAT dataset into memory, recording
+    the time as `stage` and the bytes read (see `instrumentation`).
+    """
+    with timer(stage):
+        data = data.load()
+    record_read(data.nbytes)
+    return data
+
+
+def get_flag_mask(flag_mask):
+    """ Flag mask by name in FLAG_MASKS, or the given dictionary. """
+    if isinstance(flag_mask, str):
+        try:
+            return FLAG_MASKS[flag_mask]
+        except KeyError:
+            raise ValueError('Unknown flag mask %s, choose from %s'
+                    % (flag_mask, sorted(FLAG_MASKS)))
+    return flag_mask
+
+
+def valid_pixels(data, beam, flag_mask):
+    """ Pixels of a beam with finite NRCS and quality flags accepted by
+    `flag_mask`.
+
+    Parameters
+    ==========
+    data : xarray Dataset
+        ASCAT dataset, cropped image or single pixel.
+    beam : string
+        'fore', 'mid' or 'aft'.
+    flag_mask : string or dictionary
+        Name of a mask in FLAG_MASKS or a dictionary of flag variable
+        prefixes and largest accepted values. Missing flag variables are
+        ignored.
+
+    Returns
+    =======
+    valid : array of bools
+    """
+    valid = np.isfinite(data['sigma0_trip_' + beam].values)
+    for prefix, max_value in get_flag_mask(flag_mask).items():
+        if prefix + beam in data:
+            valid &= data[prefix + beam].values <= max_value
+    return valid
+
+
+def normalize_beams(ascat_params_dict, norm_model='cmod5n'):
+    """ Add the incidence angle normalized NRCS of the three beams to a
+    dictionary returned by the `ascat_params*` functions.
+
+    Parameters
+    ==========
+    ascat_params_dict : dictionary
+        Dictionary with the keys sigma0_trip_<beam> and
+        inc_angle_trip_<beam>, scalars or arrays.
+    norm_model : string or NormalizationModel, optional
+        Normalization model from `nrcs_models` (default CMOD5.N).
 
-def ascat_params(ascat_fn, station_lon, station_lat):
+    Returns
+    =======
+    ascat_params_dict : dictionary
+        The input dictionary with the additional keys
+        sigma0_norm_trip_<beam> : NRCS [dB] normalized by `norm_model`.
+    """
+    model = get_normalization_model(norm_model)
+    for beam in BEAMS:
+        s0_norm = model(
+            ascat_params_dict['sigma0_trip_' + beam],
+            ascat_params_dict['inc_angle_trip_' + beam])
+        ascat_params_dict['sigma0_norm_trip_' + beam] = s0_norm.item() if np.ndim(s0_norm) == 0 else s0_norm
+    return ascat_params_dict
+
+
+def ascat_params(ascat_fn, station_lon, station_lat, norm_model=None, dtype_policy=None):
     """ Estimate SAR parameters at given location.
 
     Parameters
@@ -22,6 +125,12 @@ def ascat_params(ascat_fn, station_lon, station_lat):
         Longitude (in degrees) of the station where ASCAT parameters are retrieved.
     station_lat : float
         Latitue (in degrees) of the station where ASCAT parameters are retrieved.            
+    norm_model : string, optional
+        If provided, name of the incidence angle normalization model in
+        `nrcs_models` (e.g. 'cmod5n') used to add normalized NRCS.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` (e.g. 'float32' or
+        'compact') applied to the returned arrays.
         
 
     Returns
@@ -50,10 +159,12 @@ def ascat_params(ascat_fn, station_lon, station_lat):
             Geographical longitudes in degrees of the original image.
         grid_lats_orig : array of floats
             Geographical latitudes in degrees of the original image.
+        sigma0_norm_trip_fore, sigma0_norm_trip_mid, sigma0_norm_trip_aft : float
+            Normalized NRCS [dB], only if `norm_model` is provided.
     """
     
     # Load the image data
-    data = xr.open_dataset(ascat_fn)
+    data = open_ascat(ascat_fn)
     
     # Fill in dict with parameters from the image
     ascat_params_dict = {}
@@ -68,7 +179,8 @@ def ascat_params(ascat_fn, station_lon, station_lat):
         'stop_sensing_time'
     ]
     
-    data_station = data.sel(lat=station_lat, lon=station_lon,  method='nearest')
+    data_station = load_window(data.sel(lat=station_lat, lon=station_lon, method='nearest'),
+            'ascat.nearest')
     
     for param in list_of_params:
         if param == 'start_sensing_time':
@@ -78,10 +190,16 @@ def ascat_params(ascat_fn, station_lon, station_lat):
         else:    
             ascat_params_dict[param] = data_station[param].values.item()  # Var
 
+    if norm_model is not None:
+        normalize_beams(ascat_params_dict, norm_model)
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
     return ascat_params_dict
 
 
-def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17, ny:int=17):
+def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17, ny:int=17, norm_model=None, dtype_policy=None, flag_mask=None):
     """ Estimate SAR parameters at given location.
 
     Parameters
@@ -96,6 +214,16 @@ def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17,
         Number of pixel in the longitude dimension of the cropped image.
     ny : float
         Number of pixel in the latitude dimension of the cropped image.
+    norm_model : string, optional
+        If provided, name of the incidence angle normalization model in
+        `nrcs_models` (e.g. 'cmod5n') used to add normalized NRCS.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` (e.g. 'float32' or
+        'compact') applied to the returned arrays.
+    flag_mask : string or dictionary, optional
+        If provided, quality flag mask (see `valid_pixels`); rejected
+        pixels are set to NaN and the number of valid pixels of each beam
+        is returned as n_valid_trip_<beam>.
 
     Returns
     =======
@@ -123,6 +251,8 @@ def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17,
             Geographical longitudes in degrees of the original image.
         grid_lats_orig : array of floats
             Geographical latitudes in degrees of the original image.
+        sigma0_norm_trip_fore, sigma0_norm_trip_mid, sigma0_norm_trip_aft : float
+            Normalized NRCS [dB], only if `norm_model` is provided.
         lons_cropped_image : array of floats
             Geographical longitudes in degrees of the cropeed image.
         lats_cropped_image : array of floats
@@ -130,7 +260,7 @@ def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17,
     """
     
     # Load the image data
-    ascat = xr.open_dataset(ascat_fn)
+    ascat = open_ascat(ascat_fn)
     
     # Fill in dict with parameters from the image
     ascat_params_dict = {}
@@ -147,14 +277,14 @@ def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17,
     
     
     # Get the latitude and the logitude of the nearest grid box in ASCAT to the station
-    ascat_station = ascat.sel(lat=station_lat, lon=station_lon, method='nearest')
-    
-    # Get the indices of the nearest grid box in ASCAT to the station
-    lon_i, lat_i = np.nonzero(
-        xr.where(
-            (ascat.lon==ascat_station.lon.values) & (ascat.lat==ascat_station.lat.values), 1, 0
-        ).data
-    )
+    with timer('ascat.nearest'):
+        ascat_station = ascat.sel(lat=station_lat, lon=station_lon, method='nearest')
+        # Get the indices of the nearest grid box in ASCAT to the station
+        lon_i, lat_i = np.nonzero(
+            xr.where(
+                (ascat.lon==ascat_station.lon.values) & (ascat.lat==ascat_station.lat.values), 1, 0
+            ).data
+        )
     
     # How many grid boxes on each side of the nearest station grid box
     if divmod(nx, 2)==0:
@@ -167,7 +297,10 @@ def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17,
     else:
         ny2 = (ny - 1)/2
 
-    cropped_image = ascat.isel(lat=slice(lat_i[0] - ny2, lat_i[0] + ny2 + 1), lon=slice(lon_i[0] - nx2, lon_i[0] + nx2 + 1))
+    cropped_image = load_window(ascat.isel(
+        lat=slice(int(lat_i[0] - ny2), int(lat_i[0] + ny2 + 1)), 
+        lon=slice(int(lon_i[0] - nx2), int(lon_i[0] + nx2 + 1))
+    ), 'ascat.crop')
     
     ascat_params_dict['lats_cropped_image'] = cropped_image['lat'].values
     ascat_params_dict['lons_cropped_image'] = cropped_image['lon'].values
@@ -180,10 +313,24 @@ def ascat_params_cnn(ascat_fn, station_lon:float, station_lat:float, nx:int=17,
         else:    
             ascat_params_dict[param] = cropped_image[param].values  # Var
 
+    if flag_mask is not None:
+        for beam in BEAMS:
+            valid = valid_pixels(cropped_image, beam, flag_mask)
+            for param in ['sigma0_trip_', 'azi_angle_trip_', 'inc_angle_trip_']:
+                ascat_params_dict[param + beam] = np.where(
+                    valid, ascat_params_dict[param + beam], np.nan)
+            ascat_params_dict['n_valid_trip_' + beam] = int(valid.sum())
+
+    if norm_model is not None:
+        normalize_beams(ascat_params_dict, norm_model)
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
     return ascat_params_dict
 
 
-def ascat_params_mean_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int=17, ny:int=17):
+def ascat_params_mean_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int=17, ny:int=17, norm_model=None, dtype_policy=None, flag_mask=None):
     """ Estimate SAR parameters at given location.
 
     Parameters
@@ -198,6 +345,16 @@ def ascat_params_mean_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int
         Number of pixel in the longitude dimension of the cropped image.
     ny : float
         Number of pixel in the latitude dimension of the cropped image.
+    norm_model : string, optional
+        If provided, name of the incidence angle normalization model in
+        `nrcs_models` (e.g. 'cmod5n') used to add normalized NRCS.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` (e.g. 'float32' or
+        'compact') applied to the returned arrays.
+    flag_mask : string or dictionary, optional
+        If provided, quality flag mask (see `valid_pixels`); the window
+        means and standard deviations of each beam only use the valid
+        pixels, and their number is returned as n_valid_trip_<beam>.
 
     Returns
     =======
@@ -225,6 +382,8 @@ def ascat_params_mean_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int
             Geographical longitudes in degrees of the original image.
         grid_lats_orig : array of floats
             Geographical latitudes in degrees of the original image.
+        sigma0_norm_trip_fore, sigma0_norm_trip_mid, sigma0_norm_trip_aft : float
+            Normalized NRCS [dB], only if `norm_model` is provided.
         lons_cropped_image : array of floats
             Geographical longitudes in degrees of the cropeed image.
         lats_cropped_image : array of floats
@@ -232,7 +391,7 @@ def ascat_params_mean_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int
     """
     
     # Load the image data
-    ascat = xr.open_dataset(ascat_fn)
+    ascat = open_ascat(ascat_fn)
     
     # Fill in dict with parameters from the image
     ascat_params_dict = {}
@@ -248,14 +407,14 @@ def ascat_params_mean_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int
     ]
     
     # Get the latitude and the logitude of the nearest grid box in ASCAT to the station
-    ascat_station = ascat.sel(lat=station_lat, lon=station_lon, method='nearest')
-    
-    # Get the indices of the nearest grid box in ASCAT to the station
-    lon_i, lat_i = np.nonzero(
-        xr.where(
-            (ascat.lon==ascat_station.lon.values) & (ascat.lat==ascat_station.lat.values), 1, 0
-        ).data
-    )
+    with timer('ascat.nearest'):
+        ascat_station = ascat.sel(lat=station_lat, lon=station_lon, method='nearest')
+        # Get the indices of the nearest grid box in ASCAT to the station
+        lon_i, lat_i = np.nonzero(
+            xr.where(
+                (ascat.lon==ascat_station.lon.values) & (ascat.lat==ascat_station.lat.values), 1, 0
+            ).data
+        )
     
     # How many grid boxes on each side of the nearest station grid box
     if divmod(nx, 2)==0:
@@ -268,29 +427,129 @@ def ascat_params_mean_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int
     else:
         ny2 = (ny - 1)/2
 
-    cropped_image = ascat.isel(
+    cropped_image = load_window(ascat.isel(
         lat=slice(int(lat_i[0] - ny2), int(lat_i[0] + ny2 + 1)), 
         lon=slice(int(lon_i[0] - nx2), int(lon_i[0] + nx2 + 1))
-    )
+    ), 'ascat.crop')
     
     ascat_params_dict['lats_cropped_image'] = cropped_image['lat'].values
     ascat_params_dict['lons_cropped_image'] = cropped_image['lon'].values
     
+    if flag_mask is not None:
+        valid = {beam: valid_pixels(cropped_image, beam, flag_mask) for beam in BEAMS}
+
+    def window(param):
+        values = cropped_image[param].values
+        if flag_mask is not None:
+            values = np.where(valid[param.rsplit('_', 1)[1]], values, np.nan)
+        return values
+
     for param in list_of_params:
         if param == 'start_sensing_time':
             ascat_params_dict[param] = cropped_image.start_sensing_time  # Attr
         elif param == 'stop_sensing_time':
             ascat_params_dict[param] = cropped_image.stop_sensing_time  # Attr
         else:    
-            ascat_params_dict[param] = np.nanmean(cropped_image[param].values)  # Var
-    ascat_params_dict['std_sigma0_trip_fore'] = np.std(cropped_image['sigma0_trip_fore'].values)
-    ascat_params_dict['std_sigma0_trip_mid'] = np.std(cropped_image['sigma0_trip_mid'].values)
-    ascat_params_dict['std_sigma0_trip_aft'] = np.std(cropped_image['sigma0_trip_aft'].values)
+            ascat_params_dict[param] = np.nanmean(window(param))  # Var
+    if flag_mask is not None:
+        for beam in BEAMS:
+            ascat_params_dict['std_sigma0_trip_' + beam] = np.nanstd(window('sigma0_trip_' + beam))
+            ascat_params_dict['n_valid_trip_' + beam] = int(valid[beam].sum())
+    else:
+        ascat_params_dict['std_sigma0_trip_fore'] = np.std(cropped_image['sigma0_trip_fore'].values)
+        ascat_params_dict['std_sigma0_trip_mid'] = np.std(cropped_image['sigma0_trip_mid'].values)
+        ascat_params_dict['std_sigma0_trip_aft'] = np.std(cropped_image['sigma0_trip_aft'].values)
+
+    if norm_model is not None:
+        # Normalize each pixel before averaging over the window
+        model = get_normalization_model(norm_model)
+        for beam in BEAMS:
+            ascat_params_dict['sigma0_norm_trip_' + beam] = np.nanmean(model(
+                window('sigma0_trip_' + beam), window('inc_angle_trip_' + beam)))
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
 
     return ascat_params_dict
 
 
-def ascat_params_gradient_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int=17, ny:int=17):
+def ascat_params_multiscale(ascat_fn, station_lon, station_lat, sizes=(3, 5, 7, 9, 15),
+        flag_mask=None, dtype_policy=None):
+    """ Window means and standard deviations of several window sizes
+    around a station, as `ascat_params_mean_nxn` for each size, from one
+    read of the largest window (see `window_stats`).
+
+    Parameters
+    ==========
+    ascat_fn : string
+        Full path to ASCAT dataset.
+    station_lon, station_lat : float
+        Location (in degrees) of the station.
+    sizes : list of ints or (ny, nx) pairs, optional
+        Window sizes in pixels.
+    flag_mask : string or dictionary, optional
+        If provided, quality flag mask (see `valid_pixels`) of the pixels
+        used for each beam.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` applied to the
+        returned arrays.
+
+    Returns
+    =======
+    ascat_params_dict : dictionary with ASCAT data.
+        For each size suffix _<ny>x<nx> and beam:
+        sigma0_trip_<beam>_<ny>x<nx> : float
+            Mean NRCS [dB] of the window.
+        std_sigma0_trip_<beam>_<ny>x<nx> : float
+            Standard deviation of the NRCS [dB] over the valid pixels.
+        inc_angle_trip_<beam>_<ny>x<nx>, azi_angle_trip_<beam>_<ny>x<nx> : float
+            Mean incidence and azimuth angles.
+        n_valid_trip_<beam>_<ny>x<nx> : int
+            Number of valid NRCS pixels.
+        and start_sensing_time, stop_sensing_time, grid_lats_orig and
+        grid_lons_orig.
+    """
+    ascat = open_ascat(ascat_fn)
+
+    ascat_params_dict = {}
+    ascat_params_dict['grid_lats_orig'] = ascat.lat.values
+    ascat_params_dict['grid_lons_orig'] = ascat.lon.values
+    ascat_params_dict['start_sensing_time'] = ascat.start_sensing_time
+    ascat_params_dict['stop_sensing_time'] = ascat.stop_sensing_time
+
+    with timer('ascat.nearest'):
+        row = ascat.indexes['lat'].get_indexer([station_lat], method='nearest')[0]
+        col = ascat.indexes['lon'].get_indexer([station_lon], method='nearest')[0]
+
+    # Read only the region covered by the largest windows
+    shape = (ascat.sizes['lat'], ascat.sizes['lon'])
+    bounds = [window_bounds(shape, row, col, size) for size in sizes]
+    r0, c0 = min(b[0] for b in bounds), min(b[1] for b in bounds)
+    r1, c1 = max(b[2] for b in bounds), max(b[3] for b in bounds)
+    region = load_window(ascat.isel(lat=slice(r0, r1), lon=slice(c0, c1)), 'ascat.crop')
+    row, col = row - r0, col - c0
+
+    for beam in BEAMS:
+        valid = valid_pixels(region, beam, flag_mask or {})
+        stats = window_stats(region['sigma0_trip_' + beam].values, row, col, sizes, valid)
+        for size, (mean, std, count) in stats.items():
+            suffix = size_suffix(size)
+            ascat_params_dict['sigma0_trip_' + beam + suffix] = mean
+            ascat_params_dict['std_sigma0_trip_' + beam + suffix] = std
+            ascat_params_dict['n_valid_trip_' + beam + suffix] = count
+        for param in ['inc_angle_trip_', 'azi_angle_trip_']:
+            stats = window_stats(region[param + beam].values, row, col, sizes,
+                    valid if flag_mask is not None else None)
+            for size, (mean, _, _) in stats.items():
+                ascat_params_dict[param + beam + size_suffix(size)] = mean
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
+    return ascat_params_dict
+
+
+def ascat_params_gradient_nxn(ascat_fn, station_lon:float, station_lat:float, nx:int=17, ny:int=17, dtype_policy=None, flag_mask=None):
     """ Estimate SAR parameters at given location.
 
     Parameters
@@ -305,17 +564,25 @@ def ascat_params_gradient_nxn(ascat_fn, station_lon:float, station_lat:float, nx
         Number of pixel in the longitude dimension of the cropped image.
     ny : float
         Number of pixel in the latitude dimension of the cropped image.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` (e.g. 'float32' or
+        'compact') applied to the returned arrays.
+    flag_mask : string or dictionary, optional
+        If provided, quality flag mask (see `valid_pixels`) of the pixels
+        used in the gradients.
 
     Returns
     =======
     ascat_params_dict : dictionary with ASCAT data.
         The dictionary contains the following keys:
-        sigma0_trip_fore : float
-            NRCS [dB] over the buoy from the fore beam.
-        sigma0_trip_mid : float
-            NRCS [dB] over the buoy from the mid beam.
-        sigma0_trip_aft : float
-            NRCS [dB] over the buoy from the aft beam.    
+        sigma0_trip_fore_x, sigma0_trip_fore_y : float
+            Eastward and northward NRCS gradients [dB/km] of the fore beam,
+            from a least-squares plane fit over the valid pixels of the
+            window (see `gradients.plane_gradients`).
+        sigma0_trip_mid_x, sigma0_trip_mid_y : float
+            NRCS gradients [dB/km] of the mid beam.
+        sigma0_trip_aft_x, sigma0_trip_aft_y : float
+            NRCS gradients [dB/km] of the aft beam.
         inc_angle_trip_fore : float
             Satellite look incidence angle over the buoy from the fore beam.
         inc_angle_trip_mid : float
@@ -339,7 +606,7 @@ def ascat_params_gradient_nxn(ascat_fn, station_lon:float, station_lat:float, nx
     """
     
     # Load the image data
-    ascat = xr.open_dataset(ascat_fn)
+    ascat = open_ascat(ascat_fn)
     
     # Fill in dict with parameters from the image
     ascat_params_dict = {}
@@ -356,14 +623,14 @@ def ascat_params_gradient_nxn(ascat_fn, station_lon:float, station_lat:float, nx
     
     
     # Get the latitude and the logitude of the nearest grid box in ASCAT to the station
-    ascat_station = ascat.sel(lat=station_lat, lon=station_lon, method='nearest')
-    
-    # Get the indices of the nearest grid box in ASCAT to the station
-    lon_i, lat_i = np.nonzero(
-        xr.where(
-            (ascat.lon==ascat_station.lon.values) & (ascat.lat==ascat_station.lat.values), 1, 0
-        ).data
-    )
+    with timer('ascat.nearest'):
+        ascat_station = ascat.sel(lat=station_lat, lon=station_lon, method='nearest')
+        # Get the indices of the nearest grid box in ASCAT to the station
+        lon_i, lat_i = np.nonzero(
+            xr.where(
+                (ascat.lon==ascat_station.lon.values) & (ascat.lat==ascat_station.lat.values), 1, 0
+            ).data
+        )
     
     # How many grid boxes on each side of the nearest station grid box
     if divmod(nx, 2)==0:
@@ -376,30 +643,44 @@ def ascat_params_gradient_nxn(ascat_fn, station_lon:float, station_lat:float, nx
     else:
         ny2 = (ny - 1)/2
 
-    cropped_image = ascat.isel(
+    cropped_image = load_window(ascat.isel(
         lat=slice(int(lat_i[0] - ny2), int(lat_i[0] + ny2 + 1)), 
         lon=slice(int(lon_i[0] - nx2), int(lon_i[0] + nx2 + 1))
-    )
+    ), 'ascat.crop')
     
     ascat_params_dict['lats_cropped_image'] = cropped_image['lat'].values
     ascat_params_dict['lons_cropped_image'] = cropped_image['lon'].values
-    
+
+    # Gradients of the three beams in one batch
+    windows = np.stack([cropped_image['sigma0_trip_' + beam].values for beam in BEAMS])
+    valid = None
+    if flag_mask is not None:
+        valid = np.stack([valid_pixels(cropped_image, beam, flag_mask) for beam in BEAMS])
+    dy, dx = grid_spacing_km(ascat_params_dict['lats_cropped_image'],
+            ascat_params_dict['lons_cropped_image'])
+    with timer('ascat.gradient'):
+        grad_x, grad_y = plane_gradients(windows, dy, dx, valid)
+
     for param in list_of_params:
         if param == 'start_sensing_time':
             ascat_params_dict[param] = cropped_image.start_sensing_time  # Attr
         elif param == 'stop_sensing_time':
             ascat_params_dict[param] = cropped_image.stop_sensing_time  # Attr
         elif (param == 'sigma0_trip_fore') or (param == 'sigma0_trip_mid') or (param == 'sigma0_trip_aft'):
-            ascat_params_dict[param + '_x'] = (cropped_image[param][int(ny2), -1] - cropped_image[param][int(ny2), 0])
-            ascat_params_dict[param + '_y'] = (cropped_image[param][-1, int(nx2)] - cropped_image[param][0, int(nx2)])
+            beam = BEAMS.index(param.rsplit('_', 1)[1])
+            ascat_params_dict[param + '_x'] = float(grad_x[beam])
+            ascat_params_dict[param + '_y'] = float(grad_y[beam])
         else:    
             ascat_params_dict[param] = ascat_station[param].values  # Var
 
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
     return ascat_params_dict
 
 
 
-def ascat_params_extended_list(ascat_fn, station_lon, station_lat):
+def ascat_params_extended_list(ascat_fn, station_lon, station_lat, norm_model=None, dtype_policy=None, flag_mask=None):
     """ Estimate SAR parameters at given location.
 
     Parameters
@@ -410,6 +691,15 @@ def ascat_params_extended_list(ascat_fn, station_lon, station_lat):
         Longitude (in degrees) of the station where ASCAT parameters are retrieved.
     station_lat : float
         Latitue (in degrees) of the station where ASCAT parameters are retrieved.            
+    norm_model : string, optional
+        If provided, name of the incidence angle normalization model in
+        `nrcs_models` (e.g. 'cmod5n') used to add normalized NRCS.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` (e.g. 'float32' or
+        'compact') applied to the returned arrays.
+    flag_mask : string or dictionary, optional
+        If provided, quality flag mask (see `valid_pixels`); valid_trip_<beam>
+        is 1 if the pixel of the beam is accepted, else 0.
         
 
     Returns
@@ -438,10 +728,12 @@ def ascat_params_extended_list(ascat_fn, station_lon, station_lat):
             Geographical longitudes in degrees of the original image.
         grid_lats_orig : array of floats
             Geographical latitudes in degrees of the original image.
+        sigma0_norm_trip_fore, sigma0_norm_trip_mid, sigma0_norm_trip_aft : float
+            Normalized NRCS [dB], only if `norm_model` is provided.
     """
     
     # Load the image data
-    data = xr.open_dataset(ascat_fn)
+    data = open_ascat(ascat_fn)
     
     # Fill in dict with parameters from the image
     ascat_params_dict = {}
@@ -462,7 +754,8 @@ def ascat_params_extended_list(ascat_fn, station_lon, station_lat):
         'f_low_res'
     ]
     
-    data_station = data.sel(lat=station_lat, lon=station_lon,  method='nearest')
+    data_station = load_window(data.sel(lat=station_lat, lon=station_lon, method='nearest'),
+            'ascat.nearest')
     
     for param in list_of_params:
         if param == 'start_sensing_time':
@@ -471,23 +764,38 @@ def ascat_params_extended_list(ascat_fn, station_lon, station_lat):
             ascat_params_dict[param] = data_station.stop_sensing_time  # Attr
         elif param == 'f_low_res':
             ascat_params_dict['f_low_res'] = check_if_low_resolution(data)
-            if check_if_low_resolution(data)==1:
-                print(ascat_fn)
         else:    
             ascat_params_dict[param] = data_station[param].values.item()  # Var
 
+    if flag_mask is not None:
+        for beam in BEAMS:
+            ascat_params_dict['valid_trip_' + beam] = int(valid_pixels(data_station, beam, flag_mask))
+
+    if norm_model is not None:
+        normalize_beams(ascat_params_dict, norm_model)
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
     return ascat_params_dict
 
 
 def check_if_low_resolution(data_ascat):
-    if data_ascat.lat[0] - data_ascat.lat[1] > 2:
-        f_low_res = 1
-    else:
-        f_low_res = 0
-    return f_low_res
+    """ 1 if the latitude spacing of an ASCAT dataset is larger than
+    LOW_RESOLUTION_SPACING, else 0. To screen many files without opening
+    them, see `ascat_index`.
+    """
+    return is_low_resolution(data_ascat.lat.values)
 
 
-def ascat_params_ifs_stress(ascat_fn, station_lon, station_lat):
+def is_low_resolution(lat):
+    """ 1 if the spacing of the latitude vector `lat` is larger than
+    LOW_RESOLUTION_SPACING, else 0.
+    """
+    return int(lat.size > 1 and abs(float(lat[0]) - float(lat[1])) > LOW_RESOLUTION_SPACING)
+
+
+def ascat_params_ifs_stress(ascat_fn, station_lon, station_lat, norm_model=None, dtype_policy=None):
     """ Estimate SAR parameters at given location.
 
     Parameters
@@ -498,6 +806,12 @@ def ascat_params_ifs_stress(ascat_fn, station_lon, station_lat):
         Longitude (in degrees) of the station where ASCAT parameters are retrieved.
     station_lat : float
         Latitue (in degrees) of the station where ASCAT parameters are retrieved.            
+    norm_model : string, optional
+        If provided, name of the incidence angle normalization model in
+        `nrcs_models` (e.g. 'cmod5n') used to add normalized NRCS.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` (e.g. 'float32' or
+        'compact') applied to the returned arrays.
         
 
     Returns
@@ -526,10 +840,12 @@ def ascat_params_ifs_stress(ascat_fn, station_lon, station_lat):
             Geographical longitudes in degrees of the original image.
         grid_lats_orig : array of floats
             Geographical latitudes in degrees of the original image.
+        sigma0_norm_trip_fore, sigma0_norm_trip_mid, sigma0_norm_trip_aft : float
+            Normalized NRCS [dB], only if `norm_model` is provided.
     """
     
     # Load the image data
-    data = xr.open_dataset(ascat_fn)
+    data = open_ascat(ascat_fn)
     
     # Fill in dict with parameters from the image
     ascat_params_dict = {}
@@ -550,7 +866,8 @@ def ascat_params_ifs_stress(ascat_fn, station_lon, station_lat):
         'f_low_res'
     ]
     
-    data_station = data.sel(lat=station_lat, lon=station_lon,  method='nearest')
+    data_station = load_window(data.sel(lat=station_lat, lon=station_lon, method='nearest'),
+            'ascat.nearest')
     
     for param in list_of_params:
         if param == 'start_sensing_time':
@@ -559,9 +876,13 @@ def ascat_params_ifs_stress(ascat_fn, station_lon, station_lat):
             ascat_params_dict[param] = data_station.stop_sensing_time  # Attr
         elif param == 'f_low_res':
             ascat_params_dict['f_low_res'] = check_if_low_resolution(data)
-            if check_if_low_resolution(data)==1:
-                print(ascat_fn)
         else:    
             ascat_params_dict[param] = data_station[param].values.item()  # Var
 
+    if norm_model is not None:
+        normalize_beams(ascat_params_dict, norm_model)
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
     return ascat_params_dict
\ No newline at end of file
@@ -0,0 +1,207 @@
+""" Metadata index of ASCAT products for screening before extraction.
+
+The index has one row per NetCDF file with the grid shape, the grid
+spacing, the low resolution flag (see `ascat.check_if_low_resolution`),
+the bounding box of the grid and the sensing times. Products in swath
+geometry (see `ascat_swath`) are flagged as 'swath'; their shape is the
+number of rows and cells, and the spacing is that of the nodes along the
+first cell and row. Only the coordinate
+variables and the global attributes are read, and the files are scanned
+in parallel; rebuilding an existing index only scans new or modified
+files.
+
+    index = build_index(data_dir, index_file=data_dir + 'ascat_index.csv')
+    files = select_files(index, station_lon, station_lat)
+"""
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+from ascat import is_low_resolution
+from ascat_swath import as_swath, is_swath
+from streaming import netcdf_lock, prefetch_map
+
+COLUMNS = [
+    'filename', 'size', 'mtime', 'swath', 'n_lat', 'n_lon', 'lat_spacing', 'lon_spacing',
+    'low_resolution', 'lat_min', 'lat_max', 'lon_min', 'lon_max',
+    'start_sensing_time', 'stop_sensing_time', 'error',
+]
+
+
+def _read_coordinates(path):
+    """ Latitudes, longitudes and global attributes of a product, and
+    whether it is in swath geometry.
+    """
+    if netCDF4 is not None:
+        with netcdf_lock, netCDF4.Dataset(path) as ds:
+            if not is_swath(ds.dimensions):
+                attrs = {name: ds.getncattr(name) for name in ds.ncattrs()}
+                return (np.asarray(ds['lat'][:], dtype=float),
+                        np.asarray(ds['lon'][:], dtype=float), attrs, False)
+    import xarray as xr
+    with netcdf_lock, xr.open_dataset(path) as ds:
+        swath = is_swath(ds.dims)
+        if swath:
+            # Longitudes in [-180, 180) and the sensing times of the rows
+            ds = as_swath(ds)
+        return ds['lat'].values.astype(float), ds['lon'].values.astype(float), dict(ds.attrs), swath
+
+
+def scan_file(path):
+    """ Metadata of one ASCAT file, a dictionary with the keys in
+    `COLUMNS`. Files that cannot be read have an 'error'.
+    """
+    st = os.stat(path)
+    row = dict.fromkeys(COLUMNS)
+    row.update(filename=os.path.abspath(path), size=st.st_size, mtime=st.st_mtime)
+    try:
+        lat, lon, attrs, swath = _read_coordinates(path)
+    except Exception as error:
+        row['error'] = '%s: %s' % (type(error).__name__, error)
+        return row
+    # Nodes along the first cell and row of a swath
+    lats, lons = (lat[:, 0], lon[0, :]) if swath else (lat, lon)
+    row.update(
+        swath=int(swath), n_lat=lats.size, n_lon=lons.size,
+        lat_spacing=float(np.abs(np.diff(lats)).mean()) if lats.size > 1 else np.nan,
+        lon_spacing=float(np.abs(np.diff(lons)).mean()) if lons.size > 1 else np.nan,
+        low_resolution=is_low_resolution(lats),
+        lat_min=float(np.nanmin(lat)), lat_max=float(np.nanmax(lat)),
+        lon_min=float(np.nanmin(lon)), lon_max=float(np.nanmax(lon)),
+        start_sensing_time=attrs.get('start_sensing_time'),
+        stop_sensing_time=attrs.get('stop_sensing_time'))
+    return row
+
+
+def read_index(index_file):
+    """ Read an index written by `build_index`. """
+    if index_file.endswith('.parquet'):
+        index = pd.read_parquet(index_file)
+    else:
+        index = pd.read_csv(index_file, dtype={'error': object})
+    if 'swath' not in index:
+        # Index written before swath products were indexed
+        index.insert(COLUMNS.index('swath'), 'swath', 0)
+    for column in ['start_sensing_time', 'stop_sensing_time']:
+        index[column] = pd.to_datetime(index[column], utc=True)
+    return index
+
+
+def write_index(index, index_file):
+    """ Write an index as CSV, or Parquet if `index_file` ends with
+    .parquet.
+    """
+    if index_file.endswith('.parquet'):
+        index.to_parquet(index_file, index=False)
+    else:
+        index.to_csv(index_file, index=False)
+    return index_file
+
+
+def build_index(paths, pattern='*.nc', index_file=None, workers=8, executor='process'):
+    """ Scan ASCAT files into an index table.
+
+    Parameters
+    ==========
+    paths : string or list of strings
+        Directory (searched with `pattern`) or list of files.
+    pattern : string, optional
+        Glob pattern of the files in a directory.
+    index_file : string, optional
+        If given, the existing index is updated (only new or modified
+        files are scanned, removed files are dropped) and written back.
+    workers : int, optional
+        Number of files scanned in parallel.
+    executor : string, optional
+        'process' (default) or 'thread', see `streaming.prefetch_map`.
+        Threads read the files one at a time.
+
+    Returns
+    =======
+    index : pandas DataFrame
+        One row per file with the columns in `COLUMNS`.
+    """
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(os.path.join(paths, pattern)))
+    paths = [os.path.abspath(path) for path in paths]
+
+    known = pd.DataFrame(columns=COLUMNS)
+    if index_file is not None and os.path.exists(index_file):
+        known = read_index(index_file)
+        known = known[known['filename'].isin(paths)]
+        st = {path: os.stat(path) for path in known['filename']}
+        unchanged = np.array([st[f].st_size == size and st[f].st_mtime == mtime
+                for f, size, mtime in zip(known['filename'], known['size'], known['mtime'])],
+                dtype=bool)
+        known = known[unchanged]
+    todo = [path for path in paths if path not in set(known['filename'])]
+
+    rows = [row for _, row in prefetch_map(scan_file, todo, workers=workers,
+            executor=executor, ordered=False)]
+    scanned = pd.DataFrame(rows, columns=COLUMNS)
+    for column in ['start_sensing_time', 'stop_sensing_time']:
+        scanned[column] = pd.to_datetime(scanned[column], utc=True)
+    frames = [frame for frame in [known, scanned] if len(frame)]
+    index = pd.concat(frames, ignore_index=True) if frames else scanned
+    index = index.sort_values('filename').reset_index(drop=True)
+    if index_file is not None:
+        write_index(index, index_file)
+    return index
+
+
+def covers(index, station_lon, station_lat, margin=0.):
+    """ Boolean Series, True for the files whose grid contains the station
+    (within `margin` degrees). The swath only covers a part of the grid,
+    so the station may still be outside the swath.
+    """
+    return ((index['lat_min'] - margin <= station_lat) & (station_lat <= index['lat_max'] + margin)
+            & (index['lon_min'] - margin <= station_lon) & (station_lon <= index['lon_max'] + margin))
+
+
+def select_files(index, station_lon, station_lat, start=None, end=None,
+        allow_low_resolution=False, margin=0.):
+    """ Files of the index that cover the station, are not low resolution
+    (unless `allow_low_resolution`) and were sensed between `start` and
+    `end` (if given).
+
+    Returns
+    =======
+    filenames : list of strings
+    """
+    mask = index['error'].isna() & covers(index, station_lon, station_lat, margin)
+    if not allow_low_resolution:
+        mask &= index['low_resolution'] == 0
+    if start is not None:
+        mask &= index['stop_sensing_time'] >= pd.Timestamp(start, tz='UTC')
+    if end is not None:
+        mask &= index['start_sensing_time'] <= pd.Timestamp(end, tz='UTC')
+    return list(index.loc[mask, 'filename'])
+
+
+def filter_tasks(tasks, index, allow_low_resolution=False, margin=0.):
+    """ Drop tasks (see `streaming.Task`) whose file is low resolution,
+    unreadable or does not cover the buoy. Files missing from the index
+    are kept.
+    """
+    rows = index.set_index('filename')
+    for task in tasks:
+        filename = os.path.abspath(task.filename)
+        if filename not in rows.index:
+            yield task
+            continue
+        row = rows.loc[filename]
+        if isinstance(row.get('error'), str):
+            continue
+        if not allow_low_resolution and row['low_resolution']:
+            continue
+        if not (row['lat_min'] - margin <= task.lat <= row['lat_max'] + margin
+                and row['lon_min'] - margin <= task.lon <= row['lon_max'] + margin):
+            continue
+        yield task
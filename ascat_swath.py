@@ -0,0 +1,374 @@
+""" ASCAT level 1 SZR products in swath geometry.
+
+The products are read as delivered by EUMETSAT, without the Data Tailor
+reprojection to a geographic grid: either the EUMETSAT NetCDF layout
+(dimensions numRows, numCells and numSigma) or the Data Tailor 'netcdf4'
+output without projection (dimensions y and x, per beam variables). Both
+are normalized by `open_swath` to per beam variables such as
+sigma0_trip_fore on the dimensions (row, cell), as in the gridded
+products read by `ascat`.
+
+Stations are located with a KD-tree of the swath nodes, which is kept
+for the most recently used files, so that extracting many stations from
+the same product builds it once. Windows are extracted either in swath
+geometry (`ascat_swath_params_cnn`) or resampled to a local geographic
+grid with nearest neighbours (`ascat_swath_params_resampled`), in the
+layout of `ascat.ascat_params_cnn`; the neighbour indices of each grid
+are cached with the KD-tree.
+"""
+import collections
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.spatial import cKDTree
+
+from ascat import BEAMS, normalize_beams, valid_pixels
+from dtype_policy import apply_dtype_policy
+from gradients import EARTH_RADIUS_KM
+from instrumentation import record_open, record_read, timer
+
+# Distance [km] from the nearest node beyond which a location is outside
+# the swath (the SZR nodes are 12.5 km apart)
+MAX_DISTANCE_KM = 12.5
+
+# Number of files whose KD-tree is kept
+MAX_LOCATORS = 8
+
+PARAMS = ['sigma0_trip_', 'azi_angle_trip_', 'inc_angle_trip_']
+
+# Dimensions of the swath layouts (EUMETSAT NetCDF, Data Tailor output
+# without projection, `as_swath`); the gridded products have lat and lon
+SWATH_DIMS = {'numRows', 'numCells', 'numSigma', 'y', 'x', 'row', 'cell'}
+
+_locators = collections.OrderedDict()
+_swath_files = {}
+
+
+def is_swath(dims):
+    """ True for the dimensions (names) of an ASCAT product in swath
+    geometry.
+    """
+    return bool(SWATH_DIMS.intersection(dims))
+
+
+def is_swath_file(ascat_fn):
+    """ True if an ASCAT product is in swath geometry. Only the dimensions
+    are read, and the result is kept for each file.
+    """
+    st = os.stat(ascat_fn)
+    key = (os.path.realpath(ascat_fn), st.st_size, st.st_mtime_ns)
+    if key not in _swath_files:
+        with xr.open_dataset(ascat_fn) as ds:
+            _swath_files[key] = is_swath(ds.dims)
+    return _swath_files[key]
+
+
+def as_swath(ds):
+    """ Normalize an ASCAT swath dataset: per beam variables on the
+    dimensions (row, cell), 2D lat and lon coordinates with longitudes in
+    [-180, 180), and start_sensing_time and stop_sensing_time attributes.
+    """
+    if 'numSigma' in ds.dims:
+        data_vars = {}
+        for name, var in ds.data_vars.items():
+            if 'numSigma' in var.dims:
+                for i, beam in enumerate(BEAMS):
+                    data_vars['%s_%s' % (name, beam)] = var.isel(numSigma=i, drop=True)
+            else:
+                data_vars[name] = var
+        ds = xr.Dataset(data_vars, attrs=ds.attrs).rename({'numRows': 'row', 'numCells': 'cell'})
+    else:
+        ds = ds.rename({'y': 'row', 'x': 'cell', 'latitude': 'lat', 'longitude': 'lon'})
+    ds = ds.assign_coords(lon=(ds.lon + 180.) % 360. - 180.)
+    if 'start_sensing_time' not in ds.attrs and 'utc_line_nodes' in ds:
+        times = pd.to_datetime(ds['utc_line_nodes'].values)
+        ds.attrs['start_sensing_time'] = times.min().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        ds.attrs['stop_sensing_time'] = times.max().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return ds
+
+
+def open_swath(ascat_fn):
+    """ Open an ASCAT swath product (see `as_swath`), recording the
+    opening time and file size (see `instrumentation`).
+    """
+    record_open(ascat_fn)
+    with timer('ascat_swath.open_dataset'):
+        return as_swath(xr.open_dataset(ascat_fn))
+
+
+def _xyz(lons, lats):
+    lons, lats = np.deg2rad(lons), np.deg2rad(lats)
+    return np.stack([np.cos(lats)*np.cos(lons), np.cos(lats)*np.sin(lons), np.sin(lats)], axis=-1)
+
+
+class SwathLocator:
+    """ Nearest swath nodes of geographical locations.
+
+    Parameters
+    ==========
+    lons, lats : 2D arrays of floats
+        Geolocation of the swath nodes [degrees], NaN for missing nodes.
+    """
+
+    def __init__(self, lons, lats):
+        lons, lats = np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)
+        self.shape = lats.shape
+        valid = (np.isfinite(lons) & np.isfinite(lats)).ravel()
+        self.nodes = np.flatnonzero(valid)
+        self.tree = cKDTree(_xyz(lons.ravel()[valid], lats.ravel()[valid]))
+        self._neighbours = {}
+
+    def query(self, lons, lats, max_distance=MAX_DISTANCE_KM):
+        """ Nearest nodes.
+
+        Returns
+        =======
+        index : array of ints
+            Flat index of the nearest node in the swath, -1 for locations
+            farther than `max_distance` [km] from any node.
+        distance : array of floats
+            Distance to the nearest node [km].
+        """
+        chord, i = self.tree.query(_xyz(lons, lats))
+        distance = 2*EARTH_RADIUS_KM*np.arcsin(np.minimum(chord/2, 1.))
+        index = np.where(distance <= max_distance, self.nodes[np.minimum(i, self.nodes.size - 1)], -1)
+        return index, distance
+
+    def locate(self, lon, lat, max_distance=MAX_DISTANCE_KM):
+        """ Row and cell of the node nearest to a station, or None if the
+        station is outside the swath.
+        """
+        index, _ = self.query(lon, lat, max_distance)
+        if index < 0:
+            return None
+        return np.unravel_index(int(index), self.shape)
+
+    def neighbours(self, grid_lons, grid_lats, max_distance=MAX_DISTANCE_KM):
+        """ Nearest nodes of the pixels of a 2D grid, see `query`. The
+        result is cached for each grid.
+        """
+        grid_lons, grid_lats = np.asarray(grid_lons, dtype=float), np.asarray(grid_lats, dtype=float)
+        key = hashlib.sha1(grid_lons.tobytes() + grid_lats.tobytes()
+                + np.float64(max_distance).tobytes()).hexdigest()
+        if key not in self._neighbours:
+            self._neighbours[key] = self.query(grid_lons, grid_lats, max_distance)[0]
+        return self._neighbours[key]
+
+
+def swath_locator(ascat_fn, swath=None):
+    """ `SwathLocator` of a product, kept for the MAX_LOCATORS most
+    recently used files.
+    """
+    st = os.stat(ascat_fn)
+    key = (os.path.realpath(ascat_fn), st.st_size, st.st_mtime_ns)
+    if key in _locators:
+        _locators.move_to_end(key)
+        return _locators[key]
+    swath = swath if swath is not None else open_swath(ascat_fn)
+    with timer('ascat_swath.kdtree'):
+        locator = SwathLocator(swath.lon.values, swath.lat.values)
+    _locators[key] = locator
+    while len(_locators) > MAX_LOCATORS:
+        _locators.popitem(last=False)
+    return locator
+
+
+def _sensing_times(ascat_params_dict, swath):
+    ascat_params_dict['start_sensing_time'] = swath.attrs.get('start_sensing_time')
+    ascat_params_dict['stop_sensing_time'] = swath.attrs.get('stop_sensing_time')
+
+
+def ascat_swath_params(ascat_fn, station_lon, station_lat, norm_model=None, dtype_policy=None,
+        max_distance=MAX_DISTANCE_KM):
+    """ ASCAT parameters of the swath node nearest to a station, as
+    `ascat.ascat_params`.
+
+    Parameters
+    ==========
+    ascat_fn : string
+        Full path to ASCAT swath product.
+    station_lon, station_lat : float
+        Location (in degrees) of the station.
+    norm_model : string, optional
+        If provided, name of the incidence angle normalization model in
+        `nrcs_models` used to add normalized NRCS.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` applied to the
+        returned arrays.
+    max_distance : float, optional
+        Maximum distance [km] between the station and the node.
+
+    Returns
+    =======
+    ascat_params_dict : dictionary with ASCAT data, or None
+        None if the station is outside the swath, else the keys of
+        `ascat.ascat_params` (without the geolocation grids), and
+        row, cell : int
+            Index of the node.
+        node_lon, node_lat : float
+            Location of the node [degrees].
+    """
+    swath = open_swath(ascat_fn)
+    locator = swath_locator(ascat_fn, swath)
+    with timer('ascat_swath.nearest'):
+        node = locator.locate(station_lon, station_lat, max_distance)
+    if node is None:
+        return None
+    row, cell = node
+
+    ascat_params_dict = {'row': int(row), 'cell': int(cell)}
+    station = swath.isel(row=row, cell=cell)
+    ascat_params_dict['node_lon'] = float(station.lon)
+    ascat_params_dict['node_lat'] = float(station.lat)
+    for param in PARAMS:
+        for beam in BEAMS:
+            ascat_params_dict[param + beam] = station[param + beam].values.item()
+    _sensing_times(ascat_params_dict, swath)
+
+    if norm_model is not None:
+        normalize_beams(ascat_params_dict, norm_model)
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
+    return ascat_params_dict
+
+
+def ascat_swath_params_cnn(ascat_fn, station_lon, station_lat, nx=17, ny=17, norm_model=None,
+        dtype_policy=None, flag_mask=None, max_distance=MAX_DISTANCE_KM):
+    """ Window of (ny rows, nx cells) in swath geometry around the node
+    nearest to a station. Nodes outside the product or on the other side
+    of the ground track are NaN.
+
+    Parameters
+    ==========
+    ascat_fn, station_lon, station_lat, norm_model, dtype_policy, max_distance :
+        See `ascat_swath_params`.
+    nx, ny : int, optional
+        Number of cells and rows of the window.
+    flag_mask : string or dictionary, optional
+        If provided, quality flag mask (see `ascat.valid_pixels`);
+        rejected pixels are set to NaN and the number of valid pixels of
+        each beam is returned as n_valid_trip_<beam>.
+
+    Returns
+    =======
+    ascat_params_dict : dictionary with ASCAT data, or None
+        None if the station is outside the swath, else the keys of
+        `ascat.ascat_params_cnn` (without the geolocation grids of the
+        product) with (ny, nx) arrays, lons_cropped_image and
+        lats_cropped_image being the 2D geolocation of the window, and
+        row, cell of the centre node.
+    """
+    swath = open_swath(ascat_fn)
+    locator = swath_locator(ascat_fn, swath)
+    with timer('ascat_swath.nearest'):
+        node = locator.locate(station_lon, station_lat, max_distance)
+    if node is None:
+        return None
+    row, cell = node
+
+    # Window clipped to the product, then padded back to (ny, nx)
+    r0, c0 = row - (ny - 1)//2, cell - (nx - 1)//2
+    r1, c1 = r0 + ny, c0 + nx
+    with timer('ascat_swath.crop'):
+        window = swath.isel(row=slice(max(r0, 0), r1), cell=slice(max(c0, 0), c1)).load()
+        record_read(window.nbytes)
+        window = window.pad(row=(max(-r0, 0), max(r1 - swath.sizes['row'], 0)),
+                cell=(max(-c0, 0), max(c1 - swath.sizes['cell'], 0)))
+    same_side = np.ones((ny, nx), dtype=bool)
+    if 'swath_indicator' in swath:
+        same_side = window['swath_indicator'].values == swath['swath_indicator'].values[row, cell]
+
+    ascat_params_dict = {'row': int(row), 'cell': int(cell)}
+    ascat_params_dict['lats_cropped_image'] = np.where(same_side, window['lat'].values, np.nan)
+    ascat_params_dict['lons_cropped_image'] = np.where(same_side, window['lon'].values, np.nan)
+    for beam in BEAMS:
+        valid = same_side
+        if flag_mask is not None:
+            valid = valid & valid_pixels(window, beam, flag_mask)
+            ascat_params_dict['n_valid_trip_' + beam] = int(
+                (valid & np.isfinite(window['sigma0_trip_' + beam].values)).sum())
+        for param in PARAMS:
+            ascat_params_dict[param + beam] = np.where(valid, window[param + beam].values, np.nan)
+    _sensing_times(ascat_params_dict, swath)
+
+    if norm_model is not None:
+        normalize_beams(ascat_params_dict, norm_model)
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
+    return ascat_params_dict
+
+
+def ascat_swath_params_resampled(ascat_fn, station_lon, station_lat, nx=17, ny=17,
+        resolution=0.125, norm_model=None, dtype_policy=None, flag_mask=None,
+        max_distance=MAX_DISTANCE_KM):
+    """ Window of a swath product resampled to a local geographic grid
+    around a station, in the layout of `ascat.ascat_params_cnn`: (ny, nx)
+    arrays on descending latitudes and ascending longitudes, centred on
+    the station.
+
+    Each grid pixel takes the value of the nearest swath node, or NaN if
+    no node is within `max_distance` [km]. The neighbours of each grid
+    are computed once per product.
+
+    Parameters
+    ==========
+    ascat_fn, station_lon, station_lat, norm_model, dtype_policy, max_distance :
+        See `ascat_swath_params`.
+    nx, ny : int, optional
+        Number of longitudes and latitudes of the grid.
+    resolution : float, optional
+        Grid spacing [degrees].
+    flag_mask : string or dictionary, optional
+        See `ascat_swath_params_cnn`.
+
+    Returns
+    =======
+    ascat_params_dict : dictionary with ASCAT data, or None
+        None if the station is outside the swath, else the keys of
+        `ascat.ascat_params_cnn` without the geolocation grids of the
+        product; lons_cropped_image and lats_cropped_image are the 1D
+        coordinates of the grid.
+    """
+    swath = open_swath(ascat_fn)
+    locator = swath_locator(ascat_fn, swath)
+    if locator.locate(station_lon, station_lat, max_distance) is None:
+        return None
+
+    lats = station_lat - resolution*(np.arange(ny) - (ny - 1)/2)
+    lons = station_lon + resolution*(np.arange(nx) - (nx - 1)/2)
+    grid_lons, grid_lats = np.meshgrid(lons, lats)
+    with timer('ascat_swath.neighbours'):
+        index = locator.neighbours(grid_lons, grid_lats, max_distance)
+    found = index >= 0
+    rows, cells = np.unravel_index(np.where(found, index, 0), locator.shape)
+
+    ascat_params_dict = {'lats_cropped_image': lats, 'lons_cropped_image': lons}
+    with timer('ascat_swath.resample'):
+        pixels = swath.isel(row=xr.DataArray(rows, dims=('lat', 'lon')),
+                cell=xr.DataArray(cells, dims=('lat', 'lon'))).load()
+    record_read(pixels.nbytes)
+    for beam in BEAMS:
+        valid = found
+        if flag_mask is not None:
+            valid = valid & valid_pixels(pixels, beam, flag_mask)
+        for param in PARAMS:
+            ascat_params_dict[param + beam] = np.where(valid, pixels[param + beam].values, np.nan)
+        if flag_mask is not None:
+            ascat_params_dict['n_valid_trip_' + beam] = int(
+                    np.isfinite(ascat_params_dict['sigma0_trip_' + beam]).sum())
+    _sensing_times(ascat_params_dict, swath)
+
+    if norm_model is not None:
+        normalize_beams(ascat_params_dict, norm_model)
+
+    if dtype_policy is not None:
+        apply_dtype_policy(ascat_params_dict, dtype_policy, station_lon, station_lat)
+
+    return ascat_params_dict
@@ -0,0 +1,366 @@
+""" Memory-mapped store of fixed-size crops for training data loaders.
+
+The collocated pickles keep every crop as a separate array (SAR crops) or
+as one column per pixel (ASCAT crops in the collocated DataFrames), and
+have to be loaded entirely before building tensors. A crop store keeps
+all crops of one window size in contiguous arrays, one .npy file per
+field, with a table of scalar features and targets alongside:
+
+    <store_dir>/<field>.npy        (n_crops, ny, nx)
+    <store_dir>/crops.parquet      one row per crop (crops.csv without
+                                   pyarrow or fastparquet)
+
+`CropStore` memory-maps the arrays, so that opening a store is instant
+and batches are read from disk when sliced. The scene directories
+written by `sar_tiling.tile_scene` (with patches.csv) can be opened with
+`CropStore` as well.
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from dtype_policy import ANGLE_PREFIXES, decode_angles
+
+TABLE_NAMES = ['crops.parquet', 'crops.csv', 'patches.csv']
+
+# Bytes copied at a time when the .npy files are finalized
+COPY_BUFFER = 16*1024*1024
+
+
+def _parquet_engine():
+    for engine in ['pyarrow', 'fastparquet']:
+        try:
+            __import__(engine)
+            return engine
+        except ImportError:
+            pass
+    return None
+
+
+def write_table(table, store_dir):
+    """ Write the table of a crop store as Parquet, or CSV if no Parquet
+    engine is installed. Returns the path of the written file.
+    """
+    if _parquet_engine() is not None:
+        path = os.path.join(store_dir, 'crops.parquet')
+        table.to_parquet(path, index=False)
+    else:
+        path = os.path.join(store_dir, 'crops.csv')
+        table.to_csv(path, index=False)
+    return path
+
+
+def read_table(store_dir):
+    """ Table of a crop store, see `TABLE_NAMES`. """
+    for name in TABLE_NAMES:
+        path = os.path.join(store_dir, name)
+        if os.path.exists(path):
+            if name.endswith('.parquet'):
+                return pd.read_parquet(path)
+            return pd.read_csv(path)
+    raise FileNotFoundError('No crop table in %s' % store_dir)
+
+
+class CropStoreWriter:
+    """ Writer of a crop store, one crop at a time, without keeping the
+    crops in memory.
+
+    The crops are appended to raw files, which are turned into .npy files
+    by `close`.
+
+    Parameters
+    ==========
+    store_dir : string
+        Directory of the store, created if needed.
+    shape : tuple of ints
+        Shape (ny, nx) of the crops.
+    fields : list of strings
+        Names of the array fields.
+    dtype : numpy dtype, optional
+        Data type of the stored arrays (float32 by default).
+    """
+
+    def __init__(self, store_dir, shape, fields, dtype=np.float32):
+        self.store_dir = store_dir
+        self.shape = tuple(shape)
+        self.fields = list(fields)
+        self.dtype = np.dtype(dtype)
+        self.rows = []
+        os.makedirs(store_dir, exist_ok=True)
+        self._files = {field: open(self._raw_path(field), 'wb') for field in self.fields}
+
+    def _raw_path(self, field):
+        return os.path.join(self.store_dir, field + '.raw')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, arrays, row=None):
+        """ Append a crop.
+
+        Parameters
+        ==========
+        arrays : dictionary
+            Field name -> array of shape `shape`, for all fields.
+        row : dictionary, optional
+            Scalar features and targets of the crop.
+
+        Returns
+        =======
+        appended : bool
+            False, and nothing is written, if an array has the wrong
+            shape (e.g. crops at the edge of an image).
+        """
+        values = {}
+        for field in self.fields:
+            value = np.asarray(arrays[field], dtype=self.dtype)
+            if value.shape != self.shape:
+                return False
+            values[field] = value
+        for field, value in values.items():
+            self._files[field].write(np.ascontiguousarray(value).tobytes())
+        self.rows.append(dict(row or {}))
+        return True
+
+    def close(self):
+        """ Write the .npy files and the table.
+
+        Returns
+        =======
+        table : pandas DataFrame
+        """
+        n = len(self.rows)
+        for field, f in self._files.items():
+            f.close()
+            header = {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                    'fortran_order': False, 'shape': (n,) + self.shape}
+            with open(os.path.join(self.store_dir, field + '.npy'), 'wb') as dst, \
+                    open(self._raw_path(field), 'rb') as src:
+                np.lib.format.write_array_header_1_0(dst, header)
+                shutil.copyfileobj(src, dst, COPY_BUFFER)
+            os.remove(self._raw_path(field))
+        self._files = {}
+        table = pd.DataFrame(self.rows)
+        table.insert(0, 'index', np.arange(n))
+        write_table(table, self.store_dir)
+        return table
+
+    def abort(self):
+        """ Remove the raw files of an unfinished store. """
+        for field, f in self._files.items():
+            f.close()
+            os.remove(self._raw_path(field))
+        self._files = {}
+
+
+def _scalar_items(params):
+    for key, value in params.items():
+        if np.ndim(value) == 0 and value is not None:
+            yield key, value.item() if isinstance(value, np.generic) else value
+
+
+def _decoded_fields(params, fields):
+    """ Fields of an extraction result, with the angles encoded as int16
+    by the 'compact' dtype policy decoded to degrees.
+    """
+    arrays = {}
+    for field in fields:
+        value = params[field]
+        if field.startswith(ANGLE_PREFIXES) and np.asarray(value).dtype == np.int16:
+            value = decode_angles(value)
+        arrays[field] = value
+    return arrays
+
+
+def export_sar_crops(in_situ_obs, store_dir, size, fields=('s0', 's0_norm', 'inc', 'az'),
+        dtype=np.float32):
+    """ Export the SAR crops of one size in the collocated dictionary
+    filled by crop_sar.py to a crop store.
+
+    Parameters
+    ==========
+    in_situ_obs : dictionary
+        buoy -> {'lat', 'lon', 'products': product -> {'filename',
+        'sar_params': str(size) -> dictionary from `sar.sar_params_dict`}}.
+        Angles encoded by the 'compact' dtype policy are stored in
+        degrees.
+    store_dir : string
+    size : int
+        Crop size in pixels.
+    fields : sequence of strings, optional
+        Array keys of the SAR parameter dictionaries to store.
+    dtype : numpy dtype, optional
+
+    Returns
+    =======
+    table : pandas DataFrame
+        One row per stored crop, with the buoy, product, file name and
+        the scalar values of the parameter dictionaries (e.g. pol).
+    """
+    with CropStoreWriter(store_dir, (size, size), fields, dtype) as writer:
+        for buoy, obs in in_situ_obs.items():
+            for product, product_dict in obs['products'].items():
+                params = product_dict.get('sar_params', {}).get(str(size))
+                if not params or any(params.get(field) is None for field in fields):
+                    continue
+                row = {'buoy': buoy, 'product': str(product),
+                        'filename': product_dict.get('filename')}
+                row.update(_scalar_items(params))
+                writer.append(_decoded_fields(params, fields), row)
+    return read_table(store_dir)
+
+
+def pixel_columns(param, nx, ny):
+    """ Names of the per-pixel columns of a flattened crop,
+    <param>_<pixel> with the pixels in row-major order.
+    """
+    return ['%s_%d' % (param, i) for i in range(nx*ny)]
+
+
+def export_dataframe(df, store_dir, fields, nx, ny, columns=None, dtype=np.float32,
+        chunk_rows=10000):
+    """ Export crops flattened to one column per pixel (as in the
+    collocated ASCAT DataFrames) to a crop store.
+
+    Parameters
+    ==========
+    df : pandas DataFrame or dictionary of DataFrames
+        Collocated data, e.g. buoy -> DataFrame. Dictionaries are
+        exported with an additional 'buoy' column.
+    store_dir : string
+    fields : list of strings
+        Names of the parameters with the columns <field>_0 to
+        <field>_<nx*ny - 1>.
+    nx, ny : int
+        Crop size.
+    columns : list of strings, optional
+        Scalar columns to keep in the table (features and targets). By
+        default all columns that are not pixel columns.
+    dtype : numpy dtype, optional
+    chunk_rows : int, optional
+        Number of rows converted at a time.
+
+    Returns
+    =======
+    table : pandas DataFrame
+    """
+    if isinstance(df, dict):
+        frames = [(key, value) for key, value in df.items()]
+    else:
+        frames = [(None, df)]
+    pixel = {field: pixel_columns(field, nx, ny) for field in fields}
+    all_pixels = set(c for cols in pixel.values() for c in cols)
+
+    with CropStoreWriter(store_dir, (ny, nx), fields, dtype) as writer:
+        for key, frame in frames:
+            scalar = columns if columns is not None else [
+                    c for c in frame.columns if c not in all_pixels]
+            for start in range(0, len(frame), chunk_rows):
+                chunk = frame.iloc[start:start + chunk_rows]
+                values = {field: chunk[pixel[field]].to_numpy(dtype=dtype).reshape(-1, ny, nx)
+                        for field in fields}
+                rows = chunk[scalar].to_dict('records')
+                for i, row in enumerate(rows):
+                    if key is not None:
+                        row = dict(buoy=key, **row)
+                    writer.append({field: values[field][i] for field in fields}, row)
+    return read_table(store_dir)
+
+
+class CropStore:
+    """ Memory-mapped crop store.
+
+    Parameters
+    ==========
+    store_dir : string
+        Directory with the <field>.npy files and the crop table.
+    fields : list of strings, optional
+        Fields to open, all .npy files by default.
+
+    Attributes
+    ==========
+    arrays : dictionary
+        Field name -> read-only memory-mapped array (n_crops, ny, nx).
+    table : pandas DataFrame
+        Scalar features and targets, one row per crop.
+    """
+
+    def __init__(self, store_dir, fields=None):
+        self.store_dir = store_dir
+        if fields is None:
+            fields = sorted(name[:-4] for name in os.listdir(store_dir) if name.endswith('.npy'))
+        self.arrays = {field: np.load(os.path.join(store_dir, field + '.npy'), mmap_mode='r')
+                for field in fields}
+        self.table = read_table(store_dir)
+        lengths = set(len(array) for array in self.arrays.values())
+        if len(lengths) > 1 or (lengths and lengths.pop() != len(self.table)):
+            raise ValueError('Inconsistent number of crops in %s' % store_dir)
+
+    def __len__(self):
+        return len(self.table)
+
+    def batch(self, index, fields=None):
+        """ Crops of the given index.
+
+        Parameters
+        ==========
+        index : slice or array of ints
+            Slices return views of the memory-mapped arrays (no copy);
+            index arrays are sorted before reading, so that the file is
+            read sequentially, and the crops are returned in the given
+            order.
+        fields : list of strings, optional
+            Fields to return, all by default.
+
+        Returns
+        =======
+        arrays : dictionary
+            Field name -> array (n, ny, nx).
+        """
+        fields = fields if fields is not None else list(self.arrays)
+        if isinstance(index, slice):
+            return {field: self.arrays[field][index] for field in fields}
+        index = np.asarray(index)
+        order = np.argsort(index, kind='stable')
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(order.size)
+        return {field: self.arrays[field][index[order]][inverse] for field in fields}
+
+    def iter_batches(self, batch_size, shuffle=False, seed=None, fields=None):
+        """ Iterate over the store in batches.
+
+        Yields
+        ======
+        index : slice or array of ints
+            Rows of the batch in `table`.
+        arrays : dictionary
+            See `batch`.
+        """
+        n = len(self)
+        if shuffle:
+            permutation = np.random.default_rng(seed).permutation(n)
+            for start in range(0, n, batch_size):
+                index = permutation[start:start + batch_size]
+                yield index, self.batch(index, fields)
+        else:
+            for start in range(0, n, batch_size):
+                index = slice(start, min(start + batch_size, n))
+                yield index, self.batch(index, fields)
+
+    def stack(self, fields, index=slice(None)):
+        """ Fields stacked as channels, shape (n, ny, nx, len(fields)),
+        e.g. as input of a CNN.
+        """
+        arrays = self.batch(index, fields)
+        return np.stack([arrays[field] for field in fields], axis=-1)
@@ -0,0 +1,234 @@
+""" Registry of variables derived from ERA5/IFS model fields.
+
+Derived variables (wind speed and direction, stress magnitude, air
+density) are declared once together with the raw model variables they
+depend on. A `DerivedVariables` object resolves the requested names to
+the downloaded files, opens only the files that are needed with dask
+chunks, and builds the derived fields lazily. Nothing is read from disk
+before the caller computes (or persists) the returned arrays.
+"""
+import os
+
+import numpy as np
+import xarray as xr
+
+from air_density import air_density
+
+# Length of the ERA5 accumulation period [s] used to convert accumulated
+# surface stress (N m-2 s) to mean stress (N m-2)
+ACCUMULATION_PERIOD = 3600.
+
+# Default dask chunks: one month of hourly fields per chunk
+DEFAULT_CHUNKS = {'time': 24*31}
+
+# name -> list of recipes, a recipe being a (requires, function) tuple
+REGISTRY = {}
+
+
+def register(name, requires):
+    """ Register a recipe for the derived variable `name`.
+
+    Several recipes can be registered for the same name; they are tried
+    in order of registration and the first one whose dependencies are
+    available is used.
+
+    Parameters
+    ==========
+    name : string
+        Name of the derived variable.
+    requires : list of strings
+        Names of the raw or derived variables the recipe depends on.
+    """
+    def decorator(func):
+        REGISTRY.setdefault(name, []).append((list(requires), func))
+        return func
+    return decorator
+
+
+@register('wspd', requires=['u10', 'v10'])
+def wind_speed(u10, v10):
+    """ 10 m wind speed [m/s]. """
+    wspd = np.sqrt(u10**2 + v10**2)
+    wspd.attrs = {'units': 'm s**-1', 'long_name': '10 metre wind speed'}
+    return wspd
+
+
+@register('wdir', requires=['u10', 'v10'])
+def wind_direction(u10, v10):
+    """ 10 m wind direction [degrees], meteorological convention (the
+    direction the wind is blowing from, clockwise from north).
+    """
+    wdir = (270. - np.rad2deg(np.arctan2(v10, u10))) % 360.
+    wdir.attrs = {'units': 'degrees', 'long_name': '10 metre wind direction'}
+    return wdir
+
+
+@register('rhoa', requires=['p140209'])
+def air_density_era5(p140209):
+    """ Air density over the oceans as provided by ERA5 [kg/m3]. """
+    return p140209.rename('rhoa')
+
+
+@register('rhoa', requires=['t2m', 'd2m', 'msl'])
+def air_density_from_surface_fields(t2m, d2m, msl):
+    """ Air density [kg/m3] from 2 m temperature, 2 m dew point
+    temperature and mean sea level pressure (in Pa), see
+    `air_density.air_density`.
+    """
+    rhoa, _ = air_density(t2m, d2m, msl/100.)
+    rhoa.attrs = {'units': 'kg m**-3', 'long_name': 'Air density'}
+    return rhoa
+
+
+@register('tau', requires=['iews', 'inss'])
+def stress_magnitude_instantaneous(iews, inss):
+    """ Magnitude of the instantaneous turbulent surface stress [N/m2]. """
+    tau = np.sqrt(iews**2 + inss**2)
+    tau.attrs = {'units': 'N m**-2', 'long_name': 'Turbulent surface stress'}
+    return tau
+
+
+@register('tau', requires=['ewss', 'nsss'])
+def stress_magnitude_accumulated(ewss, nsss):
+    """ Magnitude of the turbulent surface stress [N/m2] from the ERA5
+    accumulated eastward and northward components.
+    """
+    tau = np.sqrt(ewss**2 + nsss**2)/ACCUMULATION_PERIOD
+    tau.attrs = {'units': 'N m**-2', 'long_name': 'Turbulent surface stress'}
+    return tau
+
+
+@register('tau', requires=['rhoa', 'zust'])
+def stress_magnitude_friction_velocity(rhoa, zust):
+    """ Magnitude of the surface stress [N/m2] from air density and the
+    IFS friction velocity, tau = rhoa*u*^2.
+    """
+    tau = rhoa*zust**2
+    tau.attrs = {'units': 'N m**-2', 'long_name': 'Turbulent surface stress'}
+    return tau
+
+
+def era5_buoy_files(data_dir, buoy):
+    """ Map raw ERA5 variable names to the files written by the download
+    scripts in `scripts_copernicus` for a given buoy.
+
+    Parameters
+    ==========
+    data_dir : string
+        Root directory of the ERA5 buoy downloads.
+    buoy : string
+        Name of the buoy, e.g., 'Pioneer_3'.
+
+    Returns
+    =======
+    files : dictionary
+        Raw variable name -> file path, only for files that exist.
+    """
+    layout = {
+        'u10': os.path.join('mean_wave_period', 'era_u10m_' + buoy + '.nc'),
+        'v10': 'era_v10m_' + buoy + '.nc',
+        'ewss': os.path.join(
+            'eastward_stress', 'era_eastward_turbulent_surface_stress_' + buoy + '.nc'),
+        'nsss': os.path.join(
+            'northward_stress', 'era_northward_turbulent_surface_stress_' + buoy + '.nc'),
+        'p140209': os.path.join(
+            'air_density', 'era_air_density_over_the_oceans_' + buoy + '.nc'),
+    }
+    files = {}
+    for var, fn in layout.items():
+        path = os.path.join(data_dir, fn)
+        if os.path.exists(path):
+            files[var] = path
+    return files
+
+
+class DerivedVariables:
+    """ Lazily resolve and compute derived variables from model files.
+
+    Parameters
+    ==========
+    files : dictionary
+        Raw variable name -> path (or list of paths) of the NetCDF
+        file(s) holding it. Several variables may share a file.
+    chunks : dictionary, optional
+        Dask chunks used when opening the files.
+    persist : bool, optional
+        If True, derived variables are computed chunk-wise and kept in
+        (distributed) memory the first time they are requested, so that
+        later requests reuse the result. If False (default), the cache
+        holds lazy arrays only.
+    """
+
+    def __init__(self, files, chunks=None, persist=False):
+        self.files = dict(files)
+        self.chunks = DEFAULT_CHUNKS if chunks is None else chunks
+        self.persist = persist
+        self._datasets = {}
+        self._cache = {}
+
+    def available(self, name):
+        """ True if `name` can be resolved from the configured files. """
+        return self._plan(name, ()) is not None
+
+    def _plan(self, name, stack):
+        """ Return the recipe used for `name`, None if it cannot be
+        resolved, or 'raw' if it is read directly from a file.
+        """
+        if name in self._cache:
+            return 'cached'
+        if name in self.files:
+            return 'raw'
+        if name in stack:
+            return None
+        for requires, func in REGISTRY.get(name, []):
+            if all(self._plan(dep, stack + (name,)) is not None for dep in requires):
+                return requires, func
+        return None
+
+    def _open(self, path):
+        key = tuple(path) if isinstance(path, (list, tuple)) else path
+        if key not in self._datasets:
+            if isinstance(path, (list, tuple)):
+                ds = xr.open_mfdataset(path, chunks=self.chunks, combine='by_coords')
+            else:
+                ds = xr.open_dataset(path, chunks=self.chunks)
+            self._datasets[key] = ds
+        return self._datasets[key]
+
+    def _raw(self, name):
+        ds = self._open(self.files[name])
+        if name in ds:
+            return ds[name]
+        # Single-variable files may use another short name
+        data_vars = list(ds.data_vars)
+        if len(data_vars) == 1:
+            return ds[data_vars[0]].rename(name)
+        raise KeyError('Variable %s not found in %s' % (name, self.files[name]))
+
+    def get(self, name):
+        """ Lazy DataArray of the raw or derived variable `name`. """
+        plan = self._plan(name, ())
+        if plan is None:
+            raise KeyError('Cannot resolve variable %s from files %s'
+                    % (name, sorted(self.files)))
+        if plan == 'cached':
+            return self._cache[name]
+        if plan == 'raw':
+            da = self._raw(name)
+        else:
+            requires, func = plan
+            da = func(*[self.get(dep) for dep in requires]).rename(name)
+            if self.persist:
+                da = da.persist()
+        self._cache[name] = da
+        return da
+
+    def dataset(self, names):
+        """ Lazy Dataset with the requested raw and derived variables.
+
+        Parameters
+        ==========
+        names : list of strings
+            Variables to include, e.g., ['wspd', 'wdir', 'tau', 'rhoa'].
+        """
+        return xr.Dataset({name: self.get(name) for name in names})
@@ -0,0 +1,212 @@
+""" Planning of the satellite product downloads.
+
+The Data Tailor customisations are limited to a region of interest
+(ROI) around the buoys, given to `eumdac.tailor_models.Chain` as
+
+    chain = eumdac.tailor_models.Chain(product='ASCATL1SZR', format='netcdf4',
+            projection='geographic', roi=station_roi(lon, lat))
+
+so that a customisation returns the few hundred pixels the extraction
+functions use instead of a full orbit. The ROIs of buoys covered by the
+same product are merged into one customisation when they are close to
+each other.
+
+Products are planned across all buoys (`plan_downloads`): the
+buoy -> products mapping of the collocation dictionary is inverted, so
+that a product covering several buoys is customised and downloaded once,
+into a directory addressed by the product and the customisation
+(`product_key`), and the file is then recorded for each of its buoys
+(`record_download`). A JSON lines manifest lists the downloads, so that
+later runs, also for other buoys, reuse them.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Margin [degrees] around a buoy, larger than half of the 17x17 windows
+# of the extraction functions on the 0.125 degree grid
+ROI_MARGIN = 2.
+
+# Largest extent [degrees] of merged ROIs; buoys farther apart get their
+# own customisation
+MAX_ROI_EXTENT = 10.
+
+
+def station_roi(lon, lat, margin=ROI_MARGIN):
+    """ ROI around a station, as the `roi` argument of a Data Tailor
+    chain.
+
+    Parameters
+    ==========
+    lon, lat : float
+        Location of the station [degrees].
+    margin : float, optional
+        Half size of the ROI [degrees].
+
+    Returns
+    =======
+    roi : dictionary
+        {'NSWE': [north, south, west, east]} in degrees.
+    """
+    return {'NSWE': [min(float(lat) + margin, 90.), max(float(lat) - margin, -90.),
+            float(lon) - margin, float(lon) + margin]}
+
+
+def merge_rois(rois):
+    """ Smallest ROI containing all `rois`. """
+    north, south, west, east = np.array([roi['NSWE'] for roi in rois]).T
+    return {'NSWE': [float(north.max()), float(south.min()), float(west.min()), float(east.max())]}
+
+
+def roi_extent(roi):
+    """ Largest side [degrees] of a ROI. """
+    north, south, west, east = roi['NSWE']
+    return max(north - south, east - west)
+
+
+def group_rois(rois, max_extent=MAX_ROI_EXTENT):
+    """ Merge ROIs into as few ROIs as possible, each not larger than
+    `max_extent` degrees (except single ROIs larger than that).
+
+    Parameters
+    ==========
+    rois : dictionary
+        key (e.g. buoy name) -> ROI.
+    max_extent : float, optional
+
+    Returns
+    =======
+    groups : list of (keys, roi) tuples
+        The keys of the merged ROIs and their merged ROI.
+    """
+    groups = []
+    # Greedy clustering, from west to east
+    for key in sorted(rois, key=lambda key: (rois[key]['NSWE'][2], rois[key]['NSWE'][1])):
+        for group in groups:
+            merged = merge_rois([group[1], rois[key]])
+            if roi_extent(merged) <= max_extent:
+                group[0].append(key)
+                group[1] = merged
+                break
+        else:
+            groups.append([[key], rois[key]])
+    return [(keys, roi) for keys, roi in groups]
+
+
+def buoy_rois(in_situ_obs, buoys=None, margin=ROI_MARGIN):
+    """ ROIs of buoys of a collocation dictionary (buoy -> {'lon', 'lat',
+    ...}), buoy -> ROI.
+    """
+    buoys = in_situ_obs if buoys is None else buoys
+    return {buoy: station_roi(in_situ_obs[buoy]['lon'][0], in_situ_obs[buoy]['lat'][0], margin)
+            for buoy in buoys}
+
+
+DownloadTask = collections.namedtuple('DownloadTask', ['product', 'buoys', 'roi', 'key'])
+DownloadTask.__doc__ = """ A product to download once for several buoys. """
+
+
+def product_key(product, chain=None):
+    """ Address of a product downloaded as is (`chain` None) or customised
+    with the Data Tailor chain arguments `chain` (a dictionary).
+    """
+    spec = {'product': str(product), 'chain': chain}
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def product_dir(data_dir, key):
+    """ Directory of the files of a download, <data_dir>/<key[:2]>/<key>. """
+    return os.path.join(data_dir, key[:2], key)
+
+
+def invert_products(in_situ_obs, buoys=None):
+    """ Buoys of each product of a collocation dictionary.
+
+    Returns
+    =======
+    products : OrderedDict
+        product id -> (product, list of buoys), in order of first
+        appearance.
+    """
+    products = collections.OrderedDict()
+    for buoy in in_situ_obs if buoys is None else buoys:
+        for product in in_situ_obs[buoy]['products']:
+            products.setdefault(str(product), (product, []))[1].append(buoy)
+    return products
+
+
+def plan_downloads(in_situ_obs, buoys=None, chain=None, margin=ROI_MARGIN,
+        max_extent=MAX_ROI_EXTENT):
+    """ Downloads of the products of several buoys, each product once per
+    group of nearby buoys.
+
+    Parameters
+    ==========
+    in_situ_obs : dictionary
+        Collocation dictionary, buoy -> {'lon', 'lat', 'products', ...}.
+    buoys : list of strings, optional
+        Buoys to plan for, by default all.
+    chain : dictionary, optional
+        Arguments of the Data Tailor chain, without the ROI. If None,
+        the products are downloaded as is, one task per product.
+    margin, max_extent : float, optional
+        See `station_roi` and `group_rois`.
+
+    Returns
+    =======
+    tasks : list of DownloadTask
+    """
+    rois = buoy_rois(in_situ_obs, buoys, margin)
+    tasks = []
+    for product, product_buoys in invert_products(in_situ_obs, buoys).values():
+        if chain is None:
+            tasks.append(DownloadTask(product, product_buoys, None, product_key(product)))
+            continue
+        for group, roi in group_rois({buoy: rois[buoy] for buoy in product_buoys}, max_extent):
+            tasks.append(DownloadTask(product, group, roi, product_key(product, dict(chain, roi=roi))))
+    return tasks
+
+
+def read_manifest(manifest_file):
+    """ Downloads recorded by `record_download`, key -> entry. """
+    downloads = {}
+    if manifest_file is not None and os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    downloads[entry['key']] = entry
+    return downloads
+
+
+def record_download(in_situ_obs, task, filename, manifest_file=None):
+    """ Record the file of a download for each buoy of the task, as
+    in_situ_obs[buoy]['nc_files'][product], and in the manifest.
+
+    Parameters
+    ==========
+    in_situ_obs : dictionary
+    task : DownloadTask
+    filename : string
+        Path of the file relative to the data directory.
+    manifest_file : string, optional
+        JSON lines file the download is appended to.
+
+    Returns
+    =======
+    entry : dictionary
+        The manifest entry.
+    """
+    for buoy in task.buoys:
+        in_situ_obs[buoy].setdefault('nc_files', {})[str(task.product)] = filename
+    entry = {'key': task.key, 'product': str(task.product), 'buoys': list(task.buoys),
+            'roi': task.roi, 'filename': filename,
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    if manifest_file is not None:
+        with open(manifest_file, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+    return entry
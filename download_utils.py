@@ -0,0 +1,304 @@
+""" Verified, resumable downloads.
+
+Files are written to <path>.part and only renamed to `path` once they
+are complete and match the expected size and MD5 checksum, so that an
+interrupted transfer never leaves a truncated file at the final path.
+
+`copy_stream` copies any file-like stream (e.g. the eumdac
+`customisation.stream_output` and `product.open` streams, whose expected
+size is given by `stream_size`). `download`
+fetches a URL with urllib; if the server accepts range requests, the
+file is fetched in parts by several connections, which fills a high
+latency link better than a single stream, and the completed parts are
+recorded in <path>.part.done, so that a rerun only fetches the missing
+parts. Failed attempts are retried with `retry_call`, which reports them
+to an `on_retry` callback, e.g. to count them with `progress.Progress`.
+"""
+import base64
+import binascii
+import concurrent.futures
+import hashlib
+import http.client
+import os
+import re
+import threading
+import time
+import urllib.request
+
+# Buffer of stream copies [bytes]
+COPY_BUFFER = 8*1024**2
+
+# Size of the parts of range requests [bytes]
+PART_SIZE = 32*1024**2
+
+# Attempts for each part before giving up
+RETRIES = 3
+
+# Errors of an attempt that are retried: socket and file errors (also the
+# size and checksum checks) and malformed or cut responses (e.g.
+# BadStatusLine or IncompleteRead)
+RETRY_ERRORS = (OSError, http.client.HTTPException)
+
+
+def file_md5(path, buffer_size=COPY_BUFFER):
+    """ Hex MD5 checksum of a file. """
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(buffer_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _verify(path, size=None, md5=None):
+    actual = os.path.getsize(path)
+    if size is not None and actual != size:
+        raise OSError('Size of %s is %d bytes, expected %d' % (path, actual, size))
+    if md5 is not None:
+        actual = file_md5(path)
+        if actual != md5.lower():
+            raise OSError('MD5 of %s is %s, expected %s' % (path, actual, md5))
+
+
+def _finish(tmp, path, size=None, md5=None):
+    try:
+        _verify(tmp, size, md5)
+    except OSError:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return path
+
+
+def copy_stream(stream, path, size=None, md5=None, buffer_size=COPY_BUFFER):
+    """ Copy a stream to `path` through a temporary file.
+
+    Parameters
+    ==========
+    stream : file-like object
+    path : string
+    size : int, optional
+        Expected size [bytes].
+    md5 : string, optional
+        Expected hex MD5 checksum.
+    buffer_size : int, optional
+
+    Returns
+    =======
+    nbytes : int
+        Number of bytes written.
+
+    Raises
+    ======
+    OSError
+        If the file does not match `size` or `md5`; nothing is written
+        to `path`.
+    """
+    tmp = path + '.part'
+    digest = hashlib.md5() if md5 is not None else None
+    nbytes = 0
+    try:
+        with open(tmp, 'wb') as f:
+            for block in iter(lambda: stream.read(buffer_size), b''):
+                f.write(block)
+                nbytes += len(block)
+                if digest is not None:
+                    digest.update(block)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if digest is not None and digest.hexdigest() != md5.lower():
+        os.remove(tmp)
+        raise OSError('MD5 of %s is %s, expected %s' % (path, digest.hexdigest(), md5))
+    _finish(tmp, path, size)
+    return nbytes
+
+
+def stream_size(stream):
+    """ Expected size [bytes] of an HTTP response stream from its
+    Content-Length header, or None if it has no headers (e.g. a local
+    file), no Content-Length or is compressed in transit.
+    """
+    headers = getattr(stream, 'headers', None)
+    if headers is None:
+        return None
+    if (headers.get('Content-Encoding') or 'identity').lower() != 'identity':
+        return None
+    try:
+        return int(headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_call(func, retries=RETRIES, on_retry=None, errors=RETRY_ERRORS):
+    """ Call func(), again after a pause of 1, 2, 4, ... s when it raises
+    one of `errors`, at most `retries` times in total.
+
+    Parameters
+    ==========
+    func : callable
+    retries : int, optional
+    on_retry : callable, optional
+        on_retry(attempt, error) is called before each new attempt, with
+        the number of the attempt (2 for the first retry) and the error
+        of the previous one, e.g. to record it with `progress.Progress.retry`.
+    errors : tuple of exception classes, optional
+
+    Returns
+    =======
+    result : the result of func()
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            return func()
+        except errors as error:
+            if attempt == retries:
+                raise
+            if on_retry is not None:
+                on_retry(attempt + 1, error)
+            time.sleep(2**(attempt - 1))
+
+
+def _header_md5(headers):
+    """ Hex MD5 from a Content-MD5 header, or from an ETag that is a plain
+    MD5 (as for single part uploads to S3 compatible servers).
+    """
+    content_md5 = headers.get('Content-MD5')
+    if content_md5:
+        try:
+            return base64.b64decode(content_md5).hex()
+        except (binascii.Error, ValueError):
+            pass
+    etag = (headers.get('ETag') or '').strip('"')
+    if re.fullmatch('[0-9a-fA-F]{32}', etag):
+        return etag.lower()
+    return None
+
+
+def remote_info(url, timeout=60, headers=None):
+    """ Size, range support and MD5 of a remote file from a HEAD request.
+
+    Returns
+    =======
+    info : dictionary
+        'size' (int or None), 'ranges' (bool) and 'md5' (hex string or
+        None).
+    """
+    request = urllib.request.Request(url, method='HEAD', headers=headers or {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        length = response.headers.get('Content-Length')
+        return {
+            'size': int(length) if length is not None else None,
+            'ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes',
+            'md5': _header_md5(response.headers),
+        }
+
+
+def _read_done(done_file):
+    if not os.path.exists(done_file):
+        return set()
+    with open(done_file) as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def _fetch_part(url, tmp, start, end, timeout, headers, retries, on_retry=None):
+    def fetch():
+        request = urllib.request.Request(url, headers=dict(
+            headers or {}, Range='bytes=%d-%d' % (start, end - 1)))
+        with urllib.request.urlopen(request, timeout=timeout) as response, \
+                open(tmp, 'r+b') as f:
+            if response.status != 206:
+                raise OSError('Server ignored the range request for %s' % url)
+            f.seek(start)
+            offset = start
+            for block in iter(lambda: response.read(COPY_BUFFER), b''):
+                f.write(block)
+                offset += len(block)
+        if offset != end:
+            raise OSError('Part %d-%d of %s is truncated' % (start, end, url))
+
+    retry_call(fetch, retries, on_retry)
+
+
+def download(url, path, size=None, md5=None, workers=4, part_size=PART_SIZE, timeout=60,
+        headers=None, retries=RETRIES, on_retry=None):
+    """ Download a URL to `path`, in parallel parts if the server accepts
+    range requests, resuming an interrupted download.
+
+    Parameters
+    ==========
+    url : string
+    path : string
+        Final path; the download is skipped if it exists.
+    size, md5 : optional
+        Expected size [bytes] and hex MD5 checksum, by default from the
+        Content-Length and Content-MD5 (or ETag) headers of the server.
+    workers : int, optional
+        Number of parallel range requests.
+    part_size : int, optional
+        Size of the range requests [bytes].
+    timeout : float, optional
+        Socket timeout [s].
+    headers : dictionary, optional
+        Additional request headers (e.g. authorization).
+    retries : int, optional
+        Attempts for each part.
+    on_retry : callable, optional
+        on_retry(attempt, error) is called before a new attempt of a part
+        (see `retry_call`), e.g.
+        lambda attempt, error: progress.retry(item, attempt, error).
+
+    Returns
+    =======
+    path : string
+
+    Raises
+    ======
+    OSError
+        If the download fails or does not match the expected size or
+        checksum; nothing is written to `path`.
+    """
+    if os.path.exists(path):
+        return path
+    info = remote_info(url, timeout, headers)
+    if None not in (size, info['size']) and size != info['size']:
+        raise OSError('Size of %s is %d bytes, expected %d' % (url, info['size'], size))
+    size = info['size'] if size is None else size
+    md5 = info['md5'] if md5 is None else md5
+    tmp, done_file = path + '.part', path + '.part.done'
+
+    if not info['ranges'] or size is None:
+        def fetch():
+            request = urllib.request.Request(url, headers=headers or {})
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                copy_stream(response, path, size, md5)
+
+        retry_call(fetch, retries, on_retry)
+        return path
+
+    done = _read_done(done_file) if os.path.exists(tmp) else set()
+    if not done:
+        with open(tmp, 'wb') as f:
+            f.truncate(size)
+        if os.path.exists(done_file):
+            os.remove(done_file)
+    parts = [i for i in range(-(-size//part_size)) if i not in done]
+    lock = threading.Lock()
+
+    def fetch(i):
+        _fetch_part(url, tmp, i*part_size, min((i + 1)*part_size, size), timeout, headers,
+                retries, on_retry)
+        with lock, open(done_file, 'a') as f:
+            f.write('%d\n' % i)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for future in [pool.submit(fetch, i) for i in parts]:
+            # The completed parts are kept for a retry
+            future.result()
+
+    try:
+        _finish(tmp, path, size, md5)
+    finally:
+        if os.path.exists(done_file):
+            os.remove(done_file)
+    return path
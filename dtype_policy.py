@@ -0,0 +1,204 @@
+""" Compact storage of extraction results.
+
+A dtype policy tells how the arrays in the dictionaries returned by the
+SAR and ASCAT extraction functions are stored:
+
+radiometry : NRCS and related values (sigma0, s0, s0_norm, kp, ...),
+    None (unchanged) or a floating point dtype.
+angles : incidence and azimuth angles, None (unchanged), a floating
+    point dtype, or 'int16' for scaled integers, see `encode_angles`.
+geolocation : 'grid' to keep the longitude/latitude grids (cast to
+    `geolocation_dtype` if given), or 'affine' to replace each pair of
+    grids by an affine transform, the grid shape and the index of the
+    station in the grid, see `geotransform_from_grids`.
+"""
+import numpy as np
+
+# Scaled int16 encoding of angles: angle = ANGLE_OFFSET + ANGLE_SCALE*value,
+# covering -181.96 to 361.96 degrees (azimuths in either the -180 to 180
+# or the 0 to 360 convention) with 0.0083 degree resolution
+ANGLE_SCALE = 0.0083
+ANGLE_OFFSET = 90.
+ANGLE_FILL = -32768
+
+# Maximum error [degrees] for replacing geolocation grids by an affine
+# transform; grids that are not affine within this error are kept
+AFFINE_TOLERANCE = 1e-4
+
+POLICIES = {
+    'float64': {'radiometry': None, 'angles': None, 'geolocation': 'grid',
+        'geolocation_dtype': None},
+    'float32': {'radiometry': 'float32', 'angles': 'float32', 'geolocation': 'grid',
+        'geolocation_dtype': 'float32'},
+    'compact': {'radiometry': 'float32', 'angles': 'int16', 'geolocation': 'affine',
+        'geolocation_dtype': None},
+}
+
+RADIOMETRY_PREFIXES = ('sigma0_', 'std_sigma0_', 's0', 'kp_')
+ANGLE_PREFIXES = ('inc', 'az', 'azi_angle_')
+
+# Pairs of (longitude, latitude) grid keys and the suffix of the keys
+# replacing them in the 'affine' geolocation mode
+GEOLOCATION_KEYS = [
+    ('grid_lons_orig', 'grid_lats_orig', '_orig'),
+    ('lons_cropped_image', 'lats_cropped_image', '_cropped_image'),
+    ('grid_lons', 'grid_lats', ''),
+]
+
+
+def _cast(value, dtype):
+    value = np.asarray(value, dtype=dtype)
+    return value[()] if value.ndim == 0 else value
+
+
+def get_policy(policy):
+    """ Dtype policy by name, or a dictionary completed with defaults. """
+    if isinstance(policy, str):
+        try:
+            return dict(POLICIES[policy])
+        except KeyError:
+            raise ValueError('Unknown dtype policy %s, choose from %s'
+                    % (policy, sorted(POLICIES)))
+    return dict(POLICIES['float64'], **policy)
+
+
+def encode_angles(angles):
+    """ Encode angles [degrees] as scaled int16, NaN as ANGLE_FILL. Angles
+    outside the range of the encoding raise a ValueError.
+    """
+    angles = np.asarray(angles, dtype=float)
+    encoded = np.asarray(np.round((angles - ANGLE_OFFSET)/ANGLE_SCALE))
+    missing = ~np.isfinite(encoded)
+    outside = ~missing & ((encoded < ANGLE_FILL + 1) | (encoded > np.iinfo(np.int16).max))
+    if outside.any():
+        raise ValueError('Angles %s outside the range %.2f to %.2f of the int16 encoding'
+                % (np.unique(angles[outside])[:5], decode_angles(ANGLE_FILL + 1),
+                decode_angles(np.iinfo(np.int16).max)))
+    encoded[missing] = ANGLE_FILL
+    return encoded.astype(np.int16)
+
+
+def decode_angles(encoded, dtype=np.float32):
+    """ Decode angles encoded by `encode_angles`. """
+    encoded = np.asarray(encoded)
+    angles = np.asarray(ANGLE_OFFSET + ANGLE_SCALE*encoded.astype(dtype), dtype=dtype)
+    angles[encoded == ANGLE_FILL] = np.nan
+    return angles[()] if angles.ndim == 0 else angles
+
+
+def _as_grids(lons, lats):
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    if lons.ndim == 1 and lats.ndim == 1:
+        lons, lats = np.meshgrid(lons, lats)
+    return lons, lats
+
+
+def geotransform_from_grids(lons, lats):
+    """ Least squares affine transform from pixel to geographical
+    coordinates,
+
+        lon = t[0] + t[1]*col + t[2]*row
+        lat = t[3] + t[4]*col + t[5]*row
+
+    Parameters
+    ==========
+    lons, lats : arrays of floats
+        2D grids, or 1D longitude (columns) and latitude (rows) vectors.
+
+    Returns
+    =======
+    transform : array of 6 floats
+    error : float
+        Maximum absolute error of the transform [degrees].
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    if lons.ndim == 1 and lats.ndim == 1:
+        # Separable grid, fit each axis on its own
+        lon_fit = np.polynomial.polynomial.polyfit(np.arange(lons.size), lons, 1)
+        lat_fit = np.polynomial.polynomial.polyfit(np.arange(lats.size), lats, 1)
+        error = max(np.abs(lon_fit[0] + lon_fit[1]*np.arange(lons.size) - lons).max(),
+                np.abs(lat_fit[0] + lat_fit[1]*np.arange(lats.size) - lats).max())
+        return np.array([lon_fit[0], lon_fit[1], 0., lat_fit[0], 0., lat_fit[1]]), error
+    rows, cols = np.indices(lons.shape)
+    design = np.column_stack([np.ones(lons.size), cols.ravel(), rows.ravel()])
+    coef, *_ = np.linalg.lstsq(design, np.column_stack([lons.ravel(), lats.ravel()]), rcond=None)
+    fitted = design @ coef
+    error = max(np.abs(fitted[:, 0] - lons.ravel()).max(), np.abs(fitted[:, 1] - lats.ravel()).max())
+    return np.concatenate([coef[:, 0], coef[:, 1]]), error
+
+
+def grids_from_geotransform(transform, shape):
+    """ Longitude and latitude grids of the given shape from an affine
+    transform, the inverse of `geotransform_from_grids`.
+    """
+    rows, cols = np.indices(shape)
+    lons = transform[0] + transform[1]*cols + transform[2]*rows
+    lats = transform[3] + transform[4]*cols + transform[5]*rows
+    return lons, lats
+
+
+def station_index(lons, lats, station_lon, station_lat):
+    """ (row, col) of the grid point closest to the station. """
+    lons, lats = _as_grids(lons, lats)
+    a = np.abs(lats - station_lat) + np.abs(lons - station_lon)
+    return tuple(int(i) for i in np.unravel_index(np.nanargmin(a), a.shape))
+
+
+def apply_dtype_policy(params_dict, policy, station_lon=None, station_lat=None):
+    """ Convert the arrays of an extraction result dictionary in place
+    according to a dtype policy.
+
+    Parameters
+    ==========
+    params_dict : dictionary
+        Dictionary returned by the `ascat.ascat_params*` functions or by
+        `sar.sar_params_dict`.
+    policy : string or dictionary
+        Name of a policy in `POLICIES` or a policy dictionary.
+    station_lon, station_lat : float, optional
+        Station location, used to compute the station index in the
+        'affine' geolocation mode.
+
+    Returns
+    =======
+    params_dict : dictionary
+        The converted dictionary. In the 'affine' geolocation mode each
+        pair of grids is replaced by the keys geotransform<suffix>,
+        grid_shape<suffix> and, if the station location is given,
+        station_index<suffix>; the suffixes are listed in
+        `GEOLOCATION_KEYS`.
+    """
+    policy = get_policy(policy)
+
+    for lon_key, lat_key, suffix in GEOLOCATION_KEYS:
+        if lon_key not in params_dict or lat_key not in params_dict:
+            continue
+        lons, lats = params_dict[lon_key], params_dict[lat_key]
+        if policy['geolocation'] == 'affine':
+            transform, error = geotransform_from_grids(lons, lats)
+            if error <= AFFINE_TOLERANCE:
+                params_dict['geotransform' + suffix] = transform
+                params_dict['grid_shape' + suffix] = _as_grids(lons, lats)[0].shape
+                if station_lon is not None and station_lat is not None:
+                    params_dict['station_index' + suffix] = station_index(
+                        lons, lats, station_lon, station_lat)
+                del params_dict[lon_key], params_dict[lat_key]
+                continue
+        if policy['geolocation_dtype'] is not None:
+            params_dict[lon_key] = np.asarray(lons, dtype=policy['geolocation_dtype'])
+            params_dict[lat_key] = np.asarray(lats, dtype=policy['geolocation_dtype'])
+
+    for key, value in params_dict.items():
+        if isinstance(value, (str, bytes)) or value is None:
+            continue
+        if key.startswith(RADIOMETRY_PREFIXES) and policy['radiometry'] is not None:
+            params_dict[key] = _cast(value, policy['radiometry'])
+        elif key.startswith(ANGLE_PREFIXES) and policy['angles'] is not None:
+            if policy['angles'] == 'int16':
+                params_dict[key] = encode_angles(value)[()]
+            else:
+                params_dict[key] = _cast(value, policy['angles'])
+
+    return params_dict
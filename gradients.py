@@ -0,0 +1,136 @@
+""" Gradients of image windows from least-squares plane fits.
+
+A plane z = c + gx*x + gy*y is fitted to all valid pixels of each
+window, with x and y the column and row offsets from the window centre.
+The design matrix and its pseudo-inverse only depend on the window
+shape and are computed once, so that the gradients of a batch of
+windows without gaps are a single matrix product; windows with missing
+pixels solve their own 3x3 normal equations, in one batched call. The
+gradients per pixel are scaled to physical units with the grid spacing
+of each window:
+
+    dy, dx = grid_spacing_km(lats, lons)
+    gx, gy = plane_gradients(windows, dy, dx)
+"""
+import functools
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.
+
+# Normal equations with a larger condition number (e.g. all valid pixels
+# on a line) have no gradient
+MAX_CONDITION = 1e10
+
+
+@functools.lru_cache(maxsize=None)
+def design_matrix(ny, nx):
+    """ Design matrix of a plane fit over a (ny, nx) window, shape
+    (ny*nx, 3) with columns 1, column offset and row offset from the
+    window centre.
+    """
+    rows, cols = np.indices((ny, nx), dtype=float)
+    A = np.stack([np.ones(ny*nx), (cols - (nx - 1)/2).ravel(), (rows - (ny - 1)/2).ravel()],
+            axis=1)
+    A.setflags(write=False)
+    return A
+
+
+@functools.lru_cache(maxsize=None)
+def _operators(ny, nx):
+    A = design_matrix(ny, nx)
+    pinv = np.linalg.pinv(A).T
+    # Outer products of the rows of A, to build the normal matrices of
+    # masked windows from their weights
+    outer = (A[:, :, None]*A[:, None, :]).reshape(-1, 9)
+    return pinv, outer
+
+
+def grid_spacing_km(lats, lons):
+    """ Signed grid spacing [km] of regular latitude-longitude windows.
+
+    Parameters
+    ==========
+    lats : array of floats, shape (..., ny)
+        Latitudes [degrees] of the rows.
+    lons : array of floats, shape (..., nx)
+        Longitudes [degrees] of the columns.
+
+    Returns
+    =======
+    dy, dx : floats or arrays
+        Northward distance between consecutive rows (negative for
+        descending latitudes) and eastward distance between consecutive
+        columns.
+    """
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    km_per_degree = np.deg2rad(EARTH_RADIUS_KM)
+    dy = np.diff(lats, axis=-1).mean(axis=-1)*km_per_degree
+    dx = np.diff(lons, axis=-1).mean(axis=-1)*km_per_degree*np.cos(np.deg2rad(lats.mean(axis=-1)))
+    return dy, dx
+
+
+def plane_fit(windows, valid=None, min_valid=3):
+    """ Least-squares plane fits of a batch of windows.
+
+    Parameters
+    ==========
+    windows : array of floats, shape (..., ny, nx)
+    valid : array of bools, optional
+        Pixels to use, broadcastable to `windows`. By default the finite
+        values.
+    min_valid : int, optional
+        Minimum number of valid pixels of a fit.
+
+    Returns
+    =======
+    coefficients : array of floats, shape (..., 3)
+        Value at the window centre and gradients per column and per row,
+        NaN for windows with too few valid pixels.
+    """
+    windows = np.asarray(windows, dtype=float)
+    ny, nx = windows.shape[-2:]
+    batch = windows.shape[:-2]
+    z = windows.reshape(-1, ny*nx)
+    mask = np.isfinite(z)
+    if valid is not None:
+        mask &= np.broadcast_to(valid, windows.shape).reshape(-1, ny*nx)
+    A = design_matrix(ny, nx)
+    pinv, outer = _operators(ny, nx)
+
+    coefficients = np.full((z.shape[0], 3), np.nan)
+    full = mask.all(axis=1)
+    coefficients[full] = z[full] @ pinv
+
+    partial = ~full & (mask.sum(axis=1) >= max(min_valid, 3))
+    if partial.any():
+        weights = mask[partial].astype(float)
+        normal = (weights @ outer).reshape(-1, 3, 3)
+        rhs = np.where(mask[partial], z[partial], 0.) @ A
+        with np.errstate(divide='ignore', invalid='ignore'):
+            solvable = np.linalg.cond(normal) < MAX_CONDITION
+        index = np.flatnonzero(partial)[solvable]
+        coefficients[index] = np.linalg.solve(normal[solvable], rhs[solvable][:, :, None])[:, :, 0]
+    return coefficients.reshape(batch + (3,))
+
+
+def plane_gradients(windows, dy=1., dx=1., valid=None, min_valid=3):
+    """ Eastward and northward gradients of a batch of windows.
+
+    Parameters
+    ==========
+    windows : array of floats, shape (..., ny, nx)
+    dy, dx : floats or arrays broadcastable to windows.shape[:-2]
+        Signed grid spacing of the rows and columns, see
+        `grid_spacing_km`. With the defaults the gradients are per pixel
+        along the columns and rows.
+    valid, min_valid :
+        See `plane_fit`.
+
+    Returns
+    =======
+    gx, gy : floats or arrays
+        Gradients per unit of `dx` and `dy` (e.g. dB/km).
+    """
+    coefficients = plane_fit(windows, valid, min_valid)
+    return coefficients[..., 1]/dx, coefficients[..., 2]/dy
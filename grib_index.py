@@ -0,0 +1,443 @@
+""" Indexed point reads of GRIB files.
+
+The MARS and CDS downloads can be kept as GRIB, which is several times
+smaller than the server side NetCDF conversion. A GRIB file is a
+sequence of self-contained messages, one field each; the index has one
+row per message with its byte offset, parameter, level, reference time,
+step and valid time, the regular latitude-longitude grid and, for
+simple packing, the position and scaling of the packed values. It is
+built once by scanning the messages and kept next to the file as
+<file>.index.csv. A point value is then read by seeking to the message
+and reading the few bytes of the nearest grid point, without decoding
+the field:
+
+    grib = GribFile('ifs_fc_20150101.grib')
+    values = grib.point_values(40.1, -70.8, name=['u10', 'v10'])
+
+Simple packing of both GRIB editions is decoded with numpy; other
+packings and grids other than regular latitude-longitude need eccodes.
+The archived GRIB1 fields (e.g. ERA5) are simply packed, GRIB2 fields
+are often CCSDS packed, so MARS requests set "packing": "simple" (see
+mars_download.py).
+"""
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timer
+
+try:
+    import eccodes
+except ImportError:
+    eccodes = None
+
+INDEX_SUFFIX = '.index.csv'
+
+COLUMNS = [
+    'offset', 'length', 'edition', 'param', 'name', 'level_type', 'level',
+    'time', 'step', 'valid_time', 'ni', 'nj', 'lat1', 'lon1', 'lat2', 'lon2',
+    'scan_mode', 'packing', 'n_values', 'reference', 'binary_scale',
+    'decimal_scale', 'bits', 'bitmap_offset', 'data_offset', 'file_size', 'file_mtime',
+]
+
+# Short names, as in the NetCDF conversion, of GRIB1 paramIds
+# (table*1000 + parameter, the table 128 without prefix)
+GRIB1_NAMES = {
+    148: 'chnk', 151: 'msl', 165: 'u10', 166: 'v10', 167: 't2m', 168: 'd2m',
+    180: 'ewss', 181: 'nsss', 228003: 'zust', 140209: 'p140209', 140229: 'swh',
+    140230: 'mwd', 140232: 'mwp',
+}
+
+# Short names of GRIB2 discipline.category.number (and level) parameters
+GRIB2_NAMES = {
+    ('0.2.2', 103, 10.): 'u10', ('0.2.3', 103, 10.): 'v10', ('0.0.0', 103, 2.): 't2m',
+    ('0.0.6', 103, 2.): 'd2m', ('0.3.0', 101, 0.): 'msl', ('0.3.0', 1, 0.): 'msl',
+    ('0.2.62', 1, 0.): 'ewss', ('0.2.63', 1, 0.): 'nsss', ('10.0.3', 1, 0.): 'swh',
+    ('10.0.14', 1, 0.): 'mwd', ('10.0.15', 1, 0.): 'mwp', ('10.0.17', 1, 0.): 'zust',
+    ('10.0.76', 1, 0.): 'chnk', ('10.0.82', 1, 0.): 'p140209',
+}
+
+# Hours per time unit, in both editions
+TIME_UNITS = {0: 1/60., 1: 1., 2: 24., 10: 3., 11: 6., 12: 12., 13: 1/3600.}
+
+GRIB1_LOCATION_SCALE = 1e-3
+GRIB2_LOCATION_SCALE = 1e-6
+
+
+def _uint(b):
+    return int.from_bytes(b, 'big')
+
+
+def _sint(b):
+    """ Sign and magnitude integer. """
+    value = int.from_bytes(b, 'big')
+    sign_bit = 1 << (8*len(b) - 1)
+    return -(value & ~sign_bit) if value & sign_bit else value
+
+
+def ibm_float(b):
+    """ Value of a 4 byte IBM single precision float (GRIB1 reference values). """
+    value = _uint(b)
+    mantissa = value & 0xffffff
+    exponent = (value >> 24) & 0x7f
+    sign = -1. if value >> 31 else 1.
+    return sign*mantissa*16.**(exponent - 64)/2.**24
+
+
+def scan_messages(f):
+    """ Offset, length and edition of the messages of an open binary file,
+    skipping any padding between them.
+    """
+    offset = 0
+    size = os.fstat(f.fileno()).st_size
+    while offset < size:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        if header[:4] != b'GRIB':
+            f.seek(offset)
+            chunk = f.read(1 << 20)
+            start = chunk.find(b'GRIB', 1)
+            if start < 0:
+                offset += max(len(chunk) - 3, 1)
+                continue
+            offset += start
+            continue
+        edition = header[7]
+        length = _uint(header[4:7]) if edition == 1 else _uint(header[8:16])
+        yield offset, length, edition
+        offset += length
+
+
+def _grid(entry, ni, nj, lat1, lon1, lat2, lon2, scan_mode):
+    entry.update(ni=ni, nj=nj, lat1=lat1, lon1=lon1, lat2=lat2, lon2=lon2, scan_mode=scan_mode)
+
+
+def _grib1_entry(message, offset):
+    pds = message[8:]
+    pds_length = _uint(pds[0:3])
+    table, number = pds[3], pds[8]
+    param = number if table == 128 else table*1000 + number
+    flag = pds[7]
+    step_unit, p1, p2, range_type = TIME_UNITS.get(pds[17], np.nan), pds[18], pds[19], pds[20]
+    if range_type == 10:
+        step = (p1*256 + p2)*step_unit
+    elif range_type in (2, 3, 4, 5):
+        step = p2*step_unit
+    else:
+        step = p1*step_unit
+    time = pd.Timestamp(year=(pds[24] - 1)*100 + pds[12], month=pds[13], day=pds[14],
+            hour=pds[15], minute=pds[16])
+    entry = dict.fromkeys(COLUMNS)
+    entry.update(offset=offset, length=len(message), edition=1, param=str(param),
+            name=GRIB1_NAMES.get(param, 'p%d' % param), level_type=pds[9],
+            level=float(_uint(pds[10:12])), time=time, step=step,
+            valid_time=time + pd.Timedelta(hours=step), decimal_scale=_sint(pds[26:28]))
+
+    position = 8 + pds_length
+    if flag & 0x80:
+        gds = message[position:]
+        if gds[5] == 0:
+            _grid(entry, _uint(gds[6:8]), _uint(gds[8:10]),
+                    _sint(gds[10:13])*GRIB1_LOCATION_SCALE, _sint(gds[13:16])*GRIB1_LOCATION_SCALE,
+                    _sint(gds[17:20])*GRIB1_LOCATION_SCALE, _sint(gds[20:23])*GRIB1_LOCATION_SCALE,
+                    gds[27])
+        position += _uint(gds[0:3])
+    if flag & 0x40:
+        bms = message[position:]
+        # A predefined bitmap (table reference) is not supported
+        entry['bitmap_offset'] = offset + position + 6 if _uint(bms[4:6]) == 0 else -2
+        position += _uint(bms[0:3])
+    else:
+        entry['bitmap_offset'] = -1
+    bds = message[position:]
+    bds_length, bds_flag = _uint(bds[0:3]), bds[3]
+    simple = not bds_flag & 0xc0 and entry['ni'] is not None and entry['bitmap_offset'] != -2
+    entry.update(packing='simple' if simple else 'other', reference=ibm_float(bds[6:10]),
+            binary_scale=_sint(bds[4:6]), bits=bds[10], data_offset=offset + position + 11)
+    if simple and entry['bits']:
+        entry['n_values'] = ((bds_length - 11)*8 - (bds_flag & 0x0f))//entry['bits']
+    return [entry]
+
+
+def _grib2_entries(message, offset):
+    discipline = message[6]
+    position = 16
+    entries = []
+    entry = dict.fromkeys(COLUMNS)
+    entry.update(offset=offset, length=len(message), edition=2)
+    while position < len(message) - 4:
+        section_length, number = _uint(message[position:position + 4]), message[position + 4]
+        section = message[position:position + section_length]
+        if number == 1:
+            time = pd.Timestamp(year=_uint(section[12:14]), month=section[14], day=section[15],
+                    hour=section[16], minute=section[17], second=section[18])
+        elif number == 3:
+            entry.update(dict.fromkeys(['ni', 'nj', 'lat1', 'lon1', 'lat2', 'lon2', 'scan_mode']))
+            if _uint(section[12:14]) == 0:
+                scale = GRIB2_LOCATION_SCALE
+                _grid(entry, _uint(section[30:34]), _uint(section[34:38]),
+                        _sint(section[46:50])*scale, _sint(section[50:54])*scale,
+                        _sint(section[55:59])*scale, _sint(section[59:63])*scale, section[71])
+        elif number == 4:
+            template = _uint(section[7:9])
+            param = '%d.%d.%d' % (discipline, section[9], section[10])
+            level_type = section[22]
+            level = 0.
+            if section[23] != 255:
+                level = _sint(section[24:28])/10.**_sint(section[23:24])
+            step = _sint(section[18:22])*TIME_UNITS.get(section[17], np.nan)
+            valid_time = time + pd.Timedelta(hours=step)
+            if template == 8:
+                # Statistically processed fields are valid at the end of the period
+                valid_time = pd.Timestamp(year=_uint(section[34:36]), month=section[36],
+                        day=section[37], hour=section[38], minute=section[39], second=section[40])
+                step = (valid_time - time)/pd.Timedelta(hours=1)
+            entry.update(param=param, name=GRIB2_NAMES.get((param, level_type, level),
+                    'p' + param), level_type=level_type, level=level, time=time, step=step,
+                    valid_time=valid_time)
+        elif number == 5:
+            simple = _uint(section[9:11]) == 0
+            entry.update(packing='simple' if simple else 'other', n_values=_uint(section[5:9]))
+            if simple:
+                entry.update(reference=struct.unpack('>f', section[11:15])[0],
+                        binary_scale=_sint(section[15:17]), decimal_scale=_sint(section[17:19]),
+                        bits=section[19])
+        elif number == 6:
+            indicator = section[5]
+            if indicator == 0:
+                entry['bitmap_offset'] = offset + position + 6
+            elif indicator == 255:
+                entry['bitmap_offset'] = -1
+            else:
+                # A bitmap of a previous field is not supported
+                entry['bitmap_offset'] = -2
+        elif number == 7:
+            entry['data_offset'] = offset + position + 5
+            if entry['ni'] is None or entry['bitmap_offset'] == -2:
+                entry['packing'] = 'other'
+            entries.append(dict(entry))
+        position += section_length
+    return entries
+
+
+def scan_file(path):
+    """ Index entries of the messages of a GRIB file, a list of
+    dictionaries with the keys in `COLUMNS`.
+    """
+    st = os.stat(path)
+    entries = []
+    with open(path, 'rb') as f:
+        for offset, length, edition in scan_messages(f):
+            f.seek(offset)
+            message = f.read(length)
+            if edition == 1:
+                entries.extend(_grib1_entry(message, offset))
+            elif edition == 2:
+                entries.extend(_grib2_entries(message, offset))
+            else:
+                raise ValueError('GRIB edition %d of message at %d in %s is not supported'
+                        % (edition, offset, path))
+    for entry in entries:
+        entry.update(file_size=st.st_size, file_mtime=st.st_mtime)
+    return entries
+
+
+def read_index(index_file):
+    """ Read an index written by `build_index`. """
+    index = pd.read_csv(index_file, dtype={'param': str}, float_precision='round_trip')
+    for column in ['time', 'valid_time']:
+        index[column] = pd.to_datetime(index[column])
+    return index
+
+
+def build_index(path, index_file=None):
+    """ Index of the messages of a GRIB file.
+
+    Parameters
+    ==========
+    path : string
+    index_file : string, optional
+        Persistent index, by default <path>.index.csv. An existing index
+        is reused unless the file size or modification time changed.
+        False to neither read nor write an index file.
+
+    Returns
+    =======
+    index : pandas DataFrame
+        One row per message with the columns in `COLUMNS`.
+    """
+    index_file = path + INDEX_SUFFIX if index_file is None else index_file
+    st = os.stat(path)
+    if index_file and os.path.exists(index_file):
+        index = read_index(index_file)
+        if len(index) and (index['file_size'] == st.st_size).all() \
+                and (index['file_mtime'] == st.st_mtime).all():
+            return index
+    index = pd.DataFrame(scan_file(path), columns=COLUMNS)
+    for column in ['time', 'valid_time']:
+        index[column] = pd.to_datetime(index[column])
+    if index_file:
+        index.to_csv(index_file, index=False)
+    return index
+
+
+def _unpack(data, bits, first_bits):
+    """ Unsigned integers of `bits` bits starting at the bit offsets
+    `first_bits` of a bit stream.
+    """
+    first_bits = np.asarray(first_bits, dtype=np.int64)
+    nbytes = (bits + 7)//8 + 1
+    data = np.concatenate([np.frombuffer(data, dtype=np.uint8), np.zeros(nbytes, np.uint8)])
+    words = np.zeros(first_bits.shape, dtype=np.uint64)
+    start = first_bits//8
+    for k in range(nbytes):
+        words = (words << np.uint64(8)) | data[start + k].astype(np.uint64)
+    shift = (8*nbytes - first_bits % 8 - bits).astype(np.uint64)
+    return (words >> shift) & np.uint64((1 << bits) - 1)
+
+
+class GribFile:
+    """ Random access to the messages of an indexed GRIB file.
+
+    Parameters
+    ==========
+    path : string
+    index_file : string, optional
+        See `build_index`.
+    """
+
+    def __init__(self, path, index_file=None):
+        self.path = path
+        self.index = build_index(path, index_file)
+
+    def select(self, **keys):
+        """ Index rows matching all `keys`, each a value or a list of
+        values of an index column, e.g. name='u10' or step=[0, 1].
+        """
+        mask = np.ones(len(self.index), dtype=bool)
+        for key, value in keys.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= self.index[key].isin(values).to_numpy()
+        return self.index[mask]
+
+    def _read(self, f, offset, length):
+        f.seek(offset)
+        return f.read(length)
+
+    def coordinates(self, row):
+        """ Latitudes and longitudes of the rows and columns of the grid of
+        a message (regular latitude-longitude grids only).
+        """
+        return (np.linspace(row['lat1'], row['lat2'], int(row['nj'])),
+                np.linspace(row['lon1'], row['lon1'] + (row['lon2'] - row['lon1']) % 360.,
+                    int(row['ni'])))
+
+    def _position(self, row, lat, lon):
+        """ Position in the scanned values of the nearest grid point, -1
+        outside the grid.
+        """
+        ni, nj = int(row['ni']), int(row['nj'])
+        dlat = (row['lat2'] - row['lat1'])/(nj - 1) if nj > 1 else 1.
+        dlon = ((row['lon2'] - row['lon1']) % 360.)/(ni - 1) if ni > 1 else 1.
+        j = int(round((lat - row['lat1'])/dlat))
+        i = int(round(((lon - row['lon1']) % 360.)/dlon))
+        if ni > 1 and i == round(360./dlon):
+            i = 0
+        if not (0 <= i < ni and 0 <= j < nj):
+            return -1
+        return i*nj + j if int(row['scan_mode']) & 0x20 else j*ni + i
+
+    def _scale(self, row, packed):
+        return ((row['reference'] + packed*2.**row['binary_scale'])
+                / 10.**row['decimal_scale'])
+
+    def _decode_other(self, f, row):
+        """ Values of a message in scanning order, decoded with eccodes. """
+        if eccodes is None:
+            raise ImportError('Decoding message at %d of %s needs eccodes' % (row['offset'],
+                    self.path))
+        handle = eccodes.codes_new_from_message(self._read(f, row['offset'], row['length']))
+        try:
+            values = eccodes.codes_get_values(handle).astype(float)
+            if eccodes.codes_get(handle, 'bitmapPresent'):
+                values[values == eccodes.codes_get(handle, 'missingValue')] = np.nan
+        finally:
+            eccodes.codes_release(handle)
+        return values
+
+    def _decode(self, f, row):
+        """ Values of a message in scanning order. """
+        if row['packing'] != 'simple':
+            return self._decode_other(f, row)
+        size = int(row['ni'])*int(row['nj'])
+        valid = np.ones(size, dtype=bool)
+        if row['bitmap_offset'] >= 0:
+            bitmap = self._read(f, int(row['bitmap_offset']), (size + 7)//8)
+            valid = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8))[:size].astype(bool)
+        values = np.full(size, np.nan)
+        bits, count = int(row['bits']), int(valid.sum())
+        if bits == 0:
+            values[valid] = self._scale(row, 0.)
+        else:
+            data = self._read(f, int(row['data_offset']), (count*bits + 7)//8)
+            values[valid] = self._scale(row, _unpack(data, bits, np.arange(count)*bits))
+        return values
+
+    def field(self, row):
+        """ Decoded field of a message (an index row), shape (nj, ni) in
+        the order of `coordinates`, NaN where missing.
+        """
+        with open(self.path, 'rb') as f:
+            values = self._decode(f, row)
+        ni, nj = int(row['ni']), int(row['nj'])
+        if int(row['scan_mode']) & 0x20:
+            return values.reshape(ni, nj).T
+        return values.reshape(nj, ni)
+
+    def point(self, row, lat, lon, f=None):
+        """ Value of a message (an index row) at the grid point nearest to
+        (lat, lon), NaN outside the grid or where missing. Only the bytes
+        of that point (and the bitmap before it) are read for simple
+        packing.
+        """
+        if f is None:
+            with open(self.path, 'rb') as f:
+                return self.point(row, lat, lon, f)
+        position = self._position(row, lat, lon)
+        if position < 0:
+            return np.nan
+        if row['packing'] != 'simple':
+            return float(self._decode_other(f, row)[position])
+        if row['bitmap_offset'] >= 0:
+            bitmap = np.unpackbits(np.frombuffer(
+                self._read(f, int(row['bitmap_offset']), position//8 + 1), dtype=np.uint8))
+            if not bitmap[position]:
+                return np.nan
+            position = int(bitmap[:position].sum())
+        bits = int(row['bits'])
+        if bits == 0:
+            return float(self._scale(row, 0.))
+        first_byte = position*bits//8
+        data = self._read(f, int(row['data_offset']) + first_byte, (bits + 7)//8 + 1)
+        packed = _unpack(data, bits, [position*bits - 8*first_byte])[0]
+        return float(self._scale(row, float(packed)))
+
+    def point_values(self, lat, lon, **keys):
+        """ Values at the grid point nearest to (lat, lon) of the messages
+        selected by `keys` (see `select`).
+
+        Returns
+        =======
+        values : pandas DataFrame
+            Columns name, level, time, step, valid_time and value, sorted
+            by name and valid time.
+        """
+        rows = self.select(**keys)
+        with timer('grib.point_values'), open(self.path, 'rb') as f:
+            values = [self.point(row, lat, lon, f) for _, row in rows.iterrows()]
+        result = rows[['name', 'level', 'time', 'step', 'valid_time']].assign(value=values)
+        return result.sort_values(['name', 'valid_time', 'step']).reset_index(drop=True)
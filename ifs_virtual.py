@@ -0,0 +1,402 @@
+""" Virtual IFS forecast dataset over many daily files, by valid time.
+
+The MARS downloads are one file per day (`mars_download.py`), with the
+00 and 12 UTC runs and their steps. A reference index lists, for every
+field of every file, its valid time, run time, step and where it is
+stored: the time and step indices of a NetCDF file, or the message
+offset and the number of the field in the message of a GRIB file (see
+`grib_index`; GRIB2 messages may hold several fields). The index only needs the
+coordinates of the files, and is kept as a JSON file, so that later
+sessions open it without scanning or opening any forecast file:
+
+    index = build_index(ifs_dir, pattern='ifs_fc_*.nc', index_file=ifs_dir + 'ifs_refs.json')
+    ifs = VirtualForecasts(ifs_dir + 'ifs_refs.json')
+    values = ifs.points(lat, lon, ['t2m', 'msl'], times=df.index)
+
+The forecasts form one cube indexed by valid time: where runs overlap,
+the field with the shortest lead time is used. Only the files holding
+the selected valid times are opened, a few at a time.
+
+The MARS NetCDF conversion keeps only the valid times; their run is
+taken to be the last of `runs` (hours of the day) at or before the valid
+time on the day of the file, which is exact for the 00/12 runs with
+steps 0 to 11 of `mars_download.py`.
+"""
+import collections
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from grib_index import GribFile
+from instrumentation import timer
+from grib_index import build_index as build_grib_index
+from streaming import netcdf_lock, prefetch_map
+
+COLUMNS = ['file', 'name', 'valid_time', 'time', 'step', 'time_index', 'step_index', 'offset',
+        'field']
+
+# Hours of the day of the forecast runs in files without steps
+RUNS = (0, 12)
+
+# Files kept open by `VirtualForecasts`
+MAX_OPEN_FILES = 16
+
+# Version 2 added the field number of GRIB references
+INDEX_VERSION = 2
+
+
+def _is_grib(path):
+    return path.endswith(('.grib', '.grb', '.grib1', '.grib2', '.grb2'))
+
+
+def _file_date(path):
+    """ Date of a daily file from a YYYYMMDD in its name, or None. """
+    match = re.search(r'(\d{8})', os.path.basename(path))
+    return pd.Timestamp(match.group(1)) if match else None
+
+
+def _grib_fields(index):
+    """ GRIB index by message offset and number of the field in the
+    message.
+    """
+    index = index.assign(field=index.groupby('offset').cumcount())
+    return index.set_index(['offset', 'field'], drop=False)
+
+
+def _scan_grib(path):
+    index = _grib_fields(build_grib_index(path, index_file=False))
+    return [{'name': row['name'], 'valid_time': row['valid_time'], 'time': row['time'],
+            'step': row['step'], 'time_index': -1, 'step_index': -1, 'offset': int(row['offset']),
+            'field': int(row['field'])}
+            for _, row in index.iterrows()], sorted(set(index['name']))
+
+
+def _scan_netcdf(path, runs):
+    with netcdf_lock, xr.open_dataset(path) as ds:
+        names = sorted(name for name in ds.data_vars if {'latitude', 'longitude'} <= set(ds[name].dims))
+        if 'step' in ds.dims:
+            times = pd.to_datetime(ds['time'].values)
+            steps = pd.to_timedelta(ds['step'].values)/pd.Timedelta(hours=1)
+            return [{'name': '', 'valid_time': time + pd.Timedelta(hours=step), 'time': time,
+                    'step': float(step), 'time_index': i, 'step_index': k, 'offset': -1,
+                    'field': -1}
+                    for i, time in enumerate(times) for k, step in enumerate(steps)], names
+        dim = 'valid_time' if 'valid_time' in ds.dims else 'time'
+        valid_times = pd.to_datetime(ds[dim].values)
+    day = _file_date(path)
+    records = []
+    for i, valid_time in enumerate(valid_times):
+        base = day if day is not None else valid_time.floor('D')
+        run_times = [base + pd.Timedelta(hours=run) for run in runs]
+        started = [time for time in run_times if time <= valid_time]
+        time = max(started) if started else valid_time
+        records.append({'name': '', 'valid_time': valid_time, 'time': time,
+                'step': (valid_time - time)/pd.Timedelta(hours=1), 'time_index': i,
+                'step_index': -1, 'offset': -1, 'field': -1})
+    return records, names
+
+
+def scan_file(path, runs=RUNS):
+    """ References of the fields of a NetCDF or GRIB forecast file.
+
+    Returns
+    =======
+    records : list of dictionaries
+        The keys in `COLUMNS` except 'file'. The name is '' for the
+        records of NetCDF files, which hold all variables.
+    names : list of strings
+        Variables of the file.
+    """
+    if _is_grib(path):
+        return _scan_grib(path)
+    return _scan_netcdf(path, runs)
+
+
+def read_index(index_file):
+    """ Read a reference index written by `build_index`.
+
+    Returns
+    =======
+    files : list of dictionaries
+        'path', 'size', 'mtime' and 'names' of the indexed files.
+    refs : pandas DataFrame
+        One row per field with the columns in `COLUMNS`, 'file' being
+        the position in `files`.
+    """
+    with open(index_file) as f:
+        index = json.load(f)
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError('Unsupported version %s of IFS index %s' % (index.get('version'),
+                index_file))
+    refs = pd.DataFrame(index['refs'], columns=COLUMNS)
+    for column in ['valid_time', 'time']:
+        refs[column] = pd.to_datetime(refs[column]).astype('datetime64[ns]')
+    return index['files'], refs
+
+
+def write_index(files, refs, index_file):
+    """ Write a reference index as JSON, with the references by column. """
+    refs = refs.assign(valid_time=refs['valid_time'].dt.strftime('%Y-%m-%dT%H:%M:%S'),
+            time=refs['time'].dt.strftime('%Y-%m-%dT%H:%M:%S'))
+    index = {'version': INDEX_VERSION, 'files': files,
+            'refs': {column: refs[column].tolist() for column in COLUMNS}}
+    tmp = index_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, index_file)
+    return index_file
+
+
+def build_index(paths, pattern='ifs_fc_*', index_file=None, runs=RUNS, workers=8):
+    """ Reference index of IFS forecast files.
+
+    Parameters
+    ==========
+    paths : string or list of strings
+        Directory (searched with `pattern`) or list of NetCDF and GRIB
+        files.
+    pattern : string, optional
+        Glob pattern of the files in a directory.
+    index_file : string, optional
+        If given, the existing index is updated (only new or modified
+        files are scanned, removed files are dropped) and written back.
+    runs : tuple of ints, optional
+        Hours of the runs, for files without steps.
+    workers : int, optional
+        Number of files scanned in parallel (threads, NetCDF files are
+        read one at a time).
+
+    Returns
+    =======
+    files, refs :
+        See `read_index`.
+    """
+    if isinstance(paths, str):
+        paths = sorted(path for path in glob.glob(os.path.join(paths, pattern))
+                if not path.endswith('.index.csv'))
+    paths = [os.path.abspath(path) for path in paths]
+
+    known = {}
+    files = []
+    if index_file is not None and os.path.exists(index_file):
+        try:
+            files, refs = read_index(index_file)
+        except ValueError:
+            # Index of another version, all files are scanned again
+            files = []
+        for number, info in enumerate(files):
+            path = info['path']
+            if path in paths:
+                st = os.stat(path)
+                if st.st_size == info['size'] and st.st_mtime == info['mtime']:
+                    known[path] = (info, refs[refs['file'] == number])
+    todo = [path for path in paths if path not in known]
+    for path, (records, names) in prefetch_map(lambda path: scan_file(path, runs), todo,
+            workers=workers):
+        st = os.stat(path)
+        known[path] = ({'path': path, 'size': st.st_size, 'mtime': st.st_mtime, 'names': names},
+                pd.DataFrame(records, columns=COLUMNS))
+
+    files, frames = [], []
+    for number, path in enumerate(sorted(known)):
+        info, refs = known[path]
+        files.append(info)
+        frames.append(refs.assign(file=number))
+    refs = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    for column in ['valid_time', 'time']:
+        refs[column] = pd.to_datetime(refs[column]).astype('datetime64[ns]')
+    refs = refs.astype({column: int for column in
+            ['file', 'time_index', 'step_index', 'offset', 'field']})
+    if index_file is not None:
+        write_index(files, refs, index_file)
+    return files, refs
+
+
+class VirtualForecasts:
+    """ IFS forecasts of many files as one cube indexed by valid time,
+    with the shortest lead time where runs overlap.
+
+    Parameters
+    ==========
+    index_file : string
+        Reference index written by `build_index`.
+    """
+
+    def __init__(self, index_file):
+        self.files, self.refs = read_index(index_file)
+        self._selected = {}
+        self._open = collections.OrderedDict()
+
+    @property
+    def names(self):
+        """ Variables of the indexed files. """
+        return sorted(set(name for info in self.files for name in info['names']))
+
+    def references(self, name):
+        """ References of a variable, one per valid time (the shortest
+        lead time), as a DataFrame indexed by valid time.
+        """
+        if name not in self._selected:
+            files = [number for number, info in enumerate(self.files) if name in info['names']]
+            refs = self.refs[self.refs['file'].isin(files)
+                    & self.refs['name'].isin(['', name])]
+            refs = refs.sort_values(['valid_time', 'step'], kind='stable')
+            refs = refs.drop_duplicates('valid_time').set_index('valid_time')
+            self._selected[name] = refs
+        return self._selected[name]
+
+    def valid_times(self, name):
+        """ Valid times of a variable. """
+        return self.references(name).index
+
+    def _file(self, number):
+        """ Open xarray Dataset or GribFile of an indexed file. """
+        if number in self._open:
+            self._open.move_to_end(number)
+            return self._open[number]
+        path = self.files[number]['path']
+        if _is_grib(path):
+            opened = GribFile(path)
+        else:
+            with netcdf_lock:
+                opened = xr.open_dataset(path)
+        self._open[number] = opened
+        while len(self._open) > MAX_OPEN_FILES:
+            _, closed = self._open.popitem(last=False)
+            if isinstance(closed, xr.Dataset):
+                closed.close()
+        return opened
+
+    def close(self):
+        """ Close the open files. """
+        for opened in self._open.values():
+            if isinstance(opened, xr.Dataset):
+                opened.close()
+        self._open.clear()
+
+    def _select(self, name, times=None, start=None, end=None, tolerance=None):
+        refs = self.references(name)
+        if times is None:
+            return refs.loc[start:end]
+        times = pd.DatetimeIndex(pd.to_datetime(times))
+        if times.tz is not None:
+            times = times.tz_convert(None)
+        if not len(refs):
+            return pd.DataFrame({'file': -1, 'step': np.nan}, index=times)
+        positions = refs.index.get_indexer(times, method='nearest',
+                tolerance=pd.Timedelta(tolerance) if tolerance is not None else None)
+        selected = refs.iloc[np.where(positions < 0, 0, positions)].copy()
+        selected.loc[positions < 0, 'file'] = -1
+        selected.index = times
+        return selected
+
+    def _netcdf_values(self, ds, name, refs, lat=None, lon=None):
+        da = ds[name]
+        if lat is not None:
+            longitudes = ds['longitude'].values
+            lon = lon % 360. if longitudes.max() > 180. else (lon + 180.) % 360. - 180.
+            da = da.sel(latitude=lat, longitude=lon, method='nearest')
+        selection = {'time': xr.DataArray(refs['time_index'].to_numpy(), dims='record')}
+        if 'step' in da.dims:
+            selection['step'] = xr.DataArray(refs['step_index'].to_numpy(), dims='record')
+        elif 'valid_time' in da.dims:
+            selection = {'valid_time': selection['time']}
+        with netcdf_lock:
+            return da.isel(selection).values
+
+    def points(self, lat, lon, names, times=None, start=None, end=None, tolerance=None):
+        """ Values at the grid point nearest to a location.
+
+        Parameters
+        ==========
+        lat, lon : float
+            Location [degrees].
+        names : list of strings
+        times : array of datetimes, optional
+            Times to look up, each matched to the nearest valid time.
+            By default all valid times between `start` and `end`.
+        start, end : datetime-like, optional
+        tolerance : timedelta-like, optional
+            Largest difference of `times` to the valid time, NaN beyond.
+
+        Returns
+        =======
+        values : pandas DataFrame
+            Index `times` (or the valid times) and one column per name,
+            plus the lead time [hours] of each name, <name>_step.
+        """
+        columns = []
+        with timer('ifs.points'):
+            for name in names:
+                refs = self._select(name, times, start, end, tolerance)
+                values = np.full(len(refs), np.nan)
+                for number in np.unique(refs['file']):
+                    if number < 0:
+                        continue
+                    rows = np.flatnonzero(refs['file'].to_numpy() == number)
+                    opened = self._file(number)
+                    if isinstance(opened, GribFile):
+                        index = _grib_fields(opened.index)
+                        keys = zip(refs['offset'].to_numpy()[rows], refs['field'].to_numpy()[rows])
+                        with open(opened.path, 'rb') as f:
+                            values[rows] = [opened.point(index.loc[key], lat, lon, f)
+                                    for key in keys]
+                    else:
+                        values[rows] = self._netcdf_values(opened, name, refs.iloc[rows],
+                                lat, lon)
+                columns.append(pd.DataFrame({name: values, name + '_step':
+                        np.where(refs['file'] >= 0, refs['step'], np.nan)}, index=refs.index))
+        if not columns:
+            return pd.DataFrame(index=pd.DatetimeIndex([]))
+        return pd.concat(columns, axis=1)
+
+    def field(self, name, valid_time, tolerance=None):
+        """ Field of a variable at the valid time nearest to `valid_time`.
+
+        Parameters
+        ==========
+        name : string
+        valid_time : datetime-like
+        tolerance : timedelta-like, optional
+            Largest difference of `valid_time` to the valid time of the
+            field.
+
+        Returns
+        =======
+        field : xarray DataArray
+            On (latitude, longitude), with the run time and step as
+            attributes.
+
+        Raises
+        ======
+        KeyError
+            If the variable is not indexed, or there is no field within
+            `tolerance`.
+        """
+        if not len(self.references(name)):
+            raise KeyError(name)
+        ref = self._select(name, [valid_time], tolerance=tolerance).iloc[0]
+        if ref['file'] < 0:
+            raise KeyError('No %s field within %s of %s' % (name, tolerance, valid_time))
+        with timer('ifs.field'):
+            opened = self._file(int(ref['file']))
+            if isinstance(opened, GribFile):
+                row = _grib_fields(opened.index).loc[(ref['offset'], ref['field'])]
+                lats, lons = opened.coordinates(row)
+                values = opened.field(row)
+            else:
+                da = opened[name]
+                selection = {da.dims[0]: int(ref['time_index'])}
+                if 'step' in da.dims:
+                    selection['step'] = int(ref['step_index'])
+                with netcdf_lock:
+                    values = da.isel(selection).values
+                lats, lons = opened['latitude'].values, opened['longitude'].values
+        return xr.DataArray(values, dims=('latitude', 'longitude'),
+                coords={'latitude': lats, 'longitude': lons}, name=name,
+                attrs={'time': str(ref['time']), 'step': float(ref['step'])})
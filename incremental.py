@@ -0,0 +1,233 @@
+""" Incremental collocation: only new products are extracted.
+
+A collocation store keeps, for each extraction configuration (the
+extraction function and its arguments), the samples of all runs and a
+ledger of the (buoy, product) pairs that were processed:
+
+    <store_dir>/specs.json                      spec hash -> configuration
+    <store_dir>/ledger.jsonl                    one line per processed pair
+    <store_dir>/<spec hash>/part-<n>/           samples of one run, a crop
+                                                store (see `crop_store`)
+
+A run only extracts the tasks that are not in the ledger for the spec,
+writes the new samples to a new part and then appends them to the
+ledger, so that an interrupted run is simply repeated. Changing any
+argument of the extraction changes the spec hash and starts a new set
+of samples.
+"""
+import datetime
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from crop_store import CropStore, CropStoreWriter, read_table
+from streaming import collocate, prefetch_map
+
+# Statuses that are not repeated by later runs; tasks that failed or had
+# no in situ observation (which may arrive later) are retried
+FINAL_STATUSES = ('ok', 'empty')
+
+
+def extraction_spec(func, **kwargs):
+    """ Configuration of an extraction: the qualified name of `func` and
+    its keyword arguments.
+    """
+    return {'function': '%s.%s' % (func.__module__, func.__qualname__), 'kwargs': kwargs}
+
+
+def spec_hash(spec):
+    """ Short content hash of an extraction configuration. """
+    text = json.dumps(spec, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+class Ledger:
+    """ Persistent record of the processed (buoy, product, spec) tuples.
+
+    Parameters
+    ==========
+    path : string
+        JSON lines file, created if needed. Later lines override earlier
+        lines for the same tuple.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[(entry['buoy'], entry['product'], entry['spec'])] = entry
+
+    def status(self, buoy, product, spec):
+        entry = self.entries.get((buoy, str(product), spec))
+        return None if entry is None else entry['status']
+
+    def is_done(self, buoy, product, spec):
+        return self.status(buoy, product, spec) in FINAL_STATUSES
+
+    def pending(self, tasks, spec):
+        """ Tasks not yet done for `spec`. """
+        for task in tasks:
+            if not self.is_done(task.buoy, task.product, spec):
+                yield task
+
+    def record(self, entries):
+        """ Append entries (dictionaries with buoy, product, spec and
+        status) to the ledger.
+        """
+        with open(self.path, 'a') as f:
+            for entry in entries:
+                self.entries[(entry['buoy'], entry['product'], entry['spec'])] = entry
+                f.write(json.dumps(entry, default=str) + '\n')
+
+    def counts(self, spec=None):
+        """ Number of tuples per status. """
+        return pd.Series([e['status'] for e in self.entries.values()
+                if spec is None or e['spec'] == spec], dtype=object).value_counts().to_dict()
+
+
+def _register_spec(store_dir, spec):
+    path = os.path.join(store_dir, 'specs.json')
+    specs = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            specs = json.load(f)
+    key = spec_hash(spec)
+    if key not in specs:
+        specs[key] = spec
+        with open(path, 'w') as f:
+            json.dump(specs, f, indent=2, default=str)
+    return key
+
+
+def _parts(store_dir, key):
+    return sorted(glob.glob(os.path.join(store_dir, key, 'part-*')))
+
+
+def update(store_dir, tasks, extract, spec, in_situ=None, tolerance='30min', fields=(),
+        shape=None, workers=4, prefetch=None, executor=None):
+    """ Extract and collocate the tasks not yet processed for `spec` and
+    add the samples to the store.
+
+    Parameters
+    ==========
+    store_dir : string
+        Root directory of the collocation store.
+    tasks : iterable of streaming.Task
+    extract : callable
+        extract(task) returns a dictionary of parameters or None, see
+        `streaming.extractor`. Must correspond to `spec`.
+    spec : dictionary
+        Extraction configuration, see `extraction_spec`.
+    in_situ, tolerance :
+        See `streaming.iter_samples`.
+    fields : sequence of strings, optional
+        Keys of crop arrays to store, with shape `shape`. Only scalars are
+        stored by default.
+    shape : tuple of ints, optional
+    workers, prefetch, executor :
+        See `streaming.prefetch_map`.
+
+    Returns
+    =======
+    counts : dictionary
+        Number of tasks of this run per status ('ok', 'empty',
+        'no_observation', 'failed').
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    key = _register_spec(store_dir, spec)
+    ledger = Ledger(os.path.join(store_dir, 'ledger.jsonl'))
+    parts = _parts(store_dir, key)
+    part_dir = os.path.join(store_dir, key, 'part-%05d' % (
+        int(os.path.basename(parts[-1])[5:]) + 1 if parts else 0))
+
+    entries = []
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def failed(task, error):
+        entries.append({'buoy': task.buoy, 'product': task.product, 'spec': key,
+                'status': 'failed', 'time': now, 'error': repr(error)})
+
+    fields = list(fields)
+    writer = CropStoreWriter(part_dir, shape or (), fields)
+    try:
+        for task, params in prefetch_map(extract, ledger.pending(tasks, key), workers=workers,
+                prefetch=prefetch, executor=executor, on_error=failed):
+            sample = None if params is None else collocate(task, params, in_situ, tolerance)
+            if params is None:
+                status = 'empty'
+            elif sample is None:
+                status = 'no_observation'
+            elif writer.append(sample, {k: v for k, v in sample.items()
+                    if k not in fields and pd.api.types.is_scalar(v)}):
+                status = 'ok'
+            else:
+                status = 'empty'
+            entries.append({'buoy': task.buoy, 'product': task.product, 'spec': key,
+                    'status': status, 'time': now})
+    except BaseException:
+        writer.abort()
+        shutil.rmtree(part_dir, ignore_errors=True)
+        raise
+    if len(writer):
+        writer.close()
+    else:
+        writer.abort()
+        shutil.rmtree(part_dir, ignore_errors=True)
+    # Only recorded once the part is complete
+    ledger.record(entries)
+    return pd.Series([e['status'] for e in entries], dtype=object).value_counts().to_dict()
+
+
+def load_table(store_dir, spec):
+    """ Samples of all runs for `spec`, with a 'part' and an 'index'
+    column locating the crops; for products collocated several times
+    (e.g. after a retry) the latest sample is kept.
+    """
+    key = spec if isinstance(spec, str) else spec_hash(spec)
+    tables = []
+    for part in _parts(store_dir, key):
+        table = read_table(part)
+        table.insert(0, 'part', os.path.basename(part))
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame()
+    table = pd.concat(tables, ignore_index=True)
+    return table.drop_duplicates(['buoy', 'product'], keep='last').reset_index(drop=True)
+
+
+def open_parts(store_dir, spec):
+    """ Crop stores of the runs for `spec`, part name -> CropStore. """
+    key = spec if isinstance(spec, str) else spec_hash(spec)
+    return {os.path.basename(part): CropStore(part) for part in _parts(store_dir, key)}
+
+
+def compact(store_dir, spec):
+    """ Merge the parts of `spec` into a single part, dropping superseded
+    samples.
+    """
+    key = spec if isinstance(spec, str) else spec_hash(spec)
+    parts = _parts(store_dir, key)
+    if len(parts) < 2:
+        return
+    table = load_table(store_dir, key)
+    stores = open_parts(store_dir, key)
+    fields = sorted(set.intersection(*(set(s.arrays) for s in stores.values())))
+    shape = next(iter(stores.values())).arrays[fields[0]].shape[1:] if fields else ()
+    merged_dir = os.path.join(store_dir, key, 'part-%05d' % (
+        int(os.path.basename(parts[-1])[5:]) + 1))
+    with CropStoreWriter(merged_dir, shape, fields) as writer:
+        for row in table.to_dict('records'):
+            store = stores[row.pop('part')]
+            i = row.pop('index')
+            writer.append({field: store.arrays[field][i] for field in fields}, row)
+    for part in parts:
+        shutil.rmtree(part)
+    return merged_dir
@@ -0,0 +1,184 @@
+""" Per-stage timing and I/O counters for extraction and collocation runs.
+
+The extraction functions, the IFS and GRIB point lookups (`ifs_virtual`,
+`grib_index`) and the streaming collocation time their stages with
+`timer`. Opened files and their size are counted with `record_open`,
+the bytes of the arrays actually read with `record_read`, and cache
+lookups with `record_cache`. A driver script writes the collected
+numbers with `write_summary`, e.g.
+
+    import instrumentation
+    with instrumentation.profile_run('crop_sar'):
+        ...
+    instrumentation.write_summary('crop_sar_metrics.json')
+
+Environment variables:
+
+SATDATA_METRICS_FILE : if set, the summary is written to this file when
+    the process exits. '{pid}' in the name is replaced by the process id,
+    so that each worker of a multiprocessing pool writes its own file.
+SATDATA_PROFILE : 'cprofile' or 'pyinstrument' to profile the code run
+    inside `profile_run`.
+"""
+import atexit
+import collections
+import contextlib
+import functools
+import json
+import os
+import time
+
+import numpy as np
+
+METRICS_FILE_ENV = 'SATDATA_METRICS_FILE'
+PROFILE_ENV = 'SATDATA_PROFILE'
+
+_durations = collections.defaultdict(list)
+_counters = collections.Counter()
+_cache = collections.defaultdict(collections.Counter)
+_start = time.time()
+
+
+def reset():
+    """ Forget all recorded timings and counters. """
+    global _start
+    _durations.clear()
+    _counters.clear()
+    _cache.clear()
+    _start = time.time()
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """ Context manager recording the wall time spent in `stage`. """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _durations[stage].append(time.perf_counter() - t0)
+
+
+def timed(stage):
+    """ Decorator recording the wall time of each call as `stage`. """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """ Increment the counter `name` by `n`. """
+    _counters[name] += n
+
+
+def record_open(path):
+    """ Count an opened file and its size in bytes. """
+    _counters['files_opened'] += 1
+    try:
+        _counters['bytes_opened'] += os.path.getsize(path)
+    except (OSError, TypeError):
+        pass
+
+
+def record_read(nbytes):
+    """ Count `nbytes` bytes of data read into memory (e.g. the `nbytes`
+    of the arrays loaded from an opened file).
+    """
+    _counters['bytes_read'] += int(nbytes)
+
+
+def record_cache(name, hit):
+    """ Count a hit (`hit` True) or miss of the cache `name`. """
+    _cache[name]['hits' if hit else 'misses'] += 1
+
+
+def summary():
+    """ Summary of the recorded timings and counters.
+
+    Returns
+    =======
+    summary : dictionary
+        stages : stage -> count, total, mean, p50, p95 and max [s]
+        counters : counter name -> value
+        caches : cache name -> hits, misses and hit_rate
+        wall_time : seconds since import or the last `reset`
+    """
+    stages = {}
+    for stage, durations in sorted(_durations.items()):
+        d = np.asarray(durations)
+        stages[stage] = {
+            'count': int(d.size),
+            'total': float(d.sum()),
+            'mean': float(d.mean()),
+            'p50': float(np.percentile(d, 50)),
+            'p95': float(np.percentile(d, 95)),
+            'max': float(d.max()),
+        }
+    caches = {}
+    for name, c in sorted(_cache.items()):
+        lookups = c['hits'] + c['misses']
+        caches[name] = {'hits': c['hits'], 'misses': c['misses'],
+                'hit_rate': c['hits']/lookups if lookups else None}
+    return {
+        'pid': os.getpid(),
+        'wall_time': time.time() - _start,
+        'stages': stages,
+        'counters': dict(_counters),
+        'caches': caches,
+    }
+
+
+def write_summary(path):
+    """ Write `summary()` as JSON to `path` ('{pid}' is replaced by the
+    process id).
+    """
+    path = path.replace('{pid}', str(os.getpid()))
+    with open(path, 'w') as f:
+        json.dump(summary(), f, indent=2)
+    return path
+
+
+@contextlib.contextmanager
+def profile_run(name, output_dir='.'):
+    """ Profile the enclosed code if SATDATA_PROFILE is set.
+
+    With SATDATA_PROFILE=cprofile the statistics are written to
+    <output_dir>/<name>.<pid>.prof (view with snakeviz or pstats), with
+    SATDATA_PROFILE=pyinstrument an HTML report is written to
+    <output_dir>/<name>.<pid>.html.
+    """
+    profiler = os.environ.get(PROFILE_ENV, '').lower()
+    prefix = os.path.join(output_dir, '%s.%d' % (name, os.getpid()))
+    if profiler == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(prefix + '.prof')
+    elif profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(prefix + '.html', 'w') as f:
+                f.write(profile.output_html())
+    else:
+        yield
+
+
+def _write_summary_at_exit():
+    path = os.environ.get(METRICS_FILE_ENV)
+    if path and (_durations or _counters):
+        write_summary(path)
+
+
+atexit.register(_write_summary_at_exit)
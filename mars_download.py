@@ -31,6 +31,12 @@ from datetime import date, timedelta
 # 2) 2016, så resten
 # 3) 10u/10v slutten av 2011 (3-timers oppløsning)
 
+# "grib" keeps the archived format, several times smaller than the server
+# side NetCDF conversion; the files are read with grib_index.GribFile.
+# Simple packing is requested, as the CCSDS packing of the archived GRIB2
+# fields is only decoded with eccodes
+file_format = "netcdf"
+
 server = ECMWFService("mars")
 
 def daterange(start_date, end_date):
@@ -44,24 +50,26 @@ print("Retrieving for period {} to {}".format(start_date.strftime("%Y%m%d"), end
 
 for date in daterange(start_date, end_date):
     date_str = date.strftime("%Y%m%d")
-    filename = "ifs_fc_{}.nc".format(date_str)
+    filename = "ifs_fc_{}.{}".format(date_str, "nc" if file_format == "netcdf" else "grib")
 
     print("Retrieving {}".format(date_str))
 
-    server.execute(
-        {
-            "class": "od",
-            "date": date_str,
-            "expver": "1",
-            "levtype": "sfc",
-            "param": "148.128/151.128/167.128/168.128/3.228",
-            "step": "0/1/2/3/4/5/6/7/8/9/10/11",
-            "stream": "oper",
-            "time": "00/12",
-            "type": "fc",
-            "grid": "0.1/0.1",
-            "format": "netcdf"
-        },
-        filename)
+    request = {
+        "class": "od",
+        "date": date_str,
+        "expver": "1",
+        "levtype": "sfc",
+        "param": "148.128/151.128/167.128/168.128/3.228",
+        "step": "0/1/2/3/4/5/6/7/8/9/10/11",
+        "stream": "oper",
+        "time": "00/12",
+        "type": "fc",
+        "grid": "0.1/0.1",
+    }
+    if file_format == "netcdf":
+        request["format"] = "netcdf"
+    else:
+        request["packing"] = "simple"
+    server.execute(request, filename)
     
     print("Written {} to file {}".format(date_str, filename))
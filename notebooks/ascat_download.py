@@ -11,15 +11,47 @@ TODO:
 import eumdac
 import time
 import requests
+import urllib3
 import fnmatch
-import shutil
 import pickle
 import sys
+import os
+
+sys.path.append("..")
+from download_planning import (MAX_ROI_EXTENT, ROI_MARGIN, plan_downloads, product_dir,
+        product_key, read_manifest, record_download)
+from download_utils import RETRY_ERRORS, copy_stream, retry_call, stream_size
+from progress import Progress
 
 ####
 
-productname = "Endurance_8"
+# Buoys to download for (None for all); a product covering several buoys
+# is downloaded once, into <data_dir>/<key[:2]>/<key>/ (see
+# download_planning), and recorded in the manifest
+buoys = None
 data_dir = "/lustre/storeB/project/IT/geout/machine-ocean/data_raw/metop/"
+manifest_file = data_dir + "manifest.jsonl"
+
+# Keep the products in swath geometry (read with ascat_swath) instead of
+# reprojecting them with the Data Tailor: NetCDF products are downloaded
+# directly, without waiting on the customisation queue, the others are
+# only converted to NetCDF, without projection. ascat_index flags the
+# swath files and streaming.extractor reads them with ascat_swath
+native_swath = True
+
+# Half size [degrees] of the region around the buoys that is customised,
+# and largest size of the region of buoys sharing a customisation
+roi_margin = ROI_MARGIN
+max_roi_extent = MAX_ROI_EXTENT
+
+# The downloads are verified against the Content-Length of the streams.
+# The MD5 of the catalogue (product.md5) is of the whole product archive,
+# not of its entries or of customisation outputs, so there is no checksum
+# to verify them against
+# Failed transfers (also cut streams and size mismatches) are tried again,
+# up to download_retries times in total, and recorded as retry events
+download_retries = 3
+download_errors = RETRY_ERRORS + (urllib3.exceptions.HTTPError,)
 
 ####
 
@@ -45,42 +77,105 @@ with open('in_situ_obs_ascat_with_customisations.pickle', 'rb') as handle:
 
 datatailor = eumdac.DataTailor(token)
 
-chain = eumdac.tailor_models.Chain(
-     product='ASCATL1SZR',
-     format='netcdf4',
-     projection='geographic'
-)
+# Only the region around the buoys is customised and downloaded
+if native_swath:
+    chain_args = dict(product='ASCATL1SZR', format='netcdf4_satellite')
+else:
+    chain_args = dict(product='ASCATL1SZR', format='netcdf4', projection='geographic')
+
+# Each product once for each group of nearby buoys it covers
+tasks = plan_downloads(in_situ_obs, buoys, chain_args, roi_margin, max_roi_extent)
+downloads = read_manifest(manifest_file)
 
 ####
 
-if "nc_files" not in in_situ_obs[productname].keys():
-    in_situ_obs[productname]["nc_files"] = {}
+# JSON lines events of each product, and a Prometheus textfile for the
+# node exporter if SATDATA_PROM_DIR is set
+progress = Progress(
+    'ascat_download',
+    total=len(tasks),
+    events_file='ascat_download.jsonl',
+    textfile=os.path.join(os.environ["SATDATA_PROM_DIR"], 'ascat_download.prom')
+        if "SATDATA_PROM_DIR" in os.environ else None)
 
 print("Running customisations and downloading nc-files")
 
-for product in in_situ_obs[productname]["products"]:
+for task in tasks:
+    product = task.product
+    item = '%s/%s' % (product, task.key)
+
     # do not process products that are already downloaded
-    if str(product) in in_situ_obs[productname]["nc_files"].keys():
-        print(f"Product already processed and downloaded...skipping!")
-        continue        
-    
+    if all(str(product) in in_situ_obs[buoy].get("nc_files", {}) for buoy in task.buoys):
+        progress.skipped(item, reason="already downloaded")
+        continue
+
+    # downloaded for other buoys, as is or with the same customisation
+    direct_key = product_key(product)
+    done = [downloads[key] for key in [direct_key, task.key] if key in downloads
+            and os.path.exists(data_dir + downloads[key]["filename"])]
+    if done:
+        record_download(in_situ_obs, task, done[0]["filename"])
+        progress.skipped(item, reason="shared download")
+        continue
+
+    progress.started(item, buoys=task.buoys)
+
+    # Direct download of the NetCDF products, no customisation needed
+    if native_swath:
+        try:
+            entries = fnmatch.filter(product.entries, '*.nc')
+            if entries:
+                product_path = product_dir(data_dir, direct_key)
+                os.makedirs(product_path, exist_ok=True)
+                filename = os.path.relpath(
+                    os.path.join(product_path, os.path.basename(entries[0])), data_dir)
+                progress.status(item, "DOWNLOADING")
+
+                def fetch():
+                    with product.open(entry=entries[0]) as stream:
+                        return copy_stream(stream, data_dir + filename, size=stream_size(stream))
+
+                nbytes = retry_call(fetch, download_retries, errors=download_errors,
+                    on_retry=lambda attempt, error: progress.retry(item, attempt, error))
+                entry = record_download(in_situ_obs, task._replace(key=direct_key), filename,
+                    manifest_file)
+                downloads[direct_key] = entry
+                progress.finished(item, bytes=nbytes, filename=filename)
+                continue
+        except eumdac.EumdacError as error:
+            progress.failed(item, error, stage="download")
+            continue
+        except requests.exceptions.RequestException as error:
+            progress.failed(item, error, stage="download")
+            continue
+        except OSError as error:
+            # Incomplete download, nothing written to the final path
+            progress.failed(item, error, stage="download")
+            continue
+        except urllib3.exceptions.HTTPError as error:
+            # Stream cut after the retries
+            progress.failed(item, error, stage="download")
+            continue
+
     try:
+        chain = eumdac.tailor_models.Chain(roi=task.roi, **chain_args)
         customisation = datatailor.new_customisation(product, chain)
-        print(f"Customisation {customisation._id} started.")
+        progress.status(item, "STARTED", customisation=customisation._id)
     except eumdac.datatailor.DataTailorError as error:
-        print(f"Error related to the Data Tailor: '{error}'")
+        progress.failed(item, error, stage="customisation")
         continue
     except eumdac.EumdacError as error:
-        print("Unexpected eumdac error:", error)
+        progress.failed(item, error, stage="customisation")
         continue
     except requests.exceptions.HTTPError as error:
-        print(f"HTTP error: '{error.msg}'")
+        progress.failed(item, error, stage="customisation")
         continue
     except requests.exceptions.RequestException as error:
-        print(f"Unexpected error: {error}")
+        progress.failed(item, error, stage="customisation")
         continue
 
     status = "QUEUED"
+    last_status = None
     sleep_time = 10 # seconds
 
     # Customisation Loop
@@ -102,47 +197,62 @@ for product in in_situ_obs[productname]["products"]:
             print(f"Unexpected error: {error}")
             break
 
+        # Only status changes are recorded, the time spent queued or
+        # running is the difference of their times
+        if status != last_status:
+            progress.status(item, status, customisation=jobID)
+            last_status = status
         if "DONE" in status:
-            print(f"Customisation {jobID} is successfully completed.")
             break
         elif status in ["ERROR","FAILED","DELETED","KILLED","INACTIVE"]:
             print(f"Customisation {jobID} was unsuccessful. Customisation log is printed.\n")
             print(customisation.logfile)
             break
-        elif "QUEUED" in status:
-            print(f"Customisation {jobID} is queued.")
-        elif "RUNNING" in status:
-            print(f"Customisation {jobID} is running.")
         time.sleep(sleep_time)
     
     try:
         if len(customisation.outputs) < 1:
-            print("...NO FILES AVAILABLE FOR DOWNLOADING...", flush=True)
+            progress.failed(item, stage="download", error="no files available for downloading")
             continue
 
         jobID = customisation._id
-        print(f"\tStarting to download the NetCDF output of the customisation {jobID}")
+        progress.status(item, "DOWNLOADING", customisation=jobID)
 
         nc, = fnmatch.filter(customisation.outputs, '*.nc')
 
-        with customisation.stream_output(nc,) as stream, \
-                open(data_dir + stream.name, mode='wb') as fdst:
-            shutil.copyfileobj(stream, fdst)
-            in_situ_obs[productname]["nc_files"][str(product)] = stream.name
+        product_path = product_dir(data_dir, task.key)
+        os.makedirs(product_path, exist_ok=True)
+
+        def fetch():
+            with customisation.stream_output(nc,) as stream:
+                nbytes = copy_stream(stream, os.path.join(product_path, stream.name),
+                    size=stream_size(stream))
+                return nbytes, stream.name
+
+        nbytes, name = retry_call(fetch, download_retries, errors=download_errors,
+            on_retry=lambda attempt, error: progress.retry(item, attempt, error))
+        filename = os.path.relpath(os.path.join(product_path, name), data_dir)
+        downloads[task.key] = record_download(in_situ_obs, task, filename, manifest_file)
     except eumdac.customisation.CustomisationError as error:
-        print(f"Data Tailor Error", error)
+        progress.failed(item, error, stage="download")
         continue
     except eumdac.EumdacError as error:
-        print("Unexpected eumdac error:", error)
+        progress.failed(item, error, stage="download")
         continue
     except requests.exceptions.HTTPError as error:
-        print(f"HTTP error: '{error.msg}'")
+        progress.failed(item, error, stage="download")
         continue
     except requests.exceptions.RequestException as error:
-        print(f"Unexpected error: {error}")
+        progress.failed(item, error, stage="download")
+        continue
+    except OSError as error:
+        progress.failed(item, error, stage="download")
+        continue
+    except urllib3.exceptions.HTTPError as error:
+        progress.failed(item, error, stage="download")
         continue
 
-    print(f"\tDeleting the customisation {jobID}")
+    progress.finished(item, bytes=nbytes, filename=filename)
 
     try:
         customisation.delete()
@@ -159,8 +269,7 @@ for product in in_situ_obs[productname]["products"]:
         print("Unexpected error:", error)
         continue
 
-    print(f"\tFinished dowloading the NetCDF output and deleted the customisation {jobID}", flush=True)
-
+progress.close()
 print("All customisations done and nc-files downloaded")
 
 # pickle dict with file names
@@ -14,6 +14,9 @@ utc_timezone = pytz.timezone("UTC")
 sys.path.append("../../nansat/")
 sys.path.append("../../..")
 import sar
+from instrumentation import profile_run, reset, timer, write_summary
+from progress import Progress
+from result_cache import ResultCache
 
 
 ##### read pickled imported in-situ measurements metadata with attached colocated Sentinel-1 sat products metadata
@@ -34,10 +37,19 @@ def crop_images_one_buoy(buoy):
         
     station_lat = in_situ_obs[buoy]['lat'][0]
     station_lon = in_situ_obs[buoy]['lon'][0]
-    print(buoy)
     count_products = 0
     count_not_available = 0
     crop_size = [3, 9]
+    # One events file per buoy, as the buoys are cropped in parallel
+    progress = Progress('crop_sar_' + buoy,
+            total=len(in_situ_obs[buoy]['products'])*len(crop_size),
+            events_file='crop_sar_%s.jsonl' % buoy)
+    # None keeps float64 arrays and lon/lat grids, 'compact' stores float32
+    # NRCS, int16 angles and an affine transform instead of the grids
+    dtype_policy = None
+    # Extraction results are cached on disk (SATDATA_CACHE_DIR), so that a
+    # rerun, e.g. after the pickle was lost, does not read the products again
+    cache = ResultCache(max_bytes=50*1024**3)
     for product in in_situ_obs[buoy]['products']:
         fname = in_situ_obs[buoy]['products'][product]['filename']
         #n = Nansat(data_dir + fname)
@@ -48,47 +60,50 @@ def crop_images_one_buoy(buoy):
             in_situ_obs[buoy]['products'][product]['sar_params'] = {}
         
         for size in crop_size:
+            item = '%s/%d' % (product, size)
             if str(size) not in in_situ_obs[buoy]['products'][product]['sar_params']:
                # try:
                     #print('Getting SAR params...')
-                    s0, s0_norm, inc, az, grid_lons, grid_lats, pol = sar.sar_params(
-                        sar_fn = data_dir + fname,
-                        station_lon=station_lon,
-                        station_lat=station_lat,
-                        x_size=size,
-                        y_size=size
-                    )
-
-                    crop_param_dict = {
-                        'x_size' : size,
-                        'y_size' : size,
-                        's0' : s0, 
-                        's0_norm' : s0_norm,
-                        'inc' : inc,
-                        'az' : az,
-                        'grid_lons' : grid_lons,
-                        'grid_lats' : grid_lats,
-                        'pol' : pol
-                    }
+                    with progress.item(item, filename=fname):
+                        crop_param_dict = cache.call(
+                            sar.sar_params_dict,
+                            data_dir + fname,
+                            station_lon=station_lon,
+                            station_lat=station_lat,
+                            x_size=size,
+                            y_size=size,
+                            dtype_policy=dtype_policy
+                        )
 
                     in_situ_obs[buoy]['products'][product]['sar_params'][str(size)] = crop_param_dict
                     count_products = count_products + 1
 
                     # Save the results every 10 iterations
                     if not count_products % 10:
-                        with open(data_dir + 'in_situ_obs_with_sar_params.pickle', 'wb') as handle:
+                        with timer('pickle.dump'), open(data_dir + 'in_situ_obs_with_sar_params.pickle', 'wb') as handle:
                             pickle.dump(in_situ_obs, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-                        with open(data_dir + 'in_situ_obs_with_sar_params.pickle', 'rb') as handle:
+                        with timer('pickle.load'), open(data_dir + 'in_situ_obs_with_sar_params.pickle', 'rb') as handle:
                             in_situ_obs = pickle.load(handle)
 
                 #except:
                 #    print('Buoy ', buoy, 'File ', fname, ' cannot be normalized for size = ', size) # Check if the image exists and if the crop area is within the image
                 #    count_not_available = count_not_available - 1
-            #else:
-            #    print('Buoy ', buoy, 'File ', fname, ' is already normalized for size = ', size)
+            else:
+                progress.skipped(item, reason='already cropped')
     
-    print('Number of images that were not cropped: ', count_not_available)
+    progress.close()
+
+def crop_images_one_buoy_profiled(buoy, metrics_dir='.'):
+    """ crop_images_one_buoy with per-stage timings written to
+    <metrics_dir>/crop_sar_<buoy>.json (set SATDATA_PROFILE to also profile
+    the run, see `instrumentation`). The counters are reset first, as a
+    pool worker crops several buoys.
+    """
+    reset()
+    with profile_run('crop_sar_%s' % buoy, metrics_dir):
+        crop_images_one_buoy(buoy)
+    write_summary(os.path.join(metrics_dir, 'crop_sar_%s.json' % buoy))
 
 #with open(data_dir + 'in_situ_obs_with_sar_params.pickle', 'wb') as handle: 
 #    pickle.dump(in_situ_obs, handle, protocol=pickle.HIGHEST_PROTOCOL)
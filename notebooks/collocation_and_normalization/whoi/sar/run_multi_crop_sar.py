@@ -2,7 +2,7 @@ import pandas as pd
 import pickle
 from multiprocessing import Pool
 
-from crop_sar import crop_images_one_buoy
+from crop_sar import crop_images_one_buoy_profiled
 
 data_dir = "/lustre/storeB/project/IT/geout/machine-ocean/data_raw/sentinel/"
 
@@ -11,8 +11,9 @@ with open(data_dir + 'in_situ_obs_with_sar_params.pickle', 'rb') as handle:
         in_situ_obs = pickle.load(handle)
     
 n_processes = len(in_situ_obs.keys())
+# Per-stage timings of each buoy in crop_sar_<buoy>.json
 with Pool(n_processes) as pool: 
-    results = pool.map(crop_images_one_buoy, in_situ_obs.keys())
+    results = pool.map(crop_images_one_buoy_profiled, in_situ_obs.keys())
     
     
     
@@ -0,0 +1,220 @@
+""" Incidence angle normalization and polarization ratio models for
+radar NRCS, shared by the SAR and ASCAT extraction functions.
+
+The models only depend on the incidence angle, so they are tabulated
+once on a regular incidence angle grid (0.01 degrees by default) and
+evaluated by linear interpolation in the table. Normalizing millions of
+pixels is then a gather rather than a trigonometric evaluation.
+
+Normalization models have the form
+
+    s0_norm = scale*s0 + offset(inc)
+
+with `s0` and `s0_norm` in dB, and polarization ratio models give the
+real valued factor PR(inc) so that s0_vv = PR*s0_hh.
+"""
+import numpy as np
+
+from cmod import cmod5n_b0
+
+# Default incidence angle grid of the lookup tables [degrees]
+LUT_START = 0.
+LUT_STOP = 90.
+LUT_STEP = 0.01
+
+
+class IncidenceLUT:
+    """ Lookup table of a function of incidence angle, evaluated by
+    linear interpolation.
+
+    Parameters
+    ==========
+    func : callable
+        Vectorised function of incidence angle [degrees].
+    start, stop, step : float, optional
+        Incidence angle grid of the table [degrees].
+    """
+
+    def __init__(self, func, start=LUT_START, stop=LUT_STOP, step=LUT_STEP):
+        self.start = start
+        self.step = step
+        n = int(round((stop - start)/step)) + 1
+        self.table = func(start + step*np.arange(n))
+        self.slope = np.append(np.diff(self.table), 0.)
+
+    def __call__(self, inc, out=None):
+        """ Interpolated table values at incidence angles `inc`. Angles
+        outside the table are clamped to its end points, and NaN angles
+        give NaN.
+        """
+        pos = np.array(inc, dtype=float)
+        pos -= self.start
+        pos /= self.step
+        np.clip(pos, 0., self.table.size - 1, out=pos)
+        missing = np.isnan(pos)
+        has_missing = missing.any()
+        if has_missing:
+            pos[missing] = 0.
+        idx = pos.astype(np.intp)
+        pos -= idx
+        values = np.take(self.slope, idx)
+        values *= pos
+        values += np.take(self.table, idx)
+        if has_missing:
+            values[missing] = np.nan
+        if out is None:
+            return values
+        out[...] = values
+        return out
+
+
+class NormalizationModel:
+    """ Incidence angle normalization of NRCS in dB.
+
+    Parameters
+    ==========
+    name : string
+        Name of the model.
+    offset : callable
+        Vectorised function of incidence angle giving the additive term
+        [dB].
+    scale : float, optional
+        Factor applied to the NRCS [dB].
+    description : string, optional
+        Reference of the model.
+    """
+
+    def __init__(self, name, offset, scale=1., description=''):
+        self.name = name
+        self.offset = offset
+        self.scale = scale
+        self.description = description
+        self._lut = None
+
+    @property
+    def lut(self):
+        """ Lookup table of the offset, computed on first use. """
+        if self._lut is None:
+            self._lut = IncidenceLUT(self.offset)
+        return self._lut
+
+    def __call__(self, s0, inc, out=None, exact=False):
+        """ Normalized NRCS [dB].
+
+        Parameters
+        ==========
+        s0 : float or array
+            NRCS [dB].
+        inc : float or array
+            Radar look incidence angle [degrees].
+        out : array, optional
+            Output buffer; may be `s0` itself.
+        exact : bool, optional
+            If True, evaluate the model function instead of the table.
+        """
+        s0 = np.asarray(s0, dtype=float) if out is None else s0
+        offset = self.offset(np.asarray(inc, dtype=float)) if exact else self.lut(inc)
+        return np.add(np.multiply(s0, self.scale, out=out), offset, out=out)
+
+
+class PolarizationRatioModel:
+    """ HH to VV polarization ratio, s0_vv = PR(inc)*s0_hh with real
+    valued NRCS.
+
+    Parameters
+    ==========
+    name : string
+        Name of the model.
+    ratio : callable
+        Vectorised function of incidence angle giving PR.
+    description : string, optional
+        Reference of the model.
+    """
+
+    def __init__(self, name, ratio, description=''):
+        self.name = name
+        self.ratio = ratio
+        self.description = description
+        self._lut = None
+
+    @property
+    def lut(self):
+        """ Lookup table of the ratio, computed on first use. """
+        if self._lut is None:
+            self._lut = IncidenceLUT(self.ratio)
+        return self._lut
+
+    def __call__(self, s0hh, inc, out=None, exact=False):
+        """ VV polarized real valued NRCS from HH polarized NRCS. """
+        pr = self.ratio(np.asarray(inc, dtype=float)) if exact else self.lut(inc)
+        return np.multiply(s0hh, pr, out=out)
+
+
+def _topouzelis2016_offset(inc):
+    # Topouzelis et al. (2016), eqs. (3) and (7)
+    return (0.776*inc - 31.638)/2.
+
+
+def _ren2017_ratio(inc):
+    # Lin Ren, Jingsong Yang, Alexis Mouche, et al. (2017) [remote sensing]
+    tan2 = np.square(np.tan(np.deg2rad(inc)))
+    return np.square((1. + 2.*tan2)/(1. + 1.3*tan2))
+
+
+def cmod5n_normalization(reference_inc=40., reference_wind=8.):
+    """ CMOD5.N based normalization of VV NRCS to a reference incidence
+    angle, using the incidence dependence of the isotropic term B0 at a
+    reference wind speed. Suitable for the three ASCAT beams.
+
+    Parameters
+    ==========
+    reference_inc : float, optional
+        Incidence angle [degrees] the NRCS is normalized to.
+    reference_wind : float, optional
+        Wind speed [m/s] at which B0 is evaluated.
+    """
+    b0_ref = 10.*np.log10(cmod5n_b0(reference_wind, reference_inc))
+
+    def offset(inc):
+        return b0_ref - 10.*np.log10(cmod5n_b0(reference_wind, inc))
+
+    return NormalizationModel(
+        'cmod5n', offset,
+        description='CMOD5.N B0 at %g m/s, normalized to %g degrees'
+            % (reference_wind, reference_inc))
+
+
+NORMALIZATION_MODELS = {
+    'topouzelis2016': NormalizationModel(
+        'topouzelis2016', _topouzelis2016_offset, scale=0.5,
+        description='Topouzelis et al. (2016), eqs. (3) and (7), 30 degrees'),
+    'cmod5n': cmod5n_normalization(),
+}
+
+PR_MODELS = {
+    'ren2017': PolarizationRatioModel(
+        'ren2017', _ren2017_ratio,
+        description='Lin Ren, Jingsong Yang, Alexis Mouche, et al. (2017)'),
+}
+
+
+def get_normalization_model(model):
+    """ Normalization model by name (or the model itself). """
+    if isinstance(model, NormalizationModel):
+        return model
+    try:
+        return NORMALIZATION_MODELS[model]
+    except KeyError:
+        raise ValueError('Unknown normalization model %s, choose from %s'
+                % (model, sorted(NORMALIZATION_MODELS)))
+
+
+def get_pr_model(model):
+    """ Polarization ratio model by name (or the model itself). """
+    if isinstance(model, PolarizationRatioModel):
+        return model
+    try:
+        return PR_MODELS[model]
+    except KeyError:
+        raise ValueError('Unknown polarization ratio model %s, choose from %s'
+                % (model, sorted(PR_MODELS)))
@@ -0,0 +1,320 @@
+""" Structured progress reporting for long-running download and crop jobs.
+
+A `Progress` object writes one JSON object per line for each event of a
+job (item started, finished, failed, skipped or retried, status
+changes), e.g.
+
+    {"time": 1650000000.0, "job": "ascat_download", "pid": 123,
+     "event": "finished", "item": "ASCAT_...", "duration": 41.2,
+     "bytes": 5210000}
+
+and periodically a summary line with the number of processed items,
+throughput and estimated time to completion. The counters can also be
+written in the Prometheus text format, for the textfile collector of
+the node exporter, e.g.
+
+    with Progress('crop_sar', total=len(products),
+            events_file='crop_sar.jsonl', textfile='crop_sar.prom') as progress:
+        for product in products:
+            with progress.item(product) as fields:
+                ...
+                fields['bytes'] = nbytes
+
+Summaries of an events file are made with `summarize_events`.
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+# Seconds between summary reports
+REPORT_EVERY = 60.
+
+METRIC_PREFIX = 'satdata_'
+
+
+def _error_message(error):
+    """ Message of an exception (with its type) or of a string, None for
+    no error.
+    """
+    if error is None or isinstance(error, str):
+        return error
+    return '%s: %s' % (type(error).__name__, error)
+
+
+class Progress:
+    """ Progress of a job processing a sequence of items.
+
+    Parameters
+    ==========
+    job : string
+        Name of the job, added to all events and metrics.
+    total : int, optional
+        Number of items to process, used for the estimated time to
+        completion.
+    events_file : string, optional
+        File the JSON lines are appended to. By default they are written
+        to `stream`.
+    stream : file-like, optional
+        Stream for the summary lines (and events without `events_file`),
+        standard output by default.
+    textfile : string, optional
+        Prometheus textfile, rewritten with each summary.
+    report_every : float, optional
+        Minimum number of seconds between summaries.
+    """
+
+    def __init__(self, job, total=None, events_file=None, stream=None, textfile=None,
+            report_every=REPORT_EVERY):
+        self.job = job
+        self.total = total
+        self.stream = stream if stream is not None else sys.stdout
+        self.textfile = textfile
+        self.report_every = report_every
+        self._events = open(events_file, 'a') if events_file else None
+        self._started = {}
+        self.counts = {'started': 0, 'finished': 0, 'failed': 0, 'skipped': 0, 'retries': 0}
+        self.bytes = 0
+        self.busy_time = 0.
+        self.start_time = time.time()
+        self.last_event_time = self.start_time
+        self._last_report = self.start_time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def event(self, event, item=None, **fields):
+        """ Write an event as a JSON line. """
+        self.last_event_time = time.time()
+        record = {'time': round(self.last_event_time, 3), 'job': self.job,
+                'pid': os.getpid(), 'event': event}
+        if item is not None:
+            record['item'] = str(item)
+        record.update(fields)
+        line = json.dumps(record, default=str)
+        out = self._events if self._events is not None else self.stream
+        out.write(line + '\n')
+        out.flush()
+        return record
+
+    def started(self, item, **fields):
+        """ Record the start of the processing of `item`. """
+        self.counts['started'] += 1
+        self._started[str(item)] = time.perf_counter()
+        return self.event('started', item, **fields)
+
+    def _duration(self, item):
+        t0 = self._started.pop(str(item), None)
+        if t0 is None:
+            return None
+        duration = time.perf_counter() - t0
+        self.busy_time += duration
+        return round(duration, 3)
+
+    def finished(self, item, bytes=None, **fields):
+        """ Record the successful processing of `item`, optionally with the
+        number of bytes downloaded or written.
+        """
+        self.counts['finished'] += 1
+        if bytes:
+            self.bytes += int(bytes)
+            fields['bytes'] = int(bytes)
+        record = self.event('finished', item, duration=self._duration(item), **fields)
+        self.maybe_report()
+        return record
+
+    def failed(self, item, error=None, **fields):
+        """ Record a failure to process `item`, with an exception or a
+        message as `error`.
+        """
+        self.counts['failed'] += 1
+        record = self.event('failed', item, duration=self._duration(item),
+                error=_error_message(error), **fields)
+        self.maybe_report()
+        return record
+
+    def skipped(self, item, reason=None, **fields):
+        """ Record that `item` is skipped, e.g. because it already exists. """
+        self.counts['skipped'] += 1
+        return self.event('skipped', item, reason=reason, **fields)
+
+    def retry(self, item, attempt, error=None, **fields):
+        """ Record a new attempt to process `item`. """
+        self.counts['retries'] += 1
+        return self.event('retry', item, attempt=attempt, error=_error_message(error),
+                **fields)
+
+    def status(self, item, status, **fields):
+        """ Record a status change of `item` (e.g. QUEUED, RUNNING of a
+        Data Tailor customisation).
+        """
+        return self.event('status', item, status=status, **fields)
+
+    @contextlib.contextmanager
+    def item(self, item, **fields):
+        """ Context manager recording the start and the end of the
+        processing of `item`. The yielded dictionary is added to the
+        'finished' event; exceptions are recorded as failures and
+        re-raised.
+        """
+        self.started(item, **fields)
+        result = {}
+        try:
+            yield result
+        except Exception as error:
+            self.failed(item, error)
+            raise
+        self.finished(item, **result)
+
+    def stats(self):
+        """ Counters, throughput and estimated time to completion.
+
+        Returns
+        =======
+        stats : dictionary
+            The event counts, bytes, elapsed [s], items_per_hour,
+            bytes_per_second, remaining items and eta [s] (None if
+            unknown).
+        """
+        elapsed = time.time() - self.start_time
+        processed = self.counts['finished'] + self.counts['failed']
+        stats = dict(self.counts, bytes=self.bytes, elapsed=elapsed)
+        stats['items_per_hour'] = 3600.*processed/elapsed if elapsed > 0 else None
+        stats['bytes_per_second'] = self.bytes/elapsed if elapsed > 0 else None
+        stats['remaining'] = stats['eta'] = None
+        if self.total is not None:
+            stats['remaining'] = max(self.total - processed - self.counts['skipped'], 0)
+            if processed:
+                stats['eta'] = stats['remaining']*elapsed/processed
+        return stats
+
+    def report(self):
+        """ Write a summary event and a human readable summary line, and
+        update the Prometheus textfile.
+        """
+        self._last_report = time.time()
+        stats = self.stats()
+        if self._events is not None:
+            self.event('summary', **stats)
+        done = stats['finished'] + stats['failed'] + stats['skipped']
+        line = '[%s] %d%s items (%d failed, %d skipped), %.1f items/h, %.2f MB/s' % (
+            self.job, done, '/%d' % self.total if self.total is not None else '',
+            stats['failed'], stats['skipped'], stats['items_per_hour'] or 0.,
+            (stats['bytes_per_second'] or 0.)/1e6)
+        if stats['eta'] is not None:
+            line += ', ETA %s' % format_duration(stats['eta'])
+        self.stream.write(line + '\n')
+        self.stream.flush()
+        if self.textfile:
+            self.write_textfile(self.textfile)
+        return stats
+
+    def maybe_report(self):
+        """ Report if more than `report_every` seconds passed since the
+        last summary.
+        """
+        if time.time() - self._last_report >= self.report_every:
+            return self.report()
+
+    def metrics(self):
+        """ Metrics in the Prometheus text exposition format. """
+        stats = self.stats()
+        label = '{job="%s"}' % self.job
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append('# HELP %s%s %s' % (METRIC_PREFIX, name, help))
+            lines.append('# TYPE %s%s %s' % (METRIC_PREFIX, name, kind))
+            for labels, value in samples:
+                lines.append('%s%s%s %s' % (METRIC_PREFIX, name, labels, repr(float(value))))
+
+        metric('items_total', 'counter', 'Items by outcome.', [
+            ('{job="%s",outcome="%s"}' % (self.job, outcome), stats[outcome])
+            for outcome in ['finished', 'failed', 'skipped']])
+        metric('retries_total', 'counter', 'Retried attempts.', [(label, stats['retries'])])
+        metric('bytes_total', 'counter', 'Bytes downloaded or written.', [(label, stats['bytes'])])
+        metric('busy_seconds_total', 'counter', 'Time spent processing items.',
+                [(label, self.busy_time)])
+        if self.total is not None:
+            metric('items_expected', 'gauge', 'Items to process.', [(label, self.total)])
+        if stats['eta'] is not None:
+            metric('eta_seconds', 'gauge', 'Estimated time to completion.',
+                    [(label, stats['eta'])])
+        metric('start_time_seconds', 'gauge', 'Start time of the job.',
+                [(label, self.start_time)])
+        metric('last_event_time_seconds', 'gauge', 'Time of the last event, to detect stalls.',
+                [(label, self.last_event_time)])
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """ Write `metrics()` to `path`, atomically as required by the
+        node exporter textfile collector.
+        """
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.metrics())
+        os.replace(tmp, path)
+        return path
+
+    def close(self):
+        """ Write the final summary and close the events file. """
+        self.report()
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+
+
+def format_duration(seconds):
+    """ Duration as e.g. '2h05m' or '4m10s'. """
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return '%dh%02dm' % (hours, minutes)
+    return '%dm%02ds' % (minutes, seconds)
+
+
+def read_events(events_file):
+    """ Events of a JSON lines file as a list of dictionaries. """
+    with open(events_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_events(events_file):
+    """ Per-job summary of an events file, e.g. of an interrupted run.
+
+    Returns
+    =======
+    summary : dictionary
+        job -> finished, failed, skipped and retries counts, bytes,
+        total and maximum duration [s] of the items, time of the last
+        event, and the items started but neither finished nor failed
+        (in progress or stalled).
+    """
+    summary = {}
+    open_items = {}
+    for event in read_events(events_file):
+        job = summary.setdefault(event['job'], {
+            'finished': 0, 'failed': 0, 'skipped': 0, 'retries': 0, 'bytes': 0,
+            'duration': 0., 'max_duration': 0., 'last_event_time': None})
+        pending = open_items.setdefault(event['job'], {})
+        kind = event['event']
+        job['last_event_time'] = event['time']
+        if kind == 'started':
+            pending[event['item']] = event['time']
+        elif kind in ('finished', 'failed', 'skipped'):
+            job[kind] += 1
+            pending.pop(event.get('item'), None)
+            job['bytes'] += event.get('bytes') or 0
+            duration = event.get('duration') or 0.
+            job['duration'] += duration
+            job['max_duration'] = max(job['max_duration'], duration)
+        elif kind == 'retry':
+            job['retries'] += 1
+    for name, job in summary.items():
+        job['in_progress'] = sorted(open_items[name])
+    return summary
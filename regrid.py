@@ -0,0 +1,284 @@
+""" Regridding with precomputed sparse weights.
+
+The ERA5 wave fields (0.5 degrees), the ERA5 atmospheric fields (0.25
+degrees) and the ASCAT Data Tailor products are on different grids.
+Bilinear interpolation from a regular latitude-longitude source grid to
+any target points is a sparse (n_target, n_source) matrix with at most
+four weights per row, which only depends on the two grids. It is
+computed once per pair of grids, kept on disk as <key>.npz (a hash of
+the coordinates of both grids) and applied to all time steps of a field
+by one sparse-dense matrix product:
+
+    wave = regrid(era5_wave['swh'], ascat.lat.values, ascat.lon.values)
+    ds = regrid(era5_atmosphere, ascat.lat.values, ascat.lon.values)
+
+Missing source values (e.g. land points of the wave fields) are left
+out, and the weights of the valid points renormalized, as long as they
+make up at least `min_weight` of the interpolation weight.
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import scipy.sparse
+import xarray as xr
+
+from instrumentation import record_cache, timer
+from result_cache import CACHE_DIR_ENV, DEFAULT_CACHE_DIR
+
+# Version of the weights, part of the cache keys
+WEIGHTS_VERSION = 1
+
+# Least fraction of the interpolation weight on valid source points
+MIN_WEIGHT = 0.5
+
+# Variables of directions [degrees], interpolated as unit vectors
+DIRECTIONS = ('mwd', 'wdir')
+
+# Weights kept in memory, by key
+_weights = {}
+
+
+def _fractional_index(coordinate, values, periodic=False):
+    """ Fractional positions of `values` in a monotonic coordinate, NaN
+    outside. With `periodic` the coordinate is a full circle [degrees].
+    """
+    coordinate = np.asarray(coordinate, dtype=float)
+    positions = np.arange(coordinate.size, dtype=float)
+    if coordinate[-1] < coordinate[0]:
+        coordinate, positions = coordinate[::-1], positions[::-1]
+    if periodic:
+        values = coordinate[0] + (values - coordinate[0]) % 360.
+        coordinate = np.append(coordinate, coordinate[0] + 360.)
+        positions = np.append(positions, positions.size)
+    return np.interp(values, coordinate, positions, left=np.nan, right=np.nan)
+
+
+def is_periodic(lons):
+    """ True if regularly spaced longitudes [degrees] cover the globe. """
+    lons = np.asarray(lons, dtype=float)
+    return lons.size > 2 and np.isclose(abs(lons[-1] - lons[0]) + abs(lons[1] - lons[0]), 360.)
+
+
+def bilinear_weights(src_lats, src_lons, dst_lats, dst_lons, points=False):
+    """ Bilinear interpolation weights from a regular grid to target
+    points.
+
+    Parameters
+    ==========
+    src_lats, src_lons : 1D arrays
+        Monotonic coordinates [degrees] of the rows and columns of the
+        source grid. Global longitudes wrap around.
+    dst_lats, dst_lons : arrays
+        Target coordinates [degrees]: 1D coordinates of the rows and
+        columns of a grid, or 2D coordinates of a curvilinear grid (e.g.
+        a swath). Target longitudes may use either the -180 to 180 or
+        the 0 to 360 convention.
+    points : bool, optional
+        If True, `dst_lats` and `dst_lons` are the coordinates of points,
+        of the same shape.
+
+    Returns
+    =======
+    weights : scipy.sparse.csr_matrix, shape (n_target, n_source)
+        Rows of target points outside the source grid are empty. The
+        target points are in C order of the target grid.
+    """
+    src_lats, src_lons = np.asarray(src_lats, dtype=float), np.asarray(src_lons, dtype=float)
+    dst_lats, dst_lons = _target_points(dst_lats, dst_lons, points)
+    periodic = is_periodic(src_lons)
+    nj, ni = src_lats.size, src_lons.size
+
+    fj = _fractional_index(src_lats, dst_lats)
+    if periodic:
+        fi = _fractional_index(src_lons, dst_lons, periodic=True)
+    else:
+        # Target longitudes in the convention of the source grid
+        west = min(src_lons[0], src_lons[-1])
+        fi = _fractional_index(src_lons, west + (dst_lons - west) % 360.)
+    inside = np.isfinite(fj) & np.isfinite(fi)
+    rows = np.flatnonzero(inside)
+    fj, fi = fj[inside], fi[inside]
+    j0 = np.minimum(np.floor(fj).astype(int), nj - 2)
+    i0 = np.floor(fi).astype(int)
+    if not periodic:
+        i0 = np.minimum(i0, ni - 2)
+    ty, tx = fj - j0, fi - i0
+    i1 = (i0 + 1) % ni
+
+    row = np.tile(rows, 4)
+    col = np.concatenate([j0*ni + i0 % ni, j0*ni + i1, (j0 + 1)*ni + i0 % ni, (j0 + 1)*ni + i1])
+    data = np.concatenate([(1 - ty)*(1 - tx), (1 - ty)*tx, ty*(1 - tx), ty*tx])
+    weights = scipy.sparse.csr_matrix((data, (row, col)), shape=(dst_lats.size, nj*ni))
+    weights.eliminate_zeros()
+    return weights
+
+
+def _target_points(dst_lats, dst_lons, points=False):
+    dst_lats, dst_lons = np.asarray(dst_lats, dtype=float), np.asarray(dst_lons, dtype=float)
+    if dst_lats.ndim == 1 and dst_lons.ndim == 1 and not points:
+        dst_lats, dst_lons = np.meshgrid(dst_lats, dst_lons, indexing='ij')
+    elif dst_lats.shape != dst_lons.shape:
+        raise ValueError('Target latitudes %s and longitudes %s differ in shape'
+                % (dst_lats.shape, dst_lons.shape))
+    return dst_lats.ravel(), dst_lons.ravel()
+
+
+def target_shape(dst_lats, dst_lons, points=False):
+    """ Shape of the values on a target grid or at target points. """
+    dst_lats, dst_lons = np.asarray(dst_lats), np.asarray(dst_lons)
+    if dst_lats.ndim == 1 and dst_lons.ndim == 1 and not points:
+        return dst_lats.shape + dst_lons.shape
+    return dst_lats.shape
+
+
+def grid_key(src_lats, src_lons, dst_lats, dst_lons, points=False):
+    """ Cache key of the weights between two grids. """
+    digest = hashlib.sha256(b'bilinear-%d-%d' % (WEIGHTS_VERSION, points))
+    for coordinate in [src_lats, src_lons, dst_lats, dst_lons]:
+        coordinate = np.ascontiguousarray(coordinate, dtype=float)
+        digest.update(str(coordinate.shape).encode())
+        digest.update(coordinate.tobytes())
+    return digest.hexdigest()[:32]
+
+
+def regrid_weights(src_lats, src_lons, dst_lats, dst_lons, points=False, cache_dir=None):
+    """ `bilinear_weights`, computed once per pair of grids and kept in
+    memory and in `cache_dir` (by default <cache>/regrid, see
+    `result_cache`). False to not use a cache directory.
+    """
+    key = grid_key(src_lats, src_lons, dst_lats, dst_lons, points)
+    if key in _weights:
+        record_cache('regrid_weights', True)
+        return _weights[key]
+    if cache_dir is None:
+        cache_dir = os.path.join(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR), 'regrid')
+    path = os.path.join(cache_dir, key + '.npz') if cache_dir else None
+    if path is not None and os.path.exists(path):
+        weights = scipy.sparse.load_npz(path).tocsr()
+        record_cache('regrid_weights', True)
+    else:
+        record_cache('regrid_weights', False)
+        with timer('regrid.weights'):
+            weights = bilinear_weights(src_lats, src_lons, dst_lats, dst_lons, points)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npz')
+            os.close(fd)
+            try:
+                scipy.sparse.save_npz(tmp, weights)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+    _weights[key] = weights
+    return weights
+
+
+def apply_weights(weights, values, shape=None, min_weight=MIN_WEIGHT, circular=False):
+    """ Interpolate fields with precomputed weights.
+
+    Parameters
+    ==========
+    weights : scipy.sparse matrix, shape (n_target, n_source)
+    values : array, shape (..., nj, ni)
+        Fields on the source grid, any number of leading dimensions
+        (e.g. time).
+    shape : tuple, optional
+        Shape of the target, by default (n_target,).
+    min_weight : float, optional
+        Least fraction of the weight of a target point on finite source
+        values, NaN below.
+    circular : bool, optional
+        If True, the values are directions [degrees], interpolated as
+        unit vectors.
+
+    Returns
+    =======
+    values : array, shape (...,) + shape
+    """
+    values = np.asarray(values)
+    if circular:
+        radians = np.deg2rad(values)
+        sin = apply_weights(weights, np.sin(radians), shape, min_weight)
+        cos = apply_weights(weights, np.cos(radians), shape, min_weight)
+        return np.rad2deg(np.arctan2(sin, cos)) % 360.
+    leading = values.shape[:-2]
+    shape = (weights.shape[0],) if shape is None else tuple(shape)
+    # One column per field, so that all fields are a single product
+    columns = values.reshape(-1, weights.shape[1]).T
+    valid = np.isfinite(columns)
+    with timer('regrid.apply'):
+        if valid.all():
+            result = weights @ columns
+            result[np.asarray(weights.sum(axis=1)).ravel() < min_weight] = np.nan
+        else:
+            total = weights @ valid.astype(columns.dtype)
+            result = weights @ np.where(valid, columns, 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result = np.where(total >= min_weight, result/total, np.nan)
+    if np.issubdtype(values.dtype, np.floating):
+        result = result.astype(values.dtype, copy=False)
+    return result.T.reshape(leading + shape)
+
+
+def _coordinate_names(obj):
+    for lat, lon in [('latitude', 'longitude'), ('lat', 'lon')]:
+        if lat in obj.dims and lon in obj.dims:
+            return lat, lon
+    raise KeyError('No latitude/longitude dimensions in %s' % list(obj.dims))
+
+
+def regrid(obj, dst_lats, dst_lons, points=False, cache_dir=None, min_weight=MIN_WEIGHT,
+        directions=DIRECTIONS):
+    """ Regrid a DataArray, or the variables of a Dataset, on a regular
+    latitude-longitude grid to a target grid or target points.
+
+    Parameters
+    ==========
+    obj : xarray DataArray or Dataset
+        With 'latitude' and 'longitude' (or 'lat' and 'lon') dimensions.
+        Variables of a Dataset without them are kept as they are.
+    dst_lats, dst_lons, points :
+        See `bilinear_weights`.
+    cache_dir, min_weight :
+        See `regrid_weights` and `apply_weights`.
+    directions : list of strings, optional
+        Names of the variables of directions [degrees].
+
+    Returns
+    =======
+    regridded : DataArray or Dataset
+        On (..., <lat>, <lon>) for a target grid given by 1D coordinates,
+        else on (..., y, x) for a curvilinear grid or (..., point) for
+        points, with latitude and longitude coordinates.
+    """
+    lat, lon = _coordinate_names(obj)
+    weights = regrid_weights(obj[lat].values, obj[lon].values, dst_lats, dst_lons, points,
+            cache_dir)
+    shape = target_shape(dst_lats, dst_lons, points)
+    dst_lats, dst_lons = np.asarray(dst_lats), np.asarray(dst_lons)
+    if dst_lats.ndim == 1 and not points:
+        dims, coords = (lat, lon), {lat: dst_lats, lon: dst_lons}
+    else:
+        dims = ('y', 'x') if not points else ('point',)
+        if points:
+            dst_lats, dst_lons = dst_lats.ravel(), dst_lons.ravel()
+            shape = (dst_lats.size,)
+        coords = {lat: (dims, dst_lats), lon: (dims, dst_lons)}
+
+    def regrid_array(da):
+        da = da.transpose(..., lat, lon)
+        values = apply_weights(weights, da.values, shape, min_weight,
+                circular=da.name in directions)
+        leading = da.dims[:-2]
+        return xr.DataArray(values, dims=leading + dims,
+                coords=dict({name: da[name] for name in leading if name in da.coords}, **coords),
+                name=da.name, attrs=da.attrs)
+
+    if isinstance(obj, xr.DataArray):
+        return regrid_array(obj)
+    return xr.Dataset({name: regrid_array(da) if lat in da.dims and lon in da.dims else da
+            for name, da in obj.data_vars.items()}, attrs=obj.attrs)
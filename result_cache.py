@@ -0,0 +1,262 @@
+""" Disk cache of extraction results.
+
+The results of the extraction functions (`ascat.ascat_params*`,
+`sar.sar_params`, `sar.sar_params_dict`) are pickled under a key
+computed from
+
+- the identity of the input file: real path, size and modification time
+  (for directories, such as SAFE products, of all files they contain),
+- the station coordinates,
+- the function and its keyword arguments,
+- the code version: a hash of the source of the module of the function
+  and of the repository modules it uses, directly or indirectly.
+
+Entries are written atomically, so that several processes, also on
+different nodes with a shared file system, can use the same cache
+directory. The least recently used entries are removed when the cache
+grows larger than `max_bytes`.
+
+    cache = ResultCache('/lustre/.../cache')
+    params = cache.call(ascat.ascat_params_cnn, ascat_fn, lon, lat, nx=7, ny=7)
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import types
+
+from instrumentation import record_cache
+
+CACHE_DIR_ENV = 'SATDATA_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'satdata')
+
+# 10 GB
+DEFAULT_MAX_BYTES = 10*1024**3
+
+# Fraction of max_bytes kept by an eviction
+EVICT_TO = 0.9
+
+_code_versions = {}
+
+
+def file_identity(path):
+    """ Real path, size [bytes] and modification time [ns] of a file. The
+    size and the latest modification time of all files are used for
+    directories.
+    """
+    path = os.path.realpath(path)
+    if os.path.isdir(path):
+        size, mtime = 0, os.stat(path).st_mtime_ns
+        for root, _, files in os.walk(path):
+            for name in files:
+                st = os.stat(os.path.join(root, name))
+                size += st.st_size
+                mtime = max(mtime, st.st_mtime_ns)
+    else:
+        st = os.stat(path)
+        size, mtime = st.st_size, st.st_mtime_ns
+    return {'path': path, 'size': size, 'mtime_ns': mtime}
+
+
+def _source_hash(module):
+    try:
+        filename = inspect.getsourcefile(module)
+    except TypeError:
+        return None
+    if filename is None or not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _repository_modules(module):
+    """ `module` and the modules in its directory that it uses, directly
+    or through other such modules (imported modules, functions and
+    classes), by name.
+    """
+    directory = os.path.dirname(os.path.abspath(module.__file__))
+    modules = {}
+    todo = [module]
+    while todo:
+        module = todo.pop()
+        if module.__name__ in modules:
+            continue
+        modules[module.__name__] = module
+        for value in vars(module).values():
+            dependency = value if isinstance(value, types.ModuleType) else inspect.getmodule(value)
+            path = getattr(dependency, '__file__', None)
+            if path is not None and os.path.dirname(os.path.abspath(path)) == directory:
+                todo.append(dependency)
+    return modules
+
+
+def code_version(func):
+    """ Hash of the source of the module of `func` and of the modules in
+    the same directory that it uses, recursively (see
+    `_repository_modules`).
+    """
+    module = inspect.getmodule(func)
+    name = module.__name__ if module is not None else repr(func)
+    if name in _code_versions:
+        return _code_versions[name]
+    if module is None or getattr(module, '__file__', None) is None:
+        version = None
+    else:
+        modules = _repository_modules(module)
+        digest = hashlib.sha1()
+        for dependency in sorted(modules):
+            digest.update(('%s:%s\n' % (dependency, _source_hash(modules[dependency]))).encode())
+        version = digest.hexdigest()[:16]
+    _code_versions[name] = version
+    return version
+
+
+class ResultCache:
+    """ Disk cache of extraction results.
+
+    Parameters
+    ==========
+    cache_dir : string, optional
+        Directory of the cache, by default SATDATA_CACHE_DIR or
+        ~/.cache/satdata.
+    max_bytes : int, optional
+        Maximum size of the cache.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self._size = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, func, filename, station_lon=None, station_lat=None, **kwargs):
+        """ Cache key of func(filename, station_lon, station_lat, **kwargs). """
+        spec = {
+            'function': '%s.%s' % (func.__module__, func.__qualname__),
+            'code_version': code_version(func),
+            'file': file_identity(filename),
+            'station': [station_lon, station_lat],
+            'kwargs': kwargs,
+        }
+        text = json.dumps(spec, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pkl')
+
+    def get(self, key):
+        """ Cached value of `key`.
+
+        Returns
+        =======
+        hit : bool
+        value : object
+            None if not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            record_cache('result_cache', False)
+            return False, None
+        # The modification time is the last use, for the eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        record_cache('result_cache', True)
+        return True, value
+
+    def put(self, key, value):
+        """ Store `value` under `key`. """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(path)
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            self.evict()
+
+    def call(self, func, filename, station_lon=None, station_lat=None, **kwargs):
+        """ func(filename, station_lon, station_lat, **kwargs), from the
+        cache if possible.
+        """
+        key = self.key(func, filename, station_lon, station_lat, **kwargs)
+        hit, value = self.get(key)
+        if not hit:
+            value = func(filename, station_lon, station_lat, **kwargs)
+            self.put(key, value)
+        return value
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.pkl'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def size(self):
+        """ Total size of the cached entries [bytes]. """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        """ Remove the least recently used entries until the cache is
+        smaller than EVICT_TO*max_bytes.
+
+        Returns
+        =======
+        removed : int
+            Number of removed entries.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= EVICT_TO*max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+        self._size = size
+        return removed
+
+    def clear(self):
+        """ Remove all entries. """
+        return self.evict(0)
+
+
+def cached(func, cache=None):
+    """ Version of an extraction function with the signature
+    func(filename, station_lon, station_lat, **kwargs) that uses a
+    `ResultCache` (by default in SATDATA_CACHE_DIR).
+    """
+    cache = cache if cache is not None else ResultCache()
+
+    @functools.wraps(func)
+    def wrapper(filename, station_lon=None, station_lat=None, **kwargs):
+        return cache.call(func, filename, station_lon, station_lat, **kwargs)
+
+    wrapper.cache = cache
+    return wrapper
@@ -3,7 +3,18 @@ given location.
 """
 import numpy as np
 
-from nansat.nansat import Nansat
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+from dtype_policy import apply_dtype_policy, get_policy
+from instrumentation import record_open, record_read, timer
+from nrcs_models import get_normalization_model, get_pr_model
+from sar_readers import open_sar
+
+# Number of image rows processed at a time by `calibrate_nrcs`
+BLOCK_ROWS = 512
 
 def calc_vv(s0hh, inc):
     """ Calculate VV pol NRCS.
@@ -16,8 +27,8 @@ def calc_vv(s0hh, inc):
         Radar look incidence angle.
     """
     # PR from Lin Ren, Jingsong Yang, Alexis Mouche, et al. (2017) [remote sensing]
-    PR = np.square(1.+2.*np.square(np.tan(inc*np.pi/180.))) / \
-            np.square(1.+1.3*np.square(np.tan(inc*np.pi/180.)))
+    tan2 = np.square(np.tan(np.deg2rad(inc)))
+    PR = np.square((1.+2.*tan2)/(1.+1.3*tan2))
     return s0hh*PR # assuming real values (not dB)...
 
 def symfunc(inc):
@@ -44,6 +55,131 @@ def normalize_nrcs(s0, inc):
     """
     return (s0 + symfunc(inc))/2.
 
+def _calibrate_block_numexpr(s0, inc, to_vv, normalize, out, out_norm):
+    """ Fused calibration of one block with numexpr. """
+    if to_vv:
+        ne.evaluate(
+            '10.*log10(s0*((1. + 2.*tan(inc*d2r)**2)/(1. + 1.3*tan(inc*d2r)**2))**2)',
+            local_dict={'s0': s0, 'inc': inc, 'd2r': np.pi/180.}, out=out)
+    else:
+        ne.evaluate('10.*log10(s0)', local_dict={'s0': s0}, out=out)
+    if normalize:
+        ne.evaluate('(s0db + 0.776*inc - 31.638)/2.',
+            local_dict={'s0db': out, 'inc': inc}, out=out_norm)
+
+def _calibrate_block_numpy(s0, inc, to_vv, normalize, out, out_norm):
+    """ Calibration of one block with in-place NumPy operations, using
+    two block-sized temporaries.
+    """
+    if to_vv:
+        # PR from Lin Ren, Jingsong Yang, Alexis Mouche, et al. (2017)
+        tan2 = np.deg2rad(inc, dtype=out.dtype)
+        np.tan(tan2, out=tan2)
+        np.square(tan2, out=tan2)
+        denom = np.multiply(tan2, 1.3)
+        denom += 1.
+        tan2 *= 2.
+        tan2 += 1.
+        np.divide(tan2, denom, out=tan2)
+        np.square(tan2, out=tan2)
+        np.multiply(s0, tan2, out=out)
+    else:
+        out[...] = s0
+    np.log10(out, out=out)
+    out *= 10.
+    if normalize:
+        # Topouzelis et al. (2016), eqs. (3) and (7)
+        np.multiply(inc, 0.776, out=out_norm)
+        out_norm += out
+        out_norm -= 31.638
+        out_norm /= 2.
+
+def _calibrate_block_models(s0, inc, to_vv, normalize, out, out_norm,
+        norm_model, pr_model):
+    """ Calibration of one block with tabulated normalization and
+    polarization ratio models.
+    """
+    if to_vv:
+        pr_model(s0, inc, out=out)
+    else:
+        out[...] = s0
+    np.log10(out, out=out)
+    out *= 10.
+    if normalize:
+        norm_model(out, inc, out=out_norm)
+
+def calibrate_nrcs(s0, inc, pol='VV', vv=True, normalize=True, out=None,
+        out_norm=None, block_rows=BLOCK_ROWS, norm_model=None, pr_model=None):
+    """ Convert real valued NRCS to dB, optionally converting HH to VV
+    polarization and normalizing to 30 degrees incidence angle.
+
+    This is equivalent to `calc_vv`, `10*log10` and `normalize_nrcs`
+    applied in sequence, but the image is processed in blocks of rows
+    and written into the output buffers, so that only block-sized
+    temporaries are allocated. numexpr is used if it is installed.
+
+    Parameters
+    ==========
+    s0 : array
+        Real valued NRCS.
+    inc : array
+        Radar look incidence angle, same shape as `s0`.
+    pol : string, optional
+        Polarization of `s0`.
+    vv : bool, optional
+        True (default) if HH polarized NRCS should be converted to VV
+        polarization.
+    normalize : bool, optional
+        True (default) if the normalized NRCS should be computed.
+    out : array, optional
+        Output buffer for the NRCS in dB. May be `s0` itself, in which
+        case the calibration is done in place.
+    out_norm : array, optional
+        Output buffer for the normalized NRCS in dB.
+    block_rows : int, optional
+        Number of rows processed at a time.
+    norm_model : string or NormalizationModel, optional
+        Normalization model from `nrcs_models`. By default the
+        Topouzelis et al. (2016) relation is evaluated directly.
+    pr_model : string or PolarizationRatioModel, optional
+        Polarization ratio model from `nrcs_models`. By default the
+        Ren et al. (2017) ratio is evaluated directly.
+
+    Returns
+    =======
+    s0 : array
+        NRCS [dB].
+    s0_norm : array or None
+        Normalized NRCS [dB], None if `normalize` is False.
+    """
+    s0 = np.asarray(s0)
+    inc = np.asarray(inc)
+    if s0.shape != inc.shape:
+        raise ValueError('s0 and inc must have the same shape')
+    dtype = np.result_type(s0.dtype, np.float32)
+    if out is None:
+        out = np.empty(s0.shape, dtype=dtype)
+    if normalize and out_norm is None:
+        out_norm = np.empty(s0.shape, dtype=dtype)
+    to_vv = pol == 'HH' and vv
+
+    if norm_model is None and pr_model is None:
+        calibrate_block = _calibrate_block_numpy if ne is None else _calibrate_block_numexpr
+    else:
+        models = (get_normalization_model(norm_model or 'topouzelis2016'),
+                get_pr_model(pr_model or 'ren2017'))
+        def calibrate_block(*args):
+            _calibrate_block_models(*args, *models)
+    if s0.ndim < 2:
+        calibrate_block(s0, inc, to_vv, normalize, out, out_norm)
+    else:
+        for r0 in range(0, s0.shape[0], block_rows):
+            rows = slice(r0, r0 + block_rows)
+            calibrate_block(s0[rows], inc[rows], to_vv, normalize, out[rows],
+                    out_norm[rows] if normalize else None)
+
+    return out, (out_norm if normalize else None)
+
 def find_nearest_value(arr, val):
     """ Element in nd array `arr` closest to the scalar value `val`
 
@@ -96,7 +232,7 @@ def crop_sar_data_xy(n, station_lat, station_lon, x_size, y_size):
     
     Parameters
     ==========
-    n : Nansat object 
+    n : Nansat object or reader from `sar_readers`
     epsilon : float
         Width/height of the new image (measured from the center)
     station_lon : float
@@ -124,7 +260,8 @@ def crop_sar_data_xy(n, station_lat, station_lon, x_size, y_size):
     
     return extent
 
-def sar_params(sar_fn, station_lon=None, station_lat=None, normalize=True, vv=True, x_size=3, y_size=3):
+def sar_params(sar_fn, station_lon=None, station_lat=None, normalize=True, vv=True, x_size=3, y_size=3,
+        norm_model=None, pr_model=None, dtype=None, backend=None):
     """ Estimate SAR parameters at given location.
 
     Parameters
@@ -146,6 +283,19 @@ def sar_params(sar_fn, station_lon=None, station_lat=None, normalize=True, vv=Tr
         Number of pixels in the x dimension of the cropped image.
     y_size : int
         Number of pixels in the y dimension of the cropped image.
+    norm_model : string, optional
+        Name of the normalization model in `nrcs_models`, e.g.,
+        'topouzelis2016' or 'cmod5n'. By default Topouzelis et al.
+        (2016) is used.
+    pr_model : string, optional
+        Name of the polarization ratio model in `nrcs_models`. By
+        default Ren et al. (2017) is used.
+    dtype : numpy dtype, optional
+        If provided, floating point type (e.g. np.float32) in which the
+        NRCS is calibrated and all arrays are returned.
+    backend : string, optional
+        Reader backend in `sar_readers`, 'nansat' or 'netcdf'. By default
+        chosen from the file name, see `sar_readers.open_sar`.
     grid_lats_original : array 
         Geographical latitudes in degrees of the original input image.
     grid_lons_original : array 
@@ -170,53 +320,93 @@ def sar_params(sar_fn, station_lon=None, station_lat=None, normalize=True, vv=Tr
     pol : string
         Radar polarization.
     """
-    s0, inc, az, pol = None, None, None, None
+    s0, s0_norm, inc, az, pol = None, None, None, None, None
 
-    n = Nansat(sar_fn)
+    record_open(sar_fn)
+    with timer('sar.open'):
+        n = open_sar(sar_fn, backend=backend)
     
     if station_lon and station_lat:
         #if (x is None) or (y is None): 
-        crop_sar_data_xy(
-            n=n,
-            station_lat=station_lat,
-            station_lon=station_lon,
-            x_size=x_size, 
-            y_size=y_size
-        )
-
-    # Find band number of real valued HH or VV polarization NRCS
-    try:
-        band_no = n.get_band_number({
-            'standard_name': 'surface_backwards_scattering_coefficient_of_radar_wave',
-            'polarization': 'HH',
-            'dataType': '6',})
-    except ValueError:
-        band_no = n.get_band_number({
-            'standard_name': 'surface_backwards_scattering_coefficient_of_radar_wave',
-            'polarization': 'VV',
-            'dataType': '6',})
-
-    pol = n.get_metadata(key='polarization', band_id=band_no)
+        with timer('sar.crop'):
+            crop_sar_data_xy(
+                n=n,
+                station_lat=station_lat,
+                station_lon=station_lon,
+                x_size=x_size, 
+                y_size=y_size
+            )
+
+    pol = n.polarization
 
     # Get NRCS, incidence angle, and sensor azimuth angle
-    s0 = n[band_no]
-    inc = n['incidence_angle']
-    az = n['look_direction']
+    with timer('sar.read'):
+        s0 = n.read('s0')
+        inc = n.read('incidence_angle')
+        az = n.read('look_direction')
+    record_read(s0.nbytes + inc.nbytes + az.nbytes)
+    if dtype is not None:
+        s0 = s0.astype(dtype, copy=False)
+        inc = inc.astype(dtype, copy=False)
+        az = az.astype(dtype, copy=False)
 
-    # Calculate VV polarization
-    if pol=='HH' and vv:
-        s0 = calc_vv(s0, inc)
+    # Calculate VV polarization, NRCS in decibel and normalized NRCS.
+    # The NRCS band is calibrated in place.
+    with timer('sar.calibrate'):
+        s0, s0_norm = calibrate_nrcs(s0, inc, pol=pol, vv=vv, normalize=normalize,
+                out=s0 if s0.dtype.kind == 'f' else None,
+                norm_model=norm_model, pr_model=pr_model)
 
-    # NRCS in decibel
-    s0 = 10.*np.log10(s0)
+    with timer('sar.geolocation'):
+        grid_lons, grid_lats = n.get_geolocation_grids()
+    if dtype is not None:
+        grid_lons = grid_lons.astype(dtype, copy=False)
+        grid_lats = grid_lats.astype(dtype, copy=False)
 
-    if normalize:
-        # Normalize NRCS
-        s0_norm = normalize_nrcs(s0, inc)
+    return s0, s0_norm, inc, az, grid_lons, grid_lats, pol
 
-    grid_lons, grid_lats = n.get_geolocation_grids()
+def sar_params_dict(sar_fn, station_lon=None, station_lat=None, x_size=3, y_size=3,
+        dtype_policy=None, **kwargs):
+    """ SAR parameters at given location as a dictionary, optionally
+    stored according to a dtype policy.
 
-    return s0, s0_norm, inc, az, grid_lons, grid_lats, pol
+    Parameters
+    ==========
+    sar_fn, station_lon, station_lat, x_size, y_size :
+        See `sar_params`.
+    dtype_policy : string or dictionary, optional
+        If provided, dtype policy from `dtype_policy` (e.g. 'float32' or
+        'compact') applied to the returned arrays. The radiometry is then
+        calibrated directly in the policy dtype.
+    **kwargs :
+        Further keyword arguments to `sar_params`.
+
+    Returns
+    =======
+    sar_params_dict : dictionary
+        The dictionary contains the keys x_size, y_size, s0, s0_norm,
+        inc, az, grid_lons, grid_lats and pol, see `sar_params` and
+        `dtype_policy.apply_dtype_policy`.
+    """
+    if dtype_policy is not None and kwargs.get('dtype') is None:
+        kwargs['dtype'] = get_policy(dtype_policy)['radiometry']
+    s0, s0_norm, inc, az, grid_lons, grid_lats, pol = sar_params(
+        sar_fn, station_lon=station_lon, station_lat=station_lat,
+        x_size=x_size, y_size=y_size, **kwargs)
+    params_dict = {
+        'x_size' : x_size,
+        'y_size' : y_size,
+        's0' : s0,
+        's0_norm' : s0_norm,
+        'inc' : inc,
+        'az' : az,
+        'grid_lons' : grid_lons,
+        'grid_lats' : grid_lats,
+        'pol' : pol
+    }
+    if dtype_policy is not None:
+        apply_dtype_policy(params_dict, dtype_policy, station_lon, station_lat)
+    return params_dict
 
 def latlon2xy(grid_lats, grid_lons, station_lat, station_lon):
     
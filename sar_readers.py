@@ -0,0 +1,199 @@
+""" Readers of calibrated SAR scenes.
+
+The SAR functions only need a small part of the Nansat interface: the
+image shape, the polarization of the NRCS band, the calibrated NRCS,
+incidence angle and look direction (optionally for a block of rows),
+the geolocation grids, pixel cropping and the conversion of geographical
+to pixel coordinates. Two readers implement it:
+
+NansatReader : Sentinel-1 SAFE products (or anything else Nansat can
+    open), the default.
+NetCDFReader : small NetCDF files, or in-memory xarray Datasets, with
+    the variables sigma0 (real valued, with a `polarization` attribute),
+    incidence_angle, look_direction, lon and lat on (y, x) dimensions,
+    e.g. written by `synthetic.write_sar_netcdf`. It is used for offline
+    tests, profiling and benchmarks of the SAR pipeline.
+"""
+import numpy as np
+import xarray as xr
+
+FIELDS = ['s0', 'incidence_angle', 'look_direction']
+
+
+def nrcs_band_number(n):
+    """ Band number of the real valued HH, or else VV, polarization NRCS.
+
+    Parameters
+    ==========
+    n : Nansat object
+    """
+    try:
+        return n.get_band_number({
+            'standard_name': 'surface_backwards_scattering_coefficient_of_radar_wave',
+            'polarization': 'HH',
+            'dataType': '6',})
+    except ValueError:
+        return n.get_band_number({
+            'standard_name': 'surface_backwards_scattering_coefficient_of_radar_wave',
+            'polarization': 'VV',
+            'dataType': '6',})
+
+
+class NansatReader:
+    """ Reader of SAR scenes opened with Nansat.
+
+    Parameters
+    ==========
+    sar_fn : string
+        Full path to SAR dataset.
+    """
+
+    def __init__(self, sar_fn):
+        from nansat.nansat import Nansat
+        self.n = Nansat(sar_fn)
+        self._band_numbers = {
+            's0': nrcs_band_number(self.n),
+            'incidence_angle': self.n.get_band_number('incidence_angle'),
+            'look_direction': self.n.get_band_number('look_direction'),
+        }
+
+    @property
+    def polarization(self):
+        return self.n.get_metadata(key='polarization', band_id=self._band_numbers['s0'])
+
+    def shape(self):
+        """ Number of rows and columns of the (cropped) image. """
+        return self.n.shape()
+
+    def read(self, field, rows=None):
+        """ Read a field of the (cropped) image.
+
+        Parameters
+        ==========
+        field : string
+            's0' (real valued NRCS), 'incidence_angle' or 'look_direction'.
+        rows : tuple of ints, optional
+            First and last (exclusive) row to read. All rows by default.
+        """
+        band_no = self._band_numbers[field]
+        if rows is None:
+            return self.n[band_no]
+        band = self.n.vrt.dataset.GetRasterBand(band_no)
+        return band.ReadAsArray(0, int(rows[0]), self.n.shape()[1], int(rows[1] - rows[0]))
+
+    def get_geolocation_grids(self):
+        return self.n.get_geolocation_grids()
+
+    def crop(self, x_offset, y_offset, x_size, y_size, allow_larger=False):
+        return self.n.crop(x_offset, y_offset, x_size, y_size, allow_larger=allow_larger)
+
+    def transform_points(self, lons, lats):
+        """ Pixel coordinates (cols, rows) of geographical coordinates. """
+        return self.n.transform_points(lons, lats, DstToSrc=1)
+
+
+class NetCDFReader:
+    """ Reader of SAR scenes stored as simple NetCDF files or xarray
+    Datasets.
+
+    Parameters
+    ==========
+    sar_fn : string or xarray Dataset
+        Full path to a NetCDF file, or the dataset itself.
+    """
+
+    def __init__(self, sar_fn):
+        self.ds = sar_fn if isinstance(sar_fn, xr.Dataset) else xr.open_dataset(sar_fn)
+        self._window = (slice(None), slice(None))
+        self._variables = {'s0': 'sigma0', 'incidence_angle': 'incidence_angle',
+                'look_direction': 'look_direction'}
+
+    @property
+    def polarization(self):
+        return self.ds['sigma0'].attrs.get('polarization', 'VV')
+
+    def _cropped(self, name):
+        return self.ds[name][self._window]
+
+    def shape(self):
+        """ Number of rows and columns of the (cropped) image. """
+        return self._cropped('lon').shape
+
+    def read(self, field, rows=None):
+        """ Read a field of the (cropped) image, see `NansatReader.read`. """
+        da = self._cropped(self._variables[field])
+        if rows is not None:
+            da = da[int(rows[0]):int(rows[1])]
+        return da.values
+
+    def get_geolocation_grids(self):
+        return self._cropped('lon').values, self._cropped('lat').values
+
+    def crop(self, x_offset, y_offset, x_size, y_size, allow_larger=False):
+        """ Crop the image to the given pixel window, as Nansat.crop.
+
+        Returns
+        =======
+        extent : tuple of ints
+            x_offset, y_offset, x_size, y_size of the crop.
+        """
+        rows, cols = self.shape()
+        x0, y0 = int(x_offset), int(y_offset)
+        x1, y1 = x0 + int(x_size), y0 + int(y_size)
+        if not allow_larger and (x0 < 0 or y0 < 0 or x1 > cols or y1 > rows):
+            raise ValueError('Cropping window is outside the image')
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, cols), min(y1, rows)
+        row_slice, col_slice = self._window
+        r_start = row_slice.start or 0
+        c_start = col_slice.start or 0
+        self._window = (slice(r_start + y0, r_start + y1), slice(c_start + x0, c_start + x1))
+        return x0, y0, x1 - x0, y1 - y0
+
+    def transform_points(self, lons, lats):
+        """ Pixel coordinates (cols, rows) of geographical coordinates,
+        from the nearest grid point.
+        """
+        grid_lons, grid_lats = self.get_geolocation_grids()
+        cols, rows = [], []
+        for lon, lat in zip(lons, lats):
+            a = np.abs(grid_lats - lat) + np.abs(grid_lons - lon)
+            row, col = np.unravel_index(a.argmin(), a.shape)
+            cols.append(col)
+            rows.append(row)
+        return np.array(cols, dtype=float), np.array(rows, dtype=float)
+
+
+READERS = {
+    'nansat': NansatReader,
+    'netcdf': NetCDFReader,
+}
+
+
+def open_sar(sar_fn, backend=None):
+    """ Open a SAR scene.
+
+    Parameters
+    ==========
+    sar_fn : string or xarray Dataset
+        Full path to SAR dataset, or an in-memory dataset.
+    backend : string, optional
+        'nansat' or 'netcdf'. By default, datasets and files ending with
+        '.nc' are opened with the NetCDF reader and everything else with
+        Nansat.
+
+    Returns
+    =======
+    reader : NansatReader or NetCDFReader
+    """
+    if backend is None:
+        if isinstance(sar_fn, xr.Dataset) or str(sar_fn).endswith('.nc'):
+            backend = 'netcdf'
+        else:
+            backend = 'nansat'
+    try:
+        reader = READERS[backend]
+    except KeyError:
+        raise ValueError('Unknown SAR reader backend %s, choose from %s'
+                % (backend, sorted(READERS)))
+    return reader(sar_fn)
@@ -0,0 +1,240 @@
+""" Extraction of SAR training patches from full Sentinel-1 scenes.
+
+A scene is read once, in blocks of rows, and calibrated block by block
+in single precision (see `sar.calibrate_nrcs`). Patches of a regular
+tiling of the scene and patches centred on stations are cut out of the
+blocks and written directly to memory-mapped arrays on disk, one
+directory per scene:
+
+    <store_dir>/<scene>/s0.npy        (n_patches, size, size) float32
+    <store_dir>/<scene>/s0_norm.npy
+    <store_dir>/<scene>/inc.npy
+    <store_dir>/<scene>/az.npy
+    <store_dir>/<scene>/patches.csv   one row per patch
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from sar import calibrate_nrcs
+from sar_readers import open_sar
+
+FIELDS = ['s0', 's0_norm', 'inc', 'az']
+
+# Number of image rows read at a time
+BLOCK_ROWS = 1024
+
+
+def regular_patches(shape, size, stride):
+    """ Top-left corners of a regular tiling of an image.
+
+    Parameters
+    ==========
+    shape : tuple of ints
+        Number of rows and columns of the image.
+    size : int
+        Width and height of the patches in pixels.
+    stride : int
+        Distance between neighbouring patches in pixels. Patches overlap
+        if `stride` is smaller than `size`.
+
+    Returns
+    =======
+    corners : array of ints, shape (n, 2)
+        Row and column of the top-left corner of each patch.
+    """
+    rows = np.arange(0, shape[0] - size + 1, stride)
+    cols = np.arange(0, shape[1] - size + 1, stride)
+    rr, cc = np.meshgrid(rows, cols, indexing='ij')
+    return np.column_stack([rr.ravel(), cc.ravel()]).astype(np.intp)
+
+
+def station_patches(row, col, size, offsets=((0, 0),)):
+    """ Top-left corners of patches around a station pixel.
+
+    Parameters
+    ==========
+    row, col : float
+        Pixel position of the station in the image.
+    size : int
+        Width and height of the patches in pixels.
+    offsets : sequence of (int, int), optional
+        Shifts (rows, columns) of the patch centres relative to the
+        station, e.g., ((0, 0), (-8, 0), (8, 0)) for overlapping patches.
+
+    Returns
+    =======
+    corners : array of ints, shape (len(offsets), 2)
+    """
+    centre = np.array([int(round(row)), int(round(col))])
+    return np.array([centre + offset - size//2 for offset in offsets], dtype=np.intp)
+
+
+def iter_block_patches(read_rows, shape, corners, size, block_rows=BLOCK_ROWS):
+    """ Cut patches out of an image read in blocks of rows.
+
+    Only the rows covered by patches are read, and each row is read at
+    most twice (when a patch straddles two blocks).
+
+    Parameters
+    ==========
+    read_rows : callable
+        read_rows(r0, r1) returns a dictionary of arrays with the image
+        rows r0 to r1 (exclusive) of each field.
+    shape : tuple of ints
+        Number of rows and columns of the image.
+    corners : array of ints, shape (n, 2)
+        Top-left corners of the patches, which must lie within the image.
+    size : int
+        Width and height of the patches in pixels.
+    block_rows : int, optional
+        Number of rows in which patches may start within one block.
+
+    Yields
+    ======
+    i : int
+        Index of the patch in `corners`.
+    patch : dictionary
+        Field name -> (size, size) array. The arrays are views into the
+        current block.
+    """
+    corners = np.asarray(corners, dtype=np.intp).reshape(-1, 2)
+    order = np.argsort(corners[:, 0], kind='stable')
+    starts = corners[order, 0]
+    k = 0
+    while k < len(order):
+        r_first = starts[k]
+        j = np.searchsorted(starts, r_first + block_rows, side='left')
+        r0, r1 = r_first, min(starts[j - 1] + size, shape[0])
+        block = read_rows(r0, r1)
+        for i in order[k:j]:
+            r, c = corners[i]
+            yield i, {field: values[r - r0:r - r0 + size, c:c + size]
+                    for field, values in block.items()}
+        k = j
+
+
+def row_reader(reader, vv=True, norm_model=None, pr_model=None):
+    """ Block reader of calibrated NRCS, incidence and look direction.
+
+    Parameters
+    ==========
+    reader : reader from `sar_readers`
+    vv, norm_model, pr_model :
+        See `sar.calibrate_nrcs`.
+
+    Returns
+    =======
+    read_rows : callable
+        read_rows(r0, r1) returns float32 arrays of the fields in
+        `FIELDS` for the image rows r0 to r1 (exclusive).
+    """
+    pol = reader.polarization
+
+    def read_rows(r0, r1):
+        block = {
+            field: reader.read(name, rows=(r0, r1)).astype(np.float32, copy=False)
+            for field, name in [('s0', 's0'), ('inc', 'incidence_angle'), ('az', 'look_direction')]}
+        block['s0'], block['s0_norm'] = calibrate_nrcs(
+            block['s0'], block['inc'], pol=pol, vv=vv, out=block['s0'],
+            norm_model=norm_model, pr_model=pr_model)
+        return block
+
+    return read_rows
+
+
+def write_patches(read_rows, shape, corners, size, scene_dir, block_rows=BLOCK_ROWS):
+    """ Write patches to memory-mapped arrays in `scene_dir`, one .npy
+    file per field in `FIELDS`, with the patches in the order of
+    `corners`.
+    """
+    os.makedirs(scene_dir, exist_ok=True)
+    arrays = {
+        field: np.lib.format.open_memmap(
+            os.path.join(scene_dir, field + '.npy'), mode='w+',
+            dtype=np.float32, shape=(len(corners), size, size))
+        for field in FIELDS}
+    for i, patch in iter_block_patches(read_rows, shape, corners, size, block_rows):
+        for field in FIELDS:
+            arrays[field][i] = patch[field]
+    for array in arrays.values():
+        array.flush()
+    return arrays
+
+
+def tile_scene(sar_fn, store_dir, size=64, stride=64, stations=None,
+        station_offsets=((0, 0),), regular=True, block_rows=BLOCK_ROWS,
+        vv=True, norm_model=None, pr_model=None, backend=None):
+    """ Extract normalized NRCS, incidence and look direction patches from
+    a full SAR scene into an on-disk training store.
+
+    Parameters
+    ==========
+    sar_fn : string
+        Full path to SAR dataset.
+    store_dir : string
+        Root directory of the training store. The patches are written to
+        the subdirectory named after the scene.
+    size : int, optional
+        Width and height of the patches in pixels.
+    stride : int, optional
+        Distance between the patches of the regular tiling in pixels.
+    stations : dictionary, optional
+        Station name -> (lon, lat) of stations around which patches are
+        extracted in addition to the regular tiling.
+    station_offsets : sequence of (int, int), optional
+        Shifts of the station patch centres, see `station_patches`.
+    regular : bool, optional
+        True (default) if the regular tiling should be extracted.
+    block_rows : int, optional
+        Number of image rows read at a time.
+    vv, norm_model, pr_model :
+        See `sar.calibrate_nrcs`.
+    backend : string, optional
+        Reader backend, see `sar_readers.open_sar`.
+
+    Returns
+    =======
+    patches : pandas DataFrame
+        One row per patch with the scene name, kind ('grid' or
+        'station'), station name, and the row and column of the top-left
+        corner of the patch in the scene. Also written to patches.csv.
+    """
+    n = open_sar(sar_fn, backend=backend)
+    shape = n.shape()
+    scene = os.path.splitext(os.path.basename(os.path.normpath(sar_fn)))[0]
+
+    corners, kinds, names = [], [], []
+    if regular:
+        grid = regular_patches(shape, size, stride)
+        corners.append(grid)
+        kinds += ['grid']*len(grid)
+        names += ['']*len(grid)
+    for station, (lon, lat) in (stations or {}).items():
+        col, row = n.transform_points([lon], [lat])
+        patches = station_patches(row[0], col[0], size, station_offsets)
+        corners.append(patches)
+        kinds += ['station']*len(patches)
+        names += [station]*len(patches)
+    corners = np.concatenate(corners) if corners else np.empty((0, 2), dtype=np.intp)
+
+    # Drop patches that are not entirely within the scene
+    inside = ((corners >= 0).all(axis=1)
+            & (corners[:, 0] + size <= shape[0]) & (corners[:, 1] + size <= shape[1]))
+    patches = pd.DataFrame({
+        'scene': scene,
+        'kind': np.array(kinds, dtype=object)[inside],
+        'station': np.array(names, dtype=object)[inside],
+        'row': corners[inside, 0],
+        'col': corners[inside, 1],
+        'size': size,
+    })
+
+    read_rows = row_reader(n, vv=vv, norm_model=norm_model, pr_model=pr_model)
+    scene_dir = os.path.join(store_dir, scene)
+    write_patches(read_rows, shape, corners[inside], size, scene_dir, block_rows)
+    patches['pol'] = n.polarization
+    patches.to_csv(os.path.join(scene_dir, 'patches.csv'), index=False)
+
+    return patches
@@ -1,14 +1,27 @@
+import os
 import pickle
 import cdsapi
+import sys
+
+sys.path.append("..")
+from progress import Progress
 
 data_dir = '/lustre/storeB/project/IT/geout/machine-ocean/data_raw/era5_buoys/'
+# 'grib' keeps the archived format, several times smaller than the NetCDF
+# conversion; the files are read with grib_index.GribFile. The CDS has no
+# packing keyword and serves the archived packing, simple for the ERA5
+# fields; other packings are only decoded with eccodes
+file_format = 'netcdf'
+extension = '.nc' if file_format == 'netcdf' else '.grib'
 
 # Load dict with buoy locations
 with open( '../notebooks/in_situ_obs.pickle', 'rb') as handle:
     in_situ_dict = pickle.load(handle)
 
 
+progress = Progress('era5_u10m', total=len(in_situ_dict), events_file='era5_u10m.jsonl')
 for buoy in in_situ_dict:
+    path = data_dir +'/mean_wave_period/era_u10m_' + buoy + extension
     lat = in_situ_dict[buoy]['lat'][0]
     lon = in_situ_dict[buoy]['lon'][0]
     north = lat + 5
@@ -16,62 +29,68 @@ for buoy in in_situ_dict:
     east = lon + 5
     west = lon - 5
 
-    c = cdsapi.Client()
-    c.retrieve(
-	    'reanalysis-era5-single-levels',
-	    {
-		'product_type':'reanalysis',
-		'format':'netcdf',
-		'variable':'10m_u_component_of_wind',
-		'area'    : [north, west, south, east],
-		'year':[
-		    #'1979', '1980', '1981',
-		    #'1982', '1983', '1984',
-		    #'1985', '1986', '1987',
-		    #'1988', '1989', '1990',
-		    #'1991', '1992', '1993',
-		    #'1994', '1995', '1996',
-		    #'1997', '1998', '1999',
-		    #'2000', '2001', '2002',
-		    #'2003', '2004', '2005',
-		    #'2006', '2007', '2008',
-		    #'2009', '2010', '2011',
-		    '2012', '2013', '2014',
-		    '2015', '2016', '2017',
-		    '2018', '2019', '2020'
-		],
-		'month':[
-            "01", "02", "03", "04", "05", "06",
-            "07", "08", "09", "10", "11", "12"
-            ],
-		'day':[
-		    '01','02','03',
-		    '04','05','06',
-		    '07','08','09',
-		    '10','11','12',
-		    '13','14','15',
-		    '16','17','18',
-		    '19','20','21',
-		    '22','23','24',
-		    '25','26','27',
-		    '28','29','30',
-		    '31'
-		],
-		'time':[
-		    '00:00','01:00','02:00',
-		    '03:00','04:00','05:00',
-		    '06:00','07:00','08:00',
-		    '09:00','10:00','11:00',
-		    '12:00','13:00','14:00',
-		    '15:00','16:00','17:00',
-		    '18:00','19:00','20:00',
-		    '21:00','22:00','23:00'
-		]
-	    },
-
-	    data_dir +'/mean_wave_period/era_u10m_' + buoy + '.nc')
-
-
-
+    progress.started(buoy)
+    try:
+        c = cdsapi.Client()
+        c.retrieve(
+		    'reanalysis-era5-single-levels',
+		    {
+			'product_type':'reanalysis',
+			'format':file_format,
+			'variable':'10m_u_component_of_wind',
+			'area'    : [north, west, south, east],
+			'year':[
+			    #'1979', '1980', '1981',
+			    #'1982', '1983', '1984',
+			    #'1985', '1986', '1987',
+			    #'1988', '1989', '1990',
+			    #'1991', '1992', '1993',
+			    #'1994', '1995', '1996',
+			    #'1997', '1998', '1999',
+			    #'2000', '2001', '2002',
+			    #'2003', '2004', '2005',
+			    #'2006', '2007', '2008',
+			    #'2009', '2010', '2011',
+			    '2012', '2013', '2014',
+			    '2015', '2016', '2017',
+			    '2018', '2019', '2020'
+			],
+			'month':[
+                "01", "02", "03", "04", "05", "06",
+                "07", "08", "09", "10", "11", "12"
+                ],
+			'day':[
+			    '01','02','03',
+			    '04','05','06',
+			    '07','08','09',
+			    '10','11','12',
+			    '13','14','15',
+			    '16','17','18',
+			    '19','20','21',
+			    '22','23','24',
+			    '25','26','27',
+			    '28','29','30',
+			    '31'
+			],
+			'time':[
+			    '00:00','01:00','02:00',
+			    '03:00','04:00','05:00',
+			    '06:00','07:00','08:00',
+			    '09:00','10:00','11:00',
+			    '12:00','13:00','14:00',
+			    '15:00','16:00','17:00',
+			    '18:00','19:00','20:00',
+			    '21:00','22:00','23:00'
+			]
+		    },
 
+		    path)
+    except Exception as error:
+        # No partial file, so that the next run retries
+        if os.path.exists(path):
+            os.remove(path)
+        progress.failed(buoy, error=error)
+        continue
+    progress.finished(buoy, bytes=os.path.getsize(path))
 
+progress.close()
@@ -0,0 +1,364 @@
+""" Streaming extraction and collocation of satellite products.
+
+Instead of building one DataFrame per buoy in memory, products are
+iterated, extracted by a pool of workers and collocated with the in situ
+observations one at a time, and the samples are yielded as soon as they
+are ready:
+
+    tasks = iter_tasks(in_situ_obs, data_dir)
+    extract = extractor(ascat.ascat_params_cnn, nx=7, ny=7)
+    for batch in batched(iter_samples(tasks, extract, in_situ, workers=8), 256):
+        ...
+
+The functions from `extractor` run in a pool of 8 processes, which
+extract in parallel; in threads (executor='thread') the files would be
+read one at a time, see `netcdf_lock`.
+
+At most `prefetch` products are extracted ahead of the consumer, so that
+memory use does not depend on the number of products. The samples can be
+fed to a training loop directly or written to disk, e.g. with
+`write_crop_store`.
+"""
+import collections
+import concurrent.futures
+import functools
+import itertools
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import ascat
+import ascat_swath
+from crop_store import CropStoreWriter, read_table
+from instrumentation import timer
+
+# The NetCDF/HDF5 libraries are not thread safe: in thread workers the
+# extraction functions read their files one at a time (cache lookups and
+# collocation still overlap), process workers extract in parallel. Lazy
+# xarray results are loaded before the lock is released, so that no read
+# happens outside of it
+netcdf_lock = threading.RLock()
+
+# Extraction functions of gridded ASCAT products, and the functions of the
+# same parameters in swath geometry that `extractor` uses for swath files
+SWATH_FUNCTIONS = {
+    ascat.ascat_params: ascat_swath.ascat_swath_params,
+    ascat.ascat_params_cnn: ascat_swath.ascat_swath_params_cnn,
+}
+
+Task = collections.namedtuple('Task', ['buoy', 'product', 'filename', 'lon', 'lat', 'time'])
+Task.__doc__ = """ A product to extract at the location of a buoy. """
+
+
+def iter_tasks(in_situ_obs, data_dir='', time_key='beginposition'):
+    """ Products of a collocation dictionary as tasks.
+
+    Parameters
+    ==========
+    in_situ_obs : dictionary
+        buoy -> {'lat', 'lon', 'products'}, where 'products' maps products
+        to dictionaries with a 'filename', or, as for the downloaded
+        ASCAT products, an additional 'nc_files' maps products to file
+        names.
+    data_dir : string, optional
+        Directory prepended to the file names.
+    time_key : string, optional
+        Key of the acquisition time in the product dictionaries.
+
+    Yields
+    ======
+    task : Task
+    """
+    for buoy, obs in in_situ_obs.items():
+        nc_files = obs.get('nc_files')
+        for product in obs['products']:
+            product_dict = obs['products'][product] if isinstance(obs['products'], dict) else {}
+            if nc_files is not None:
+                filename = nc_files.get(str(product))
+            else:
+                filename = product_dict.get('filename')
+            if filename is None:
+                continue
+            yield Task(buoy, str(product), os.path.join(data_dir, filename),
+                    obs['lon'][0], obs['lat'][0], product_dict.get(time_key))
+
+
+def _loaded(result):
+    """ Result with lazily read xarray objects loaded into memory. """
+    if isinstance(result, dict):
+        return {key: _loaded(value) for key, value in result.items()}
+    if hasattr(result, 'load'):
+        return result.load()
+    return result
+
+
+def _locked(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with netcdf_lock:
+            return _loaded(func(*args, **kwargs))
+    return wrapper
+
+
+def _extract(task, func, kwargs, cache=None):
+    with timer('streaming.extract'):
+        if func in SWATH_FUNCTIONS:
+            with netcdf_lock:
+                if ascat_swath.is_swath_file(task.filename):
+                    func = SWATH_FUNCTIONS[func]
+        if cache is not None:
+            return cache.call(_locked(func), task.filename, task.lon, task.lat, **kwargs)
+        return _locked(func)(task.filename, task.lon, task.lat, **kwargs)
+
+
+def extractor(func, cache=None, **kwargs):
+    """ Extraction function of tasks from one of the extraction functions
+    with the signature func(filename, station_lon, station_lat, **kwargs),
+    e.g. `ascat.ascat_params_cnn` or `sar.sar_params_dict`. ASCAT products
+    in swath geometry are extracted with the function of `SWATH_FUNCTIONS`
+    (e.g. `ascat_swath.ascat_swath_params_cnn`) instead. The result can
+    be used with process pools, which extract in parallel and are the
+    default of `prefetch_map`; in threads the files are read one at a
+    time (see `netcdf_lock`) and lazy xarray results are loaded while the
+    lock is held. If a
+    `result_cache.ResultCache` is given, the results are cached.
+    """
+    return functools.partial(_extract, func=func, kwargs=kwargs, cache=cache)
+
+
+def _default_executor(func):
+    """ 'process' for extraction functions from `extractor`, which hold
+    `netcdf_lock` in threads, else 'thread'.
+    """
+    if isinstance(func, functools.partial) and func.func is _extract:
+        return 'process'
+    return 'thread'
+
+
+def prefetch_map(func, items, workers=4, prefetch=None, executor=None, ordered=True,
+        on_error=None):
+    """ Map `func` over `items` with a pool of workers, keeping at most
+    `prefetch` results ahead of the consumer.
+
+    Parameters
+    ==========
+    func : callable
+    items : iterable
+        Consumed lazily.
+    workers : int, optional
+        Number of workers. With 0 the items are processed in the calling
+        thread.
+    prefetch : int, optional
+        Maximum number of items submitted but not yet consumed, 2*workers
+        by default.
+    executor : string, optional
+        'thread' or 'process', by default 'process' for extraction
+        functions from `extractor` and 'thread' for other functions
+        (which need not be picklable). In threads, extraction functions
+        hold `netcdf_lock` for the whole extraction, as the HDF5 library
+        is not thread safe, so only one product is extracted at a time;
+        threads then only overlap the extraction with cache lookups and
+        the consumer.
+    ordered : bool, optional
+        If True (default) the results are yielded in the order of
+        `items`, else as they complete.
+    on_error : callable, optional
+        on_error(item, exception) is called for failed items, which are
+        then skipped. By default the exception is raised.
+
+    Yields
+    ======
+    item, result
+    """
+    def failed(item, error):
+        if on_error is None:
+            raise error
+        on_error(item, error)
+
+    if workers == 0:
+        for item in items:
+            try:
+                result = func(item)
+            except Exception as error:
+                failed(item, error)
+                continue
+            yield item, result
+        return
+
+    pools = {'thread': concurrent.futures.ThreadPoolExecutor,
+            'process': concurrent.futures.ProcessPoolExecutor}
+    executor = executor or _default_executor(func)
+    prefetch = prefetch or 2*workers
+    items = iter(items)
+    with pools[executor](max_workers=workers) as pool:
+        pending = collections.OrderedDict()
+        for item in itertools.islice(items, prefetch):
+            pending[pool.submit(func, item)] = item
+        while pending:
+            if ordered:
+                future = next(iter(pending))
+                concurrent.futures.wait([future])
+            else:
+                done, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                future = next(f for f in pending if f in done)
+            item = pending.pop(future)
+            for new_item in itertools.islice(items, 1):
+                pending[pool.submit(func, new_item)] = new_item
+            try:
+                result = future.result()
+            except Exception as error:
+                failed(item, error)
+                continue
+            yield item, result
+
+
+def nearest_observation(in_situ, time, tolerance=None):
+    """ In situ observation closest in time.
+
+    Parameters
+    ==========
+    in_situ : pandas DataFrame
+        Observations with a sorted DatetimeIndex.
+    time : datetime or string
+    tolerance : pandas Timedelta or string, optional
+        Maximum time difference.
+
+    Returns
+    =======
+    observation : dictionary or None
+        The observation with its time as 'in_situ_time', or None if there
+        is no observation within `tolerance`.
+    """
+    if time is None or len(in_situ) == 0:
+        return None
+    time = pd.Timestamp(time)
+    if time.tzinfo is not None and in_situ.index.tz is None:
+        time = time.tz_convert(None)
+    i = in_situ.index.get_indexer([time], method='nearest')[0]
+    if i < 0:
+        return None
+    if tolerance is not None and abs(in_situ.index[i] - time) > pd.Timedelta(tolerance):
+        return None
+    observation = in_situ.iloc[i].to_dict()
+    observation['in_situ_time'] = in_situ.index[i]
+    return observation
+
+
+def _sensing_time(params):
+    time = params.get('start_sensing_time')
+    return None if time is None else pd.Timestamp(time)
+
+
+def collocate(task, params, in_situ=None, tolerance='30min'):
+    """ Sample of extracted parameters and the closest in situ
+    observation.
+
+    Parameters
+    ==========
+    task : Task
+    params : dictionary
+        Extracted parameters.
+    in_situ, tolerance :
+        See `iter_samples`.
+
+    Returns
+    =======
+    sample : dictionary or None
+        None if there is no observation within `tolerance`.
+    """
+    time = task.time if task.time is not None else _sensing_time(params)
+    sample = {'buoy': task.buoy, 'product': task.product, 'time': time}
+    if in_situ:
+        with timer('streaming.collocate'):
+            observation = nearest_observation(in_situ[task.buoy], time, tolerance) \
+                    if task.buoy in in_situ else None
+        if observation is None:
+            return None
+        sample.update(observation)
+    sample.update(params)
+    return sample
+
+
+def iter_samples(tasks, extract, in_situ=None, tolerance='30min', workers=4, prefetch=None,
+        executor=None, on_error=None):
+    """ Extract and collocate products lazily.
+
+    Parameters
+    ==========
+    tasks : iterable of Task
+        E.g. from `iter_tasks`.
+    extract : callable
+        extract(task) returns a dictionary of parameters or None (no
+        sample), e.g. from `extractor`.
+    in_situ : dictionary, optional
+        buoy -> DataFrame of observations with a DatetimeIndex. Without
+        in situ data the samples only hold the extracted parameters.
+    tolerance : pandas Timedelta or string, optional
+        Maximum time difference between the product and the observation.
+        Products without an observation within the tolerance are
+        dropped.
+    workers, prefetch, executor, on_error :
+        See `prefetch_map`.
+
+    Yields
+    ======
+    sample : dictionary
+        buoy, product and time of the task, the observation (see
+        `nearest_observation`) and the extracted parameters.
+    """
+    in_situ = {buoy: df.sort_index() for buoy, df in (in_situ or {}).items()}
+    for task, params in prefetch_map(extract, tasks, workers=workers, prefetch=prefetch,
+            executor=executor, on_error=on_error):
+        if params is None:
+            continue
+        sample = collocate(task, params, in_situ, tolerance)
+        if sample is not None:
+            yield sample
+
+
+def batched(samples, batch_size):
+    """ Lists of `batch_size` samples (the last one may be shorter). """
+    samples = iter(samples)
+    while True:
+        batch = list(itertools.islice(samples, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def scalar_frames(samples, batch_size=1000):
+    """ DataFrames of the scalar values of batches of samples, e.g. to
+    append them to a CSV file.
+    """
+    for batch in batched(samples, batch_size):
+        yield pd.DataFrame([{key: value for key, value in sample.items()
+                if np.ndim(value) == 0} for sample in batch])
+
+
+def write_crop_store(samples, store_dir, fields, shape, dtype=np.float32):
+    """ Write the crops and scalar values of samples to a crop store (see
+    `crop_store`) as they are produced.
+
+    Parameters
+    ==========
+    samples : iterable of dictionaries
+    store_dir : string
+    fields : list of strings
+        Keys of the crop arrays.
+    shape : tuple of ints
+        Shape of the crops; samples with crops of another shape are
+        skipped.
+    dtype : numpy dtype, optional
+
+    Returns
+    =======
+    table : pandas DataFrame
+    """
+    with CropStoreWriter(store_dir, shape, fields, dtype) as writer:
+        for sample in samples:
+            writer.append(sample, {key: value for key, value in sample.items()
+                    if key not in fields and np.ndim(value) == 0})
+    return read_table(store_dir)
@@ -0,0 +1,522 @@
+""" Synthetic ASCAT, SAR and IFS data for offline tests and benchmarks.
+
+The ASCAT datasets mimic the geographic NetCDF products returned by the
+EUMETSAT Data Tailor (variables on a regular, descending latitude and
+ascending longitude grid, NaN outside the swath), or the level 1 SZR
+products in swath geometry, with NRCS triplets computed from a smooth
+wind field with CMOD5.N. The geolocation grids
+mimic the slightly rotated and skewed grids of Sentinel-1 scenes. The
+IFS surface fields are written as simply packed GRIB messages of either
+edition on a regular latitude-longitude grid, as retrieved from MARS.
+"""
+import struct
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cmod import cmod5n
+from grib_index import ibm_float
+
+BEAMS = ['fore', 'mid', 'aft']
+
+# Incidence angle ranges [degrees] of the ASCAT beams across the swath
+INC_RANGES = {'fore': (34., 65.), 'mid': (25., 55.), 'aft': (34., 65.)}
+
+# Azimuth of the beams relative to the satellite track [degrees]
+BEAM_AZIMUTHS = {'fore': 45., 'mid': 90., 'aft': 135.}
+
+
+def wind_field(shape, seed=0, mean_speed=8., smoothness=8):
+    """ Smooth random 10 m wind speed [m/s] and direction [degrees] fields. """
+    rng = np.random.default_rng(seed)
+    coarse = [max(2, s//smoothness) for s in shape]
+    fields = []
+    for _ in range(2):
+        field = rng.normal(size=coarse)
+        rows = np.linspace(0, coarse[0] - 1, shape[0])
+        cols = np.linspace(0, coarse[1] - 1, shape[1])
+        field = np.array([np.interp(cols, np.arange(coarse[1]), row) for row in field])
+        field = np.array([np.interp(rows, np.arange(coarse[0]), col) for col in field.T]).T
+        fields.append(field)
+    speed = np.clip(mean_speed + 3.*fields[0], 1., 30.)
+    direction = (180. + 120.*fields[1]) % 360.
+    return speed, direction
+
+
+def ascat_dataset(lat_range=(30., 50.), lon_range=(-80., -50.), resolution=0.125,
+        swath_width=0.5, seed=0):
+    """ Synthetic Data Tailor-like ASCAT dataset.
+
+    Parameters
+    ==========
+    lat_range, lon_range : tuple of floats
+        Extent of the grid [degrees].
+    resolution : float
+        Grid spacing [degrees].
+    swath_width : float
+        Fraction of the grid, across the diagonal, covered by the swath.
+    seed : int
+        Seed of the random wind field and noise.
+
+    Returns
+    =======
+    ascat : xarray Dataset
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.arange(lat_range[1], lat_range[0], -resolution)
+    lon = np.arange(lon_range[0], lon_range[1], resolution)
+    shape = (lat.size, lon.size)
+    rows, cols = np.indices(shape)
+
+    # Swath along the diagonal of the grid, across-track position in [-1, 1]
+    across = (cols/shape[1] - rows/shape[0])/swath_width
+    in_swath = np.abs(across) <= 1.
+    side = np.where(across < 0, -1., 1.)
+    track_azimuth = np.rad2deg(np.arctan2(shape[0], shape[1])) + 90.
+
+    speed, direction = wind_field(shape, seed=seed)
+
+    data_vars = {}
+    for beam in BEAMS:
+        inc_min, inc_max = INC_RANGES[beam]
+        inc = inc_min + (inc_max - inc_min)*np.abs(across)
+        azi = (track_azimuth + side*BEAM_AZIMUTHS[beam]) % 360.
+        s0 = cmod5n(speed, direction - azi, inc)*rng.lognormal(0., 0.05, shape)
+        kp = rng.uniform(0.02, 0.1, shape)
+        for name, values in [
+                ('sigma0_trip_' + beam, 10.*np.log10(s0)),
+                ('inc_angle_trip_' + beam, inc),
+                ('azi_angle_trip_' + beam, azi),
+                ('kp_' + beam, kp)]:
+            data_vars[name] = (('lat', 'lon'), np.where(in_swath, values, np.nan))
+        for flag, probability in [('f_usable_', 0.02), ('f_kp_', 0.05), ('f_land_', 0.01)]:
+            data_vars[flag + beam] = (('lat', 'lon'),
+                    np.where(in_swath, rng.random(shape) < probability, 0).astype(np.int8))
+    data_vars['swath_indicator'] = (('lat', 'lon'), np.where(across < 0, 0, 1).astype(np.int8))
+    data_vars['wind_speed_model'] = (('lat', 'lon'), speed)
+    data_vars['wind_dir_model'] = (('lat', 'lon'), direction)
+
+    return xr.Dataset(
+        data_vars, coords={'lat': lat, 'lon': lon},
+        attrs={
+            'start_sensing_time': '2016-03-01T12:00:00.000Z',
+            'stop_sensing_time': '2016-03-01T12:03:00.000Z',
+        })
+
+
+def write_ascat_netcdf(path, **kwargs):
+    """ Write a synthetic ASCAT dataset (see `ascat_dataset`) to `path`. """
+    ascat_dataset(**kwargs).to_netcdf(path)
+    return path
+
+
+def ascat_swath_dataset(n_rows=240, n_cells=82, lon0=-65., lat0=30., heading=-10.,
+        node_spacing=12.5, nadir_gap=350., seed=0):
+    """ Synthetic ASCAT level 1 SZR product in swath geometry, in the
+    layout of the EUMETSAT NetCDF products (dimensions numRows, numCells
+    and numSigma, the beams fore, mid and aft along numSigma).
+
+    Parameters
+    ==========
+    n_rows, n_cells : int
+        Number of rows (along track) and cells (across track, half of
+        them on each side of the ground track).
+    lon0, lat0 : float
+        Location of the ground track at the first row [degrees].
+    heading : float
+        Direction of the ground track, clockwise from north [degrees].
+    node_spacing : float
+        Distance between nodes [km].
+    nadir_gap : float
+        Distance between the inner cells of the two swaths [km].
+    seed : int
+        Seed of the random wind field and noise.
+
+    Returns
+    =======
+    swath : xarray Dataset
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_rows, n_cells)
+    half = n_cells//2
+    rows, cells = np.indices(shape)
+    # Signed distance from the ground track [km], negative on the left
+    inner = np.where(cells < half, half - 1 - cells, cells - half)
+    side = np.where(cells < half, -1., 1.)
+    across = side*(nadir_gap/2 + node_spacing*inner)
+    along = node_spacing*rows
+    angle = np.deg2rad(heading)
+    north = along*np.cos(angle) - across*np.sin(angle)
+    east = along*np.sin(angle) + across*np.cos(angle)
+    km_per_degree = np.deg2rad(6371.)
+    lat = lat0 + north/km_per_degree
+    lon = lon0 + east/(km_per_degree*np.cos(np.deg2rad(lat)))
+
+    speed, direction = wind_field(shape, seed=seed)
+    position = inner/max(half - 1, 1)
+    variables = {name: np.empty(shape + (3,)) for name in
+            ['sigma0_trip', 'inc_angle_trip', 'azi_angle_trip', 'kp']}
+    for i, beam in enumerate(BEAMS):
+        inc_min, inc_max = INC_RANGES[beam]
+        inc = inc_min + (inc_max - inc_min)*position
+        azi = (heading + side*BEAM_AZIMUTHS[beam]) % 360.
+        s0 = cmod5n(speed, direction - azi, inc)*rng.lognormal(0., 0.05, shape)
+        variables['sigma0_trip'][:, :, i] = 10.*np.log10(s0)
+        variables['inc_angle_trip'][:, :, i] = inc
+        variables['azi_angle_trip'][:, :, i] = azi
+        variables['kp'][:, :, i] = rng.uniform(0.02, 0.1, shape)
+    dims = ('numRows', 'numCells', 'numSigma')
+    data_vars = {name: (dims, values.astype(np.float32)) for name, values in variables.items()}
+    for flag, probability in [('f_usable', 0.02), ('f_kp', 0.05), ('f_land', 0.01)]:
+        data_vars[flag] = (dims, (rng.random(shape + (3,)) < probability).astype(np.float32))
+    data_vars['swath_indicator'] = (('numRows', 'numCells'), (cells >= half).astype(np.int8))
+    data_vars['wind_speed_model'] = (('numRows', 'numCells'), speed)
+    data_vars['wind_dir_model'] = (('numRows', 'numCells'), direction)
+    start = np.datetime64('2016-03-01T12:00:00')
+    data_vars['utc_line_nodes'] = (('numRows',),
+            start + (1875*np.arange(n_rows)).astype('timedelta64[ms]'))
+
+    return xr.Dataset(
+        data_vars, coords={
+            'sigma0': (('numSigma',), np.arange(3, dtype=np.int16)),
+            'lat': (('numRows', 'numCells'), lat),
+            'lon': (('numRows', 'numCells'), lon % 360.),
+        })
+
+
+def write_ascat_swath_netcdf(path, **kwargs):
+    """ Write a synthetic ASCAT swath (see `ascat_swath_dataset`) to `path`. """
+    ascat_swath_dataset(**kwargs).to_netcdf(path)
+    return path
+
+
+def geolocation_grids(shape=(1000, 1200), lon0=5., lat0=65., pixel_size=0.001,
+        rotation=12.):
+    """ Synthetic SAR-like geolocation grids.
+
+    Parameters
+    ==========
+    shape : tuple of ints
+        Number of rows and columns.
+    lon0, lat0 : float
+        Location of the first pixel [degrees].
+    pixel_size : float
+        Approximate pixel size [degrees of latitude].
+    rotation : float
+        Rotation of the image relative to north [degrees].
+
+    Returns
+    =======
+    grid_lons, grid_lats : arrays of floats
+    """
+    rows, cols = np.indices(shape, dtype=float)
+    angle = np.deg2rad(rotation)
+    north = pixel_size*(-rows*np.cos(angle) + cols*np.sin(angle))
+    east = pixel_size*(rows*np.sin(angle) + cols*np.cos(angle))
+    # Slight skew as in a swath
+    north += 1e-9*cols**2
+    grid_lats = lat0 + north
+    grid_lons = lon0 + east/np.cos(np.deg2rad(grid_lats))
+    return grid_lons, grid_lats
+
+
+def sar_dataset(shape=(400, 500), lon0=5., lat0=65., pol='HH', seed=0):
+    """ Synthetic calibrated SAR scene, readable with
+    `sar_readers.NetCDFReader`.
+
+    The real valued NRCS is computed with CMOD5.N from a smooth wind
+    field and, for HH polarization, converted with the inverse of the
+    Ren et al. (2017) polarization ratio.
+
+    Parameters
+    ==========
+    shape : tuple of ints
+        Number of rows and columns.
+    lon0, lat0 : float
+        Location of the first pixel [degrees].
+    pol : string
+        'HH' or 'VV'.
+    seed : int
+        Seed of the random wind field and speckle.
+
+    Returns
+    =======
+    sar : xarray Dataset
+    """
+    rng = np.random.default_rng(seed)
+    grid_lons, grid_lats = geolocation_grids(shape, lon0=lon0, lat0=lat0)
+    cols = np.broadcast_to(np.arange(shape[1]), shape)
+    inc = 30. + 16.*cols/(shape[1] - 1)
+    look = np.full(shape, 78.)
+    speed, direction = wind_field(shape, seed=seed)
+    s0 = cmod5n(speed, direction - look, inc)*rng.gamma(4.4, 1./4.4, shape)
+    if pol == 'HH':
+        tan2 = np.square(np.tan(np.deg2rad(inc)))
+        s0 /= np.square((1. + 2.*tan2)/(1. + 1.3*tan2))
+    dims = ('y', 'x')
+    return xr.Dataset({
+        'sigma0': (dims, s0.astype(np.float32), {'polarization': pol}),
+        'incidence_angle': (dims, inc.astype(np.float32)),
+        'look_direction': (dims, look.astype(np.float32)),
+        'lon': (dims, grid_lons),
+        'lat': (dims, grid_lats),
+        'wind_speed_model': (dims, speed),
+    })
+
+
+def write_sar_netcdf(path, **kwargs):
+    """ Write a synthetic SAR scene (see `sar_dataset`) to `path`. """
+    sar_dataset(**kwargs).to_netcdf(path)
+    return path
+
+
+def ifs_surface_fields(time, step, lats, lons):
+    """ Smooth synthetic IFS surface fields, name -> array of shape
+    (lats.size, lons.size), varying with the forecast time and step.
+    """
+    lat, lon = np.meshgrid(np.deg2rad(lats), np.deg2rad(lons), indexing='ij')
+    hours = (pd.Timestamp(time) - pd.Timestamp('2015-01-01')).total_seconds()/3600. + step
+    phase = 2*np.pi*hours/24.
+    return {
+        'u10': 5. + 4.*np.sin(3*lat + phase)*np.cos(2*lon),
+        'v10': -2. + 3.*np.cos(2*lat)*np.sin(3*lon - phase),
+        't2m': 285. + 10.*np.cos(lat) + 2.*np.sin(phase + lon),
+        'msl': 101325. + 800.*np.sin(2*lon + lat - phase),
+    }
+
+
+def _sign_magnitude(value, nbytes):
+    value = int(round(value))
+    return (abs(value) | (1 << (8*nbytes - 1) if value < 0 else 0)).to_bytes(nbytes, 'big')
+
+
+def _ibm_bytes(value):
+    """ IBM single precision float not larger than `value`. """
+    if value == 0:
+        return bytes(4)
+    sign, value = (0x80, -value) if value < 0 else (0, value)
+    exponent = int(np.floor(np.log(value)/np.log(16.))) + 1
+    mantissa = value*16.**-exponent*2**24
+    mantissa = int(np.ceil(mantissa) if sign else np.floor(mantissa))
+    if mantissa >= 2**24:
+        exponent, mantissa = exponent + 1, mantissa//16
+    return bytes([sign | (exponent + 64)]) + mantissa.to_bytes(3, 'big')
+
+
+def _pack_simple(values, bits, decimal_scale, edition):
+    """ Reference value (as bytes), binary scale and packed bits of the
+    finite values.
+    """
+    scaled = values[np.isfinite(values)]*10.**decimal_scale
+    if edition == 1:
+        packed_reference = _ibm_bytes(scaled.min())
+        reference = ibm_float(packed_reference)
+    else:
+        packed_reference = _float32_bytes(scaled.min())
+        reference = struct.unpack('>f', packed_reference)[0]
+    span = scaled.max() - reference
+    binary_scale = int(np.ceil(np.log2(span/(2**bits - 1)))) if span > 0 else 0
+    ints = np.clip(np.round((scaled - reference)/2.**binary_scale), 0, 2**bits - 1).astype(np.uint64)
+    shifts = np.arange(bits - 1, -1, -1, dtype=np.uint64)
+    data = np.packbits(((ints[:, None] >> shifts) & np.uint64(1)).astype(np.uint8).ravel())
+    return packed_reference, binary_scale, data.tobytes()
+
+
+def _float32_bytes(value):
+    """ IEEE single precision float not larger than `value`. """
+    value32 = np.float32(value)
+    if value32 > value:
+        value32 = np.nextafter(value32, np.float32(-np.inf))
+    return struct.pack('>f', value32)
+
+
+def grib_message(values, lats, lons, param, time, step, edition=1, level=(1, 0),
+        bits=16, decimal_scale=2):
+    """ Simply packed GRIB message of a field on a regular grid.
+
+    Parameters
+    ==========
+    values : 2D array, shape (lats.size, lons.size)
+        NaN values are masked by a bitmap.
+    lats, lons : 1D arrays
+        Equally spaced coordinates [degrees] of the rows and columns.
+    param : int or string
+        GRIB1 paramId (e.g. 165, or 228003 for table 228) or GRIB2
+        'discipline.category.number' (e.g. '0.2.2').
+    time : datetime-like
+        Reference time.
+    step : int
+        Forecast step [hours].
+    edition : int, optional
+    level : (int, float) tuple, optional
+        Type and value of the level.
+    bits, decimal_scale : int, optional
+        Packing precision.
+
+    Returns
+    =======
+    message : bytes
+    """
+    values = np.asarray(values, dtype=float)
+    time = pd.Timestamp(time)
+    nj, ni = values.shape
+    valid = np.isfinite(values).ravel()
+    bitmap = np.packbits(valid).tobytes() if not valid.all() else None
+    if edition == 1:
+        table, number = (128, param) if param < 1000 else divmod(param, 1000)
+        year_of_century = time.year % 100 or 100
+        pds = bytes([0, 0, 28, table, 98, 145, 255, 0x80 | (0x40 if bitmap else 0), number,
+                level[0]]) + int(level[1]).to_bytes(2, 'big') + bytes([year_of_century,
+                time.month, time.day, time.hour, time.minute, 1, step, 0, 0, 0, 0, 0,
+                (time.year - 1)//100 + 1, 0]) + _sign_magnitude(decimal_scale, 2)
+        gds = bytes([0, 0, 32, 0, 255, 0]) + ni.to_bytes(2, 'big') + nj.to_bytes(2, 'big') \
+                + _sign_magnitude(lats[0]*1e3, 3) + _sign_magnitude(lons[0]*1e3, 3) \
+                + bytes([0x80]) + _sign_magnitude(lats[-1]*1e3, 3) \
+                + _sign_magnitude(lons[-1]*1e3, 3) \
+                + int(round(abs(lons[1] - lons[0])*1e3)).to_bytes(2, 'big') \
+                + int(round(abs(lats[1] - lats[0])*1e3)).to_bytes(2, 'big') \
+                + bytes([0 if lats[-1] < lats[0] else 0x40]) + bytes(4)
+        sections = pds + gds
+        if bitmap:
+            sections += (6 + len(bitmap)).to_bytes(3, 'big') + bytes([(-valid.size) % 8, 0, 0]) \
+                    + bitmap
+        reference, binary_scale, data = _pack_simple(values.ravel(), bits, decimal_scale, 1)
+        unused = 8*len(data) - bits*int(valid.sum())
+        sections += (11 + len(data)).to_bytes(3, 'big') + bytes([unused]) \
+                + _sign_magnitude(binary_scale, 2) + reference + bytes([bits]) + data
+        length = 8 + len(sections) + 4
+        return b'GRIB' + length.to_bytes(3, 'big') + bytes([1]) + sections + b'7777'
+
+    discipline, category, number = [int(x) for x in param.split('.')]
+    section1 = (21).to_bytes(4, 'big') + bytes([1, 0, 98, 0, 0, 2, 0, 1]) \
+            + time.year.to_bytes(2, 'big') + bytes([time.month, time.day, time.hour,
+            time.minute, time.second, 0, 1])
+    section3 = (72).to_bytes(4, 'big') + bytes([3, 0]) + (ni*nj).to_bytes(4, 'big') \
+            + bytes([0, 0, 0, 0, 6]) + bytes(15) + ni.to_bytes(4, 'big') + nj.to_bytes(4, 'big') \
+            + bytes(8) + _sign_magnitude(lats[0]*1e6, 4) + _sign_magnitude(lons[0] % 360.*1e6, 4) \
+            + bytes([0x30]) + _sign_magnitude(lats[-1]*1e6, 4) \
+            + _sign_magnitude(lons[-1] % 360.*1e6, 4) \
+            + int(round(abs(lons[1] - lons[0])*1e6)).to_bytes(4, 'big') \
+            + int(round(abs(lats[1] - lats[0])*1e6)).to_bytes(4, 'big') \
+            + bytes([0 if lats[-1] < lats[0] else 0x40])
+    section4 = (34).to_bytes(4, 'big') + bytes([4, 0, 0, 0, 0, category, number, 2, 0, 0, 0,
+            0, 0, 1]) + step.to_bytes(4, 'big') + bytes([level[0], 0]) \
+            + int(level[1]).to_bytes(4, 'big') + bytes([255, 255]) + bytes([255]*4)
+    reference, binary_scale, data = _pack_simple(values.ravel(), bits, decimal_scale, 2)
+    section5 = (21).to_bytes(4, 'big') + bytes([5]) + int(valid.sum()).to_bytes(4, 'big') \
+            + bytes([0, 0]) + reference + _sign_magnitude(binary_scale, 2) \
+            + _sign_magnitude(decimal_scale, 2) + bytes([bits, 0])
+    section6 = (6 + len(bitmap or b'')).to_bytes(4, 'big') + bytes([6, 0 if bitmap else 255]) \
+            + (bitmap or b'')
+    section7 = (5 + len(data)).to_bytes(4, 'big') + bytes([7]) + data
+    sections = section1 + section3 + section4 + section5 + section6 + section7
+    length = 16 + len(sections) + 4
+    return b'GRIB' + bytes([0, 0, discipline, 2]) + length.to_bytes(8, 'big') + sections \
+            + b'7777'
+
+
+def _grib2_sections(message):
+    """ (number, bytes) of the sections 1 to 7 of a GRIB2 message. """
+    sections = []
+    position = 16
+    while message[position:position + 4] != b'7777':
+        length = int.from_bytes(message[position:position + 4], 'big')
+        sections.append((message[position + 4], message[position:position + length]))
+        position += length
+    return sections
+
+
+def grib2_multi_field(messages):
+    """ One GRIB2 message with the fields of GRIB2 messages of the same
+    discipline, time and grid: the sections of the first message,
+    followed by the sections 4 to 7 of the others.
+    """
+    sections = b''.join(section for _, section in _grib2_sections(messages[0]))
+    for message in messages[1:]:
+        sections += b''.join(section for number, section in _grib2_sections(message)
+                if number >= 4)
+    length = 16 + len(sections) + 4
+    return messages[0][:8] + length.to_bytes(8, 'big') + sections + b'7777'
+
+
+# GRIB parameters of the synthetic IFS fields, for both editions
+IFS_GRIB_PARAMS = {
+    'u10': (165, '0.2.2', (103, 10)), 'v10': (166, '0.2.3', (103, 10)),
+    't2m': (167, '0.0.0', (103, 2)), 'msl': (151, '0.3.0', (101, 0)),
+}
+
+
+def write_ifs_grib(path, times=('2015-01-01T00', '2015-01-01T12'), steps=range(12),
+        lat_range=(30., 50.), lon_range=(-80., -50.), resolution=0.25, edition=1,
+        names=('u10', 'v10', 't2m', 'msl'), land=None, fields_per_message=1):
+    """ Write synthetic IFS surface forecasts (see `ifs_surface_fields`)
+    as a GRIB file, date (outer loop), time, step and parameter (inner
+    loop), as retrieved from MARS.
+
+    Parameters
+    ==========
+    land : 2D array of bools, optional
+        Missing points (bitmap) of the fields.
+    fields_per_message : int, optional
+        Number of consecutive parameters in each GRIB2 message (see
+        `grib2_multi_field`).
+
+    Returns
+    =======
+    lats, lons : 1D arrays
+        Descending latitudes and ascending longitudes of the grid.
+    """
+    lats = np.arange(lat_range[1], lat_range[0] - resolution/2, -resolution)
+    lons = np.arange(lon_range[0], lon_range[1] + resolution/2, resolution)
+    with open(path, 'wb') as f:
+        for time in times:
+            for step in steps:
+                fields = ifs_surface_fields(time, step, lats, lons)
+                messages = []
+                for name in names:
+                    values = fields[name] if land is None else np.where(land, np.nan, fields[name])
+                    grib1, grib2, level = IFS_GRIB_PARAMS[name]
+                    messages.append(grib_message(values, lats, lons,
+                            grib1 if edition == 1 else grib2, time, step, edition=edition,
+                            level=level))
+                for i in range(0, len(messages), fields_per_message):
+                    group = messages[i:i + fields_per_message]
+                    f.write(group[0] if len(group) == 1 else grib2_multi_field(group))
+    return lats, lons
+
+
+def write_ifs_netcdf(path, date='2015-01-01', runs=(0, 12), steps=range(12), lat_range=(30., 50.),
+        lon_range=(280., 310.), resolution=0.25, layout='mars', names=('u10', 'v10', 't2m', 'msl')):
+    """ Write a day of synthetic IFS surface forecasts (see
+    `ifs_surface_fields`) as NetCDF.
+
+    Parameters
+    ==========
+    layout : string, optional
+        'mars': variables on (time, latitude, longitude) with the valid
+        times, as converted by MARS (the steps of the runs must not
+        overlap). 'cfgrib': variables on (time, step, latitude,
+        longitude) with the run times and steps, and a valid_time
+        coordinate.
+    """
+    lats = np.arange(lat_range[1], lat_range[0] - resolution/2, -resolution)
+    lons = np.arange(lon_range[0], lon_range[1] + resolution/2, resolution)
+    times = [pd.Timestamp(date) + pd.Timedelta(hours=run) for run in runs]
+    fields = [[ifs_surface_fields(time, step, lats, lons) for step in steps] for time in times]
+    coords = {'latitude': lats, 'longitude': lons}
+    if layout == 'mars':
+        dims = ('time', 'latitude', 'longitude')
+        coords['time'] = [time + pd.Timedelta(hours=step) for time in times for step in steps]
+        data_vars = {name: (dims, np.array([f[name] for run in fields for f in run], dtype=np.float32))
+                for name in names}
+    else:
+        dims = ('time', 'step', 'latitude', 'longitude')
+        coords.update(time=times, step=pd.to_timedelta(list(steps), unit='h'))
+        coords['valid_time'] = (('time', 'step'), np.array(
+                [[time + pd.Timedelta(hours=step) for step in steps] for time in times],
+                dtype='datetime64[ns]'))
+        data_vars = {name: (dims, np.array([[f[name] for f in run] for run in fields],
+                dtype=np.float32)) for name in names}
+    xr.Dataset(data_vars, coords=coords).to_netcdf(path)
+    return lats, lons
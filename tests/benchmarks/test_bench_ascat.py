@@ -0,0 +1,46 @@
+""" Benchmarks of the ASCAT extraction functions on a synthetic swath.
+
+Run with, e.g.,
+
+    python -m pytest tests/benchmarks --benchmark-autosave
+    python -m pytest tests/benchmarks --benchmark-compare
+
+to record a baseline and compare later runs against it.
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import ascat
+
+pytestmark = pytest.mark.bench
+
+WINDOW_SIZES = [3, 5, 7, 9, 15]
+
+
+@pytest.mark.parametrize("func", [
+    ascat.ascat_params,
+    ascat.ascat_params_extended_list,
+    ascat.ascat_params_cnn,
+    ascat.ascat_params_mean_nxn,
+    ascat.ascat_params_gradient_nxn,
+])
+def test_single_station(benchmark, ascatFile, ascatStations, func):
+    lon, lat = ascatStations[0]
+    result = benchmark(func, ascatFile, lon, lat)
+    assert "sigma0_trip_fore" in result or "sigma0_trip_fore_x" in result
+
+
+def test_multi_station(benchmark, ascatFile, ascatStations):
+    def extract():
+        return [ascat.ascat_params(ascatFile, lon, lat) for lon, lat in ascatStations]
+    result = benchmark(extract)
+    assert len(result) == len(ascatStations)
+
+
+def test_multi_window(benchmark, ascatFile, ascatStations):
+    lon, lat = ascatStations[0]
+    def extract():
+        return [ascat.ascat_params_mean_nxn(ascatFile, lon, lat, nx=n, ny=n) for n in WINDOW_SIZES]
+    result = benchmark(extract)
+    assert len(result) == len(WINDOW_SIZES)
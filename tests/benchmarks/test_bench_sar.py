@@ -0,0 +1,62 @@
+""" Benchmarks of the SAR geolocation and cropping functions on
+synthetic geolocation grids.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import sar
+
+pytestmark = pytest.mark.bench
+
+
+class GridsOnlyNansat:
+    """Minimal stand-in for the Nansat methods used by crop_sar_data_xy."""
+
+    def __init__(self, grids):
+        self.grids = grids
+
+    def get_geolocation_grids(self):
+        return self.grids
+
+    def crop(self, x_offset, y_offset, x_size, y_size, allow_larger=True):
+        return int(x_offset), int(y_offset), x_size, y_size
+
+
+def _station(grids):
+    lons, lats = grids
+    return lons[600, 500], lats[600, 500]
+
+
+def test_latlon2xy(benchmark, sarGeolocationGrids):
+    lon, lat = _station(sarGeolocationGrids)
+    x, y = benchmark(sar.latlon2xy, sarGeolocationGrids[1], sarGeolocationGrids[0], lat, lon)
+    assert (y, x) == (600, 500)
+
+
+def test_crop_sar_data_xy(benchmark, sarGeolocationGrids):
+    lon, lat = _station(sarGeolocationGrids)
+    n = GridsOnlyNansat(sarGeolocationGrids)
+    extent = benchmark(sar.crop_sar_data_xy, n, lat, lon, 9, 9)
+    assert extent[2:] == (9, 9)
+
+
+def test_multi_station_latlon2xy(benchmark, sarGeolocationGrids):
+    lons, lats = sarGeolocationGrids
+    idx = np.random.default_rng(0).integers(0, min(lons.shape), (10, 2))
+    def extract():
+        return [sar.latlon2xy(lats, lons, lats[i, j], lons[i, j]) for i, j in idx]
+    result = benchmark(extract)
+    assert len(result) == len(idx)
+
+
+def test_sar_params(benchmark, sarFile):
+    lons, lats = sar.open_sar(sarFile).get_geolocation_grids()
+    result = benchmark(sar.sar_params, sarFile, lons[200, 250], lats[200, 250], x_size=9, y_size=9)
+    assert result[0].shape == (9, 9)
+
+
+def test_sar_params_full_scene(benchmark, sarFile):
+    result = benchmark(sar.sar_params, sarFile)
+    assert result[0].shape == result[2].shape
@@ -57,6 +57,51 @@ def fncDir(tmpDir):
 #  Mock Files
 ##
 
+# Size of the synthetic datasets: SATDATA_BENCH_SCALE=2 doubles the
+# number of grid points along each axis
+BENCH_SCALE = float(os.environ.get("SATDATA_BENCH_SCALE", "1"))
+
+# Stations (lon, lat) within the synthetic ASCAT swath
+ASCAT_STATIONS = [(-70.8, 40.1), (-65.0, 40.0), (-60.0, 35.0), (-72.0, 45.0), (-55.0, 32.5)]
+
+
+@pytest.fixture(scope="session")
+def ascatFile(tmpDir):
+    """A synthetic Data Tailor-like ASCAT NetCDF file."""
+    from synthetic import write_ascat_netcdf
+    return write_ascat_netcdf(
+        os.path.join(tmpDir, "synthetic_ascat.nc"), resolution=0.125/BENCH_SCALE)
+
+
+@pytest.fixture(scope="session")
+def ascatSwathFile(tmpDir):
+    """A synthetic ASCAT level 1 SZR product in swath geometry."""
+    from synthetic import write_ascat_swath_netcdf
+    return write_ascat_swath_netcdf(
+        os.path.join(tmpDir, "synthetic_ascat_swath.nc"), n_rows=int(240*BENCH_SCALE))
+
+
+@pytest.fixture(scope="session")
+def ascatStations():
+    """Station locations (lon, lat) covered by the synthetic ASCAT file."""
+    return list(ASCAT_STATIONS)
+
+
+@pytest.fixture(scope="session")
+def sarFile(tmpDir):
+    """A synthetic calibrated SAR scene in HH polarization."""
+    from synthetic import write_sar_netcdf
+    return write_sar_netcdf(
+        os.path.join(tmpDir, "synthetic_sar.nc"),
+        shape=(int(400*BENCH_SCALE), int(500*BENCH_SCALE)))
+
+
+@pytest.fixture(scope="session")
+def sarGeolocationGrids():
+    """Synthetic SAR geolocation grids (lons, lats)."""
+    from synthetic import geolocation_grids
+    return geolocation_grids(shape=(int(1000*BENCH_SCALE), int(1200*BENCH_SCALE)))
+
 
 ##
 #  Objects
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+""" Write the GRIB samples of test_grib_index.py with ecCodes, from its
+ECMWF sample messages (local definition 1, as written by MARS):
+
+- ifs_fc_grib1.grib: 10u, 10v, 2t and msl forecasts of 2015-01-01 00 and
+  12 UTC, steps 0 and 1, and significant wave height (140.229) with the
+  land point masked by a bitmap, all with simple packing, as retrieved
+  from MARS with "packing": "simple".
+- ifs_fc_grib2.grib: the same messages converted to GRIB2 (edition=2),
+  and 2t at step 0 of 00 UTC once more with CCSDS packing, the MARS and
+  CDS default for GRIB2.
+
+The values are `sample_values` on the 4 x 5 grid 40.3..40.0 N,
+71.0..70.6 W (0.1 degree).
+"""
+import os
+
+import eccodes
+import numpy as np
+
+LATS = np.array([40.3, 40.2, 40.1, 40.0])
+LONS = np.array([-71.0, -70.9, -70.8, -70.7, -70.6])
+
+# paramId -> offset of the values
+PARAMS = {165: 5., 166: -3., 167: 280., 151: 101000., 140229: 2.}
+
+
+def sample_values(param, hour, step):
+    """ Values of a sample field, shape (4, 5), NaN at the land point of
+    the wave field.
+    """
+    j, i = np.meshgrid(np.arange(LATS.size), np.arange(LONS.size), indexing='ij')
+    values = PARAMS[param] + hour/12. + step + 0.5*i - 0.25*j
+    if param == 140229:
+        values[0, 0] = np.nan
+    return values
+
+
+def _message(param, hour, step, edition, packing='grid_simple'):
+    handle = eccodes.codes_grib_new_from_samples('regular_ll_sfc_grib1')
+    try:
+        eccodes.codes_set(handle, 'dataDate', 20150101)
+        eccodes.codes_set(handle, 'dataTime', hour*100)
+        eccodes.codes_set(handle, 'stepRange', str(step))
+        eccodes.codes_set(handle, 'paramId', param)
+        eccodes.codes_set_long(handle, 'Ni', LONS.size)
+        eccodes.codes_set_long(handle, 'Nj', LATS.size)
+        eccodes.codes_set(handle, 'latitudeOfFirstGridPointInDegrees', LATS[0])
+        eccodes.codes_set(handle, 'longitudeOfFirstGridPointInDegrees', LONS[0])
+        eccodes.codes_set(handle, 'latitudeOfLastGridPointInDegrees', LATS[-1])
+        eccodes.codes_set(handle, 'longitudeOfLastGridPointInDegrees', LONS[-1])
+        eccodes.codes_set(handle, 'iDirectionIncrementInDegrees', 0.1)
+        eccodes.codes_set(handle, 'jDirectionIncrementInDegrees', 0.1)
+        eccodes.codes_set(handle, 'bitsPerValue', 16)
+        values = sample_values(param, hour, step)
+        if np.isnan(values).any():
+            eccodes.codes_set(handle, 'bitmapPresent', 1)
+            eccodes.codes_set(handle, 'missingValue', 9999.)
+            values = np.where(np.isnan(values), 9999., values)
+        eccodes.codes_set_values(handle, values.ravel())
+        if edition == 2:
+            eccodes.codes_set(handle, 'edition', 2)
+        if packing != 'grid_simple':
+            eccodes.codes_set(handle, 'packingType', packing)
+        return eccodes.codes_get_message(handle)
+    finally:
+        eccodes.codes_release(handle)
+
+
+def main(directory=os.path.dirname(os.path.abspath(__file__))):
+    for edition in [1, 2]:
+        with open(os.path.join(directory, 'ifs_fc_grib%d.grib' % edition), 'wb') as f:
+            for hour in [0, 12]:
+                for step in [0, 1]:
+                    for param in PARAMS:
+                        f.write(_message(param, hour, step, edition))
+            if edition == 2:
+                f.write(_message(167, 0, 0, edition, packing='grid_ccsds'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from ascat import (BEAMS, ascat_params_cnn, ascat_params_extended_list, ascat_params_mean_nxn,
+        ascat_params_gradient_nxn, ascat_params_multiscale, valid_pixels)
+
+
+def test_flag_masked_window_statistics(ascatFile):
+    lon, lat = -65., 40.
+    params = ascat_params_mean_nxn(ascatFile, lon, lat, nx=9, ny=9, flag_mask='strict',
+            norm_model='cmod5n')
+    crop = ascat_params_cnn(ascatFile, lon, lat, nx=9, ny=9)
+    ds = xr.open_dataset(ascatFile)
+    lats, lons = crop['lats_cropped_image'], crop['lons_cropped_image']
+    window = ds.sel(lat=lats, lon=lons)
+
+    for beam in BEAMS:
+        valid = ((window['f_usable_' + beam] == 0) & (window['f_kp_' + beam] == 0)
+                & (window['f_land_' + beam] == 0)
+                & np.isfinite(window['sigma0_trip_' + beam])).values
+        s0 = window['sigma0_trip_' + beam].values[valid]
+        assert 0 < valid.sum() < valid.size
+        assert params['n_valid_trip_' + beam] == valid.sum()
+        assert params['sigma0_trip_' + beam] == pytest.approx(s0.mean())
+        assert params['std_sigma0_trip_' + beam] == pytest.approx(s0.std())
+        assert params['inc_angle_trip_' + beam] == pytest.approx(
+            window['inc_angle_trip_' + beam].values[valid].mean())
+
+    # Without a mask the statistics are unchanged
+    unmasked = ascat_params_mean_nxn(ascatFile, lon, lat, nx=9, ny=9)
+    assert 'n_valid_trip_fore' not in unmasked
+    assert unmasked['sigma0_trip_mid'] == pytest.approx(np.nanmean(crop['sigma0_trip_mid']))
+
+
+def test_flag_masked_crops(ascatFile):
+    masked = ascat_params_cnn(ascatFile, -65., 40., nx=9, ny=9, flag_mask={'f_kp_': 0})
+    crop = ascat_params_cnn(ascatFile, -65., 40., nx=9, ny=9)
+    for beam in BEAMS:
+        n = np.isfinite(masked['sigma0_trip_' + beam]).sum()
+        assert n == masked['n_valid_trip_' + beam]
+        assert n < np.isfinite(crop['sigma0_trip_' + beam]).sum()
+
+    station = ascat_params_extended_list(ascatFile, -65., 40., flag_mask='usable')
+    for beam in BEAMS:
+        assert station['valid_trip_' + beam] == int(
+            station['f_usable_' + beam] <= 1 and station['f_land_' + beam] == 0)
+
+    with pytest.raises(ValueError):
+        valid_pixels(xr.open_dataset(ascatFile), 'fore', 'unknown')
+
+
+def test_multiscale_window_statistics(ascatFile):
+    lon, lat = -65., 40.
+    params = ascat_params_multiscale(ascatFile, lon, lat, sizes=[3, 5, 9], flag_mask='strict')
+    for size in [3, 5, 9]:
+        single = ascat_params_mean_nxn(ascatFile, lon, lat, nx=size, ny=size, flag_mask='strict')
+        suffix = '_%dx%d' % (size, size)
+        for beam in BEAMS:
+            for key in ['sigma0_trip_', 'std_sigma0_trip_', 'inc_angle_trip_', 'azi_angle_trip_']:
+                assert params[key + beam + suffix] == pytest.approx(single[key + beam], abs=1e-9)
+            assert params['n_valid_trip_' + beam + suffix] == single['n_valid_trip_' + beam]
+    assert params['start_sensing_time'] == single['start_sensing_time']
+
+
+def test_plane_fit_gradients(ascatFile):
+    params = ascat_params_gradient_nxn(ascatFile, -65., 40., nx=9, ny=9)
+    masked = ascat_params_gradient_nxn(ascatFile, -65., 40., nx=9, ny=9, flag_mask='strict')
+    for beam in BEAMS:
+        for key in ['sigma0_trip_%s_x' % beam, 'sigma0_trip_%s_y' % beam]:
+            assert isinstance(params[key], float) and np.isfinite(params[key])
+            # dB/km
+            assert abs(params[key]) < 0.5
+            assert masked[key] != params[key]
@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import xarray as xr
+
+from ascat import check_if_low_resolution
+from ascat_index import build_index, filter_tasks, read_index, select_files
+from streaming import Task
+from synthetic import write_ascat_netcdf, write_ascat_swath_netcdf
+
+
+def test_build_index(ascatFile, tmpDir):
+    data_dir = os.path.join(tmpDir, 'ascat_index')
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    high = shutil.copy(ascatFile, os.path.join(data_dir, 'a_high.nc'))
+    low = write_ascat_netcdf(os.path.join(data_dir, 'b_low.nc'), resolution=2.5)
+    broken = os.path.join(data_dir, 'c_broken.nc')
+    with open(broken, 'w') as f:
+        f.write('not netcdf')
+    index_file = os.path.join(data_dir, 'index.csv')
+
+    index = build_index(data_dir, index_file=index_file, workers=2)
+    assert list(index['filename']) == [high, low, broken]
+    assert list(index['low_resolution'][:2]) == [0, 1]
+    with xr.open_dataset(low) as ds:
+        assert check_if_low_resolution(ds) == 1
+    assert index['error'][2].startswith('OSError')
+    assert index['lat_max'][0] <= 50. and index['lon_min'][0] == -80.
+    assert str(index['start_sensing_time'][0]) == '2016-03-01 12:00:00+00:00'
+
+    # Only the new file is scanned, the index is read back unchanged
+    os.remove(broken)
+    other = write_ascat_netcdf(os.path.join(data_dir, 'd_other.nc'), lat_range=(-10., 0.))
+    index = build_index(data_dir, index_file=index_file)
+    assert list(index['filename']) == [high, low, other]
+    assert len(read_index(index_file)) == 3
+
+    assert select_files(index, -65., 40.) == [high]
+    assert select_files(index, -65., 40., allow_low_resolution=True) == [high, low]
+    assert select_files(index, -65., 40., start='2016-03-02') == []
+    assert select_files(index, -65., -5.) == [other]
+
+    tasks = [Task('b', 'p', path, -65., 40., None) for path in [high, low, other, 'x.nc']]
+    assert [t.filename for t in filter_tasks(tasks, index)] == [high, 'x.nc']
+
+
+def test_swath_files(ascatFile, tmpDir):
+    data_dir = os.path.join(tmpDir, 'ascat_index_swath')
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    grid = shutil.copy(ascatFile, os.path.join(data_dir, 'a_grid.nc'))
+    swath = write_ascat_swath_netcdf(os.path.join(data_dir, 'b_swath.nc'), n_rows=60)
+    index = build_index(data_dir, workers=0)
+    assert list(index['swath']) == [0, 1]
+    row = index.iloc[1]
+    assert (row['n_lat'], row['n_lon'], row['low_resolution']) == (60, 82, 0)
+    assert -180. <= row['lon_min'] < row['lon_max'] < 0.
+    assert str(row['start_sensing_time']).startswith('2016-03-01 12:00:00')
+    with xr.open_dataset(swath) as ds:
+        lon, lat = float(ds.lon[30, 60]) - 360., float(ds.lat[30, 60])
+    # The grid also covers the node
+    assert select_files(index, lon, lat) == [grid, swath]
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from ascat import BEAMS
+from ascat_swath import (as_swath, ascat_swath_params, ascat_swath_params_cnn,
+        ascat_swath_params_resampled, open_swath, swath_locator)
+
+
+def test_open_swath_layouts(ascatSwathFile):
+    swath = open_swath(ascatSwathFile)
+    raw = xr.open_dataset(ascatSwathFile)
+    assert swath['sigma0_trip_aft'].dims == ('row', 'cell')
+    assert np.array_equal(swath['f_kp_mid'].values, raw['f_kp'].values[:, :, 1])
+    assert float(swath.lon.max()) < 180.
+    assert swath.attrs['start_sensing_time'].startswith('2016-03-01T12:00:00')
+
+    # Data Tailor output without projection
+    tailor = swath.rename({'row': 'y', 'cell': 'x', 'lat': 'latitude', 'lon': 'longitude'})
+    assert as_swath(tailor).identical(swath)
+
+
+def test_nearest_node(ascatSwathFile):
+    swath = open_swath(ascatSwathFile)
+    for row, cell in [(0, 0), (120, 40), (120, 41), (239, 81)]:
+        lon, lat = float(swath.lon[row, cell]) + 0.01, float(swath.lat[row, cell]) - 0.01
+        params = ascat_swath_params(ascatSwathFile, lon, lat, norm_model='cmod5n')
+        assert (params['row'], params['cell']) == (row, cell)
+        for beam in BEAMS:
+            assert params['sigma0_trip_' + beam] == swath['sigma0_trip_' + beam].values[row, cell]
+            assert np.isfinite(params['sigma0_norm_trip_' + beam])
+    assert swath_locator(ascatSwathFile) is swath_locator(ascatSwathFile)
+
+    # Nadir gap and far from the swath
+    lon = float(swath.lon[120, 40] + swath.lon[120, 41])/2
+    lat = float(swath.lat[120, 40] + swath.lat[120, 41])/2
+    assert ascat_swath_params(ascatSwathFile, lon, lat) is None
+    assert ascat_swath_params(ascatSwathFile, 10., 10.) is None
+
+
+def test_swath_windows(ascatSwathFile):
+    swath = open_swath(ascatSwathFile)
+    lon, lat = float(swath.lon[1, 38]), float(swath.lat[1, 38])
+    params = ascat_swath_params_cnn(ascatSwathFile, lon, lat, nx=9, ny=7, flag_mask='strict')
+    s0 = params['sigma0_trip_fore']
+    assert s0.shape == (7, 9)
+    # Rows before the first one and cells across the ground track are NaN
+    assert np.isnan(s0[:2]).all() and np.isnan(s0[:, 7:]).all()
+    valid = ((swath['f_kp_fore'] == 0) & (swath['f_usable_fore'] == 0)
+            & (swath['f_land_fore'] == 0)).values[0:5, 34:41]
+    expected = np.where(valid, swath['sigma0_trip_fore'].values[0:5, 34:41], np.nan)
+    assert np.array_equal(s0[2:, :7], expected, equal_nan=True)
+    assert params['n_valid_trip_fore'] == valid.sum()
+    assert params['lats_cropped_image'][3, 4] == lat
+
+
+def test_resampled_windows(ascatSwathFile):
+    swath = open_swath(ascatSwathFile)
+    lon, lat = float(swath.lon[100, 20]), float(swath.lat[100, 20])
+    params = ascat_swath_params_resampled(ascatSwathFile, lon, lat, nx=9, ny=9, resolution=0.1)
+    lats, lons = params['lats_cropped_image'], params['lons_cropped_image']
+    assert lats[0] > lats[-1] and lons[0] < lons[-1]
+    assert params['sigma0_trip_mid'][4, 4] == swath['sigma0_trip_mid'].values[100, 20]
+
+    # Brute force nearest nodes
+    slat, slon = np.deg2rad(swath.lat.values.ravel()), np.deg2rad(swath.lon.values.ravel())
+    for i, j in [(0, 0), (2, 7), (8, 3)]:
+        glat, glon = np.deg2rad(lats[i]), np.deg2rad(lons[j])
+        d = np.arccos(np.clip(np.sin(slat)*np.sin(glat)
+                + np.cos(slat)*np.cos(glat)*np.cos(slon - glon), -1, 1))
+        nearest = np.argmin(d)
+        expected = swath['sigma0_trip_mid'].values.ravel()[nearest] if d[nearest]*6371. <= 12.5 else np.nan
+        assert params['sigma0_trip_mid'][i, j] == pytest.approx(expected, nan_ok=True)
+
+    locator = swath_locator(ascatSwathFile)
+    assert len(locator._neighbours) == 1
+    ascat_swath_params_resampled(ascatSwathFile, lon, lat, nx=9, ny=9, resolution=0.1)
+    assert len(locator._neighbours) == 1
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from crop_store import CropStore, export_dataframe, export_sar_crops, pixel_columns
+from dtype_policy import apply_dtype_policy
+from sar_tiling import tile_scene
+
+
+def _sar_obs(size, n_products=4):
+    rng = np.random.default_rng(0)
+    products = {}
+    for i in range(n_products):
+        params = {field: rng.normal(size=(size, size)) for field in ['s0', 's0_norm', 'inc', 'az']}
+        params.update(x_size=size, y_size=size, pol='HH')
+        products['S1A_%d' % i] = {'filename': 'S1A_%d.SAFE' % i, 'sar_params': {str(size): params}}
+    # Crop at the edge of the image, and a product without crops
+    products['S1A_0']['sar_params'][str(size)]['s0'] = np.zeros((size - 1, size))
+    products['S1B'] = {'filename': 'S1B.SAFE', 'sar_params': {}}
+    return {'SPURS1': {'lat': [24.5], 'lon': [-38.], 'products': products}}
+
+
+def test_export_sar_crops(tmpDir):
+    store_dir = os.path.join(tmpDir, 'crop_store_sar')
+    in_situ_obs = _sar_obs(9)
+    table = export_sar_crops(in_situ_obs, store_dir, 9)
+
+    assert list(table['product']) == ['S1A_1', 'S1A_2', 'S1A_3']
+    assert (table['pol'] == 'HH').all()
+    store = CropStore(store_dir)
+    assert len(store) == 3
+    assert store.arrays['s0'].shape == (3, 9, 9)
+    assert store.arrays['s0'].dtype == np.float32
+    assert isinstance(store.arrays['s0'], np.memmap)
+    expected = in_situ_obs['SPURS1']['products']['S1A_2']['sar_params']['9']['s0_norm']
+    np.testing.assert_allclose(store.batch([1])['s0_norm'][0], expected, rtol=1e-6)
+    assert not os.path.exists(os.path.join(store_dir, 's0.raw'))
+
+
+def test_export_compact_sar_crops(tmpDir):
+    store_dir = os.path.join(tmpDir, 'crop_store_sar_compact')
+    in_situ_obs = _sar_obs(9)
+    expected = {}
+    for product, product_dict in in_situ_obs['SPURS1']['products'].items():
+        for params in product_dict['sar_params'].values():
+            params['inc'] = 30. + 10.*params['inc']
+            params['az'] = 100.*params['az'] % 360. - 180.
+            expected[product] = params['inc'], params['az']
+            apply_dtype_policy(params, 'compact')
+            assert params['inc'].dtype == np.int16
+    export_sar_crops(in_situ_obs, store_dir, 9)
+    store = CropStore(store_dir)
+    np.testing.assert_allclose(store.batch([0])['inc'][0], expected['S1A_1'][0], atol=0.005)
+    np.testing.assert_allclose(store.batch([2])['az'][0], expected['S1A_3'][1], atol=0.005)
+
+
+def test_export_dataframe_and_batches(tmpDir):
+    store_dir = os.path.join(tmpDir, 'crop_store_ascat')
+    nx, ny = 3, 2
+    rng = np.random.default_rng(1)
+    crops = rng.normal(size=(5, ny, nx))
+    df = pd.DataFrame(crops.reshape(5, -1), columns=pixel_columns('sigma0_trip_fore', nx, ny))
+    df['UWr'] = np.arange(5.)
+    table = export_dataframe({'SPURS1': df.iloc[:2], 'CLIMODE': df.iloc[2:]}, store_dir,
+            ['sigma0_trip_fore'], nx, ny, chunk_rows=2)
+
+    assert list(table.columns) == ['index', 'buoy', 'UWr']
+    assert list(table['buoy']) == ['SPURS1']*2 + ['CLIMODE']*3
+    store = CropStore(store_dir)
+    np.testing.assert_allclose(store.arrays['sigma0_trip_fore'], crops, rtol=1e-6)
+
+    # Zero-copy slices, gathered index arrays in the given order
+    batch = store.batch(slice(1, 3))['sigma0_trip_fore']
+    assert np.shares_memory(batch, store.arrays['sigma0_trip_fore'])
+    np.testing.assert_allclose(store.batch([4, 0, 2])['sigma0_trip_fore'], crops[[4, 0, 2]],
+            rtol=1e-6)
+
+    seen = []
+    for index, arrays in store.iter_batches(2, shuffle=True, seed=0):
+        np.testing.assert_allclose(arrays['sigma0_trip_fore'], crops[index], rtol=1e-6)
+        seen.extend(index)
+    assert sorted(seen) == list(range(5))
+    assert store.stack(['sigma0_trip_fore']).shape == (5, ny, nx, 1)
+
+
+def test_open_tiled_scene(sarFile, tmpDir):
+    store_dir = os.path.join(tmpDir, 'crop_store_tiles')
+    patches = tile_scene(sarFile, store_dir, size=32, stride=64)
+    store = CropStore(os.path.join(store_dir, 'synthetic_sar'))
+    assert len(store) == len(patches)
+    assert store.arrays['s0_norm'].shape == (len(patches), 32, 32)
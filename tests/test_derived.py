@@ -0,0 +1,80 @@
+import os
+
+import dask.array
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from air_density import air_density
+from derived import DerivedVariables
+
+
+def _write_field(path, name, values):
+    time = pd.date_range('2016-01-01', periods=values.shape[0], freq='h')
+    ds = xr.Dataset(
+        {name: (('time', 'latitude', 'longitude'), values)},
+        coords={'time': time, 'latitude': [41., 40.], 'longitude': [-71., -70.]})
+    ds.to_netcdf(path)
+    return path
+
+
+@pytest.fixture
+def model_files(fncDir):
+    rng = np.random.default_rng(1)
+    shape = (48, 2, 2)
+    fields = {
+        'u10': rng.normal(0., 8., shape),
+        'v10': rng.normal(0., 8., shape),
+        't2m': rng.normal(285., 3., shape),
+        'd2m': rng.normal(280., 3., shape),
+        'msl': rng.normal(101300., 500., shape),
+        'ewss': rng.normal(0., 0.2*3600, shape),
+        'nsss': rng.normal(0., 0.2*3600, shape),
+    }
+    return {name: _write_field(os.path.join(fncDir, name + '.nc'), name, values)
+            for name, values in fields.items()}
+
+
+def test_derived_variables_are_lazy_and_only_open_needed_files(model_files):
+    dv = DerivedVariables(model_files, chunks={'time': 24})
+    wspd = dv.get('wspd')
+    assert isinstance(wspd.data, dask.array.Array)
+    assert sorted(dv._datasets) == sorted([model_files['u10'], model_files['v10']])
+
+    u10 = xr.open_dataset(model_files['u10'])['u10'].values
+    v10 = xr.open_dataset(model_files['v10'])['v10'].values
+    np.testing.assert_allclose(wspd.values, np.hypot(u10, v10))
+
+    # Northerly wind blows from 0 degrees, westerly from 270 degrees
+    wdir = dv.get('wdir').values
+    expected = np.rad2deg(np.arctan2(-u10, -v10)) % 360.
+    np.testing.assert_allclose(wdir, expected)
+
+
+def test_rhoa_and_tau(model_files):
+    dv = DerivedVariables(model_files)
+    ds = dv.dataset(['rhoa', 'tau'])
+    t2m = xr.open_dataset(model_files['t2m'])['t2m'].values
+    d2m = xr.open_dataset(model_files['d2m'])['d2m'].values
+    msl = xr.open_dataset(model_files['msl'])['msl'].values
+    rhoa, _ = air_density(t2m, d2m, msl/100.)
+    np.testing.assert_allclose(ds['rhoa'].values, rhoa)
+    assert 'u10' not in ds
+    assert dv.get('rhoa') is dv.get('rhoa')
+
+
+def test_tau_from_friction_velocity(model_files, fncDir):
+    files = {k: model_files[k] for k in ['t2m', 'd2m', 'msl']}
+    files['zust'] = _write_field(
+        os.path.join(fncDir, 'zust.nc'), 'zust', np.full((48, 2, 2), 0.3))
+    dv = DerivedVariables(files)
+    np.testing.assert_allclose(
+        dv.get('tau').values, dv.get('rhoa').values*0.09)
+
+
+def test_unresolvable_variable(model_files):
+    dv = DerivedVariables({'u10': model_files['u10']})
+    assert not dv.available('wspd')
+    with pytest.raises(KeyError):
+        dv.get('wspd')
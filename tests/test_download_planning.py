@@ -0,0 +1,64 @@
+import pytest
+
+from download_planning import buoy_rois, group_rois, merge_rois, roi_extent, station_roi
+
+
+def test_station_roi():
+    assert station_roi(-70.5, 40., margin=1.5) == {'NSWE': [41.5, 38.5, -72., -69.]}
+    assert station_roi(0., 89.5)['NSWE'][0] == 90.
+    in_situ_obs = {'Pioneer_1': {'lon': [-70.8], 'lat': [40.1], 'products': []}}
+    assert buoy_rois(in_situ_obs, margin=1.) == {'Pioneer_1': station_roi(-70.8, 40.1, 1.)}
+
+
+def test_merge_and_group_rois():
+    rois = {
+        'Pioneer_1': station_roi(-70.8, 40.1, 1.),
+        'Pioneer_2': station_roi(-70.9, 39.9, 1.),
+        'Endurance_8': station_roi(-124.3, 44.6, 1.),
+        'Irminger_6': station_roi(-39.5, 59.9, 1.),
+    }
+    merged = merge_rois([rois['Pioneer_1'], rois['Pioneer_2']])
+    assert merged['NSWE'] == pytest.approx([41.1, 38.9, -71.9, -69.8])
+    assert roi_extent(merged) == pytest.approx(2.2)
+
+    groups = group_rois(rois, max_extent=5.)
+    assert sorted(sorted(keys) for keys, _ in groups) == [
+        ['Endurance_8'], ['Irminger_6'], ['Pioneer_1', 'Pioneer_2']]
+    assert dict((tuple(sorted(keys)), roi) for keys, roi in groups)[
+        ('Pioneer_1', 'Pioneer_2')] == merged
+    assert len(group_rois(rois, max_extent=100.)) == 1
+
+
+def test_plan_downloads_once_per_product(tmpDir):
+    import os
+    from download_planning import (invert_products, plan_downloads, product_dir, product_key,
+            read_manifest, record_download)
+
+    in_situ_obs = {
+        'Pioneer_1': {'lon': [-70.8], 'lat': [40.1], 'products': ['A', 'B']},
+        'Pioneer_2': {'lon': [-70.9], 'lat': [39.9], 'products': ['B', 'C']},
+        'Irminger_6': {'lon': [-39.5], 'lat': [59.9], 'products': ['B']},
+    }
+    assert invert_products(in_situ_obs) == {
+        'A': ('A', ['Pioneer_1']), 'B': ('B', ['Pioneer_1', 'Pioneer_2', 'Irminger_6']),
+        'C': ('C', ['Pioneer_2'])}
+
+    chain = {'product': 'ASCATL1SZR', 'format': 'netcdf4'}
+    tasks = plan_downloads(in_situ_obs, chain=chain, max_extent=5.)
+    assert [(t.product, sorted(t.buoys)) for t in tasks] == [
+        ('A', ['Pioneer_1']), ('B', ['Pioneer_1', 'Pioneer_2']), ('B', ['Irminger_6']),
+        ('C', ['Pioneer_2'])]
+    assert len(set(t.key for t in tasks)) == 4
+    assert tasks[1].key == product_key('B', dict(chain, roi=tasks[1].roi))
+    assert [t.roi for t in plan_downloads(in_situ_obs)] == [None]*3
+    assert product_dir('/data', 'abcdef') == os.path.join('/data', 'ab', 'abcdef')
+
+    manifest_file = os.path.join(tmpDir, 'manifest.jsonl')
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    record_download(in_situ_obs, tasks[1], 'xx/key/b.nc', manifest_file)
+    assert in_situ_obs['Pioneer_1']['nc_files'] == {'B': 'xx/key/b.nc'}
+    assert in_situ_obs['Pioneer_2']['nc_files'] == {'B': 'xx/key/b.nc'}
+    assert 'nc_files' not in in_situ_obs['Irminger_6']
+    entry, = read_manifest(manifest_file).values()
+    assert entry['key'] == tasks[1].key and sorted(entry['buoys']) == ['Pioneer_1', 'Pioneer_2']
@@ -0,0 +1,164 @@
+import base64
+import hashlib
+import http.server
+import io
+import os
+import threading
+import urllib.request
+
+import pytest
+
+from download_utils import copy_stream, download, remote_info, stream_size
+
+DATA = os.urandom(100000)
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Serves DATA at /ranges (with range requests), /plain (without),
+    /corrupt (wrong Content-MD5), /flaky (the first range request of
+    each part after offset 50000 is cut short) and /garbled (it is
+    answered with an invalid status line).
+    """
+    requests = []
+    cut = set()
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, length, start=None, end=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        if self.path != '/plain':
+            self.send_header('Accept-Ranges', 'bytes')
+        md5 = hashlib.md5(b'x' if self.path == '/corrupt' else DATA).digest()
+        self.send_header('Content-MD5', base64.b64encode(md5).decode())
+        if start is not None:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(DATA)))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(DATA))
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        type(self).requests.append((self.path, rng))
+        if rng is None or self.path == '/plain':
+            self._headers(200, len(DATA))
+            self.wfile.write(DATA)
+            return
+        start, end = [int(x) for x in rng.split('=')[1].split('-')]
+        end += 1
+        if self.path == '/garbled' and start >= 50000 and start not in type(self).cut:
+            type(self).cut.add(start)
+            self.wfile.write(b'garbled\r\n\r\n')
+            self.close_connection = True
+            return
+        self._headers(206, end - start, start, end)
+        if self.path == '/flaky' and start >= 50000 and start not in type(self).cut:
+            type(self).cut.add(start)
+            self.wfile.write(DATA[start:start + 10])
+            self.close_connection = True
+            return
+        self.wfile.write(DATA[start:end])
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % httpd.server_address[1]
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    Handler.requests = []
+    Handler.cut = set()
+
+
+def test_remote_info(server):
+    assert remote_info(server + '/ranges') == {'size': len(DATA), 'ranges': True, 'md5': MD5}
+    assert remote_info(server + '/plain')['ranges'] is False
+
+
+def test_parallel_range_download(server, tmp_path):
+    path = str(tmp_path / 'file.nc')
+    download(server + '/ranges', path, part_size=16384, workers=4)
+    assert open(path, 'rb').read() == DATA
+    assert len(Handler.requests) == 7
+    assert all(rng is not None for _, rng in Handler.requests)
+    assert os.listdir(tmp_path) == ['file.nc']
+    # Existing files are not downloaded again
+    download(server + '/ranges', path)
+    assert len(Handler.requests) == 7
+
+
+def test_download_without_ranges(server, tmp_path):
+    path = str(tmp_path / 'file.nc')
+    download(server + '/plain', path, part_size=16384)
+    assert open(path, 'rb').read() == DATA
+    assert Handler.requests == [('/plain', None)]
+
+
+def test_resume_interrupted_download(server, tmp_path):
+    path = str(tmp_path / 'file.nc')
+    with pytest.raises(OSError):
+        download(server + '/flaky', path, part_size=25000, workers=1, retries=1)
+    assert not os.path.exists(path)
+    assert open(path + '.part.done').read().split() == ['0', '1']
+
+    Handler.requests = []
+    download(server + '/flaky', path, part_size=25000, workers=1, retries=1)
+    assert open(path, 'rb').read() == DATA
+    # Only the missing parts are fetched again
+    assert sorted(rng for _, rng in Handler.requests) == ['bytes=50000-74999', 'bytes=75000-99999']
+    assert os.listdir(tmp_path) == ['file.nc']
+
+
+def test_retry_truncated_part(server, tmp_path):
+    path = str(tmp_path / 'file.nc')
+    retries = []
+    download(server + '/flaky', path, part_size=25000, workers=2,
+            on_retry=lambda attempt, error: retries.append((attempt, type(error))))
+    assert open(path, 'rb').read() == DATA
+    assert retries == [(2, OSError)]*2
+
+
+def test_retry_garbled_part(server, tmp_path):
+    path = str(tmp_path / 'file.nc')
+    download(server + '/garbled', path, part_size=25000, workers=2)
+    assert open(path, 'rb').read() == DATA
+
+
+def test_checksum_mismatch(server, tmp_path):
+    path = str(tmp_path / 'file.nc')
+    with pytest.raises(OSError, match='MD5'):
+        download(server + '/corrupt', path, part_size=16384)
+    assert os.listdir(tmp_path) == []
+    with pytest.raises(OSError, match='Size'):
+        download(server + '/ranges', path, size=len(DATA) + 1)
+    assert not os.path.exists(path)
+
+
+def test_copy_stream(tmp_path):
+    path = str(tmp_path / 'file.nc')
+    assert copy_stream(io.BytesIO(DATA), path, size=len(DATA), md5=MD5, buffer_size=4096) == len(DATA)
+    assert open(path, 'rb').read() == DATA
+
+    other = str(tmp_path / 'other.nc')
+    with pytest.raises(OSError, match='MD5'):
+        copy_stream(io.BytesIO(DATA[:-1]), other, md5=MD5)
+    with pytest.raises(OSError, match='Size'):
+        copy_stream(io.BytesIO(DATA[:-1]), other, size=len(DATA))
+    assert sorted(os.listdir(tmp_path)) == ['file.nc']
+
+
+def test_stream_size(server):
+    with urllib.request.urlopen(server + '/plain') as response:
+        assert stream_size(response) == len(DATA)
+    assert stream_size(io.BytesIO(DATA)) is None
+    response = io.BytesIO(DATA)
+    response.headers = {'Content-Length': '10', 'Content-Encoding': 'gzip'}
+    assert stream_size(response) is None
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from dtype_policy import (apply_dtype_policy, decode_angles, encode_angles,
+        geotransform_from_grids, grids_from_geotransform)
+
+
+def test_angle_encoding_roundtrip():
+    angles = np.array([0., 25.123, 64.99, 359.99, -120., np.nan])
+    encoded = encode_angles(angles)
+    assert encoded.dtype == np.int16
+    decoded = decode_angles(encoded)
+    np.testing.assert_allclose(decoded[:-1], angles[:-1], atol=0.005)
+    assert np.isnan(decoded[-1])
+
+
+def test_angle_encoding_range():
+    # ASCAT azimuths in the -180 to 180 convention
+    angles = np.array([-180., -170., -150., -147.7, 179.99, 360.])
+    np.testing.assert_allclose(decode_angles(encode_angles(angles)), angles, atol=0.005)
+    with pytest.raises(ValueError):
+        encode_angles([10., 400.])
+    with pytest.raises(ValueError):
+        encode_angles(-190.)
+
+
+def test_geotransform_roundtrip():
+    rows, cols = np.indices((9, 7))
+    lons = 5. + 0.01*cols - 0.002*rows
+    lats = 65. - 0.001*cols - 0.009*rows
+    transform, error = geotransform_from_grids(lons, lats)
+    assert error < 1e-10
+    np.testing.assert_allclose(grids_from_geotransform(transform, lons.shape), (lons, lats))
+
+    transform, error = geotransform_from_grids(np.arange(-80., -60., 0.25), np.arange(50., 30., -0.25))
+    np.testing.assert_allclose(transform, [-80., 0.25, 0., 50., 0., -0.25])
+
+
+def test_compact_policy():
+    params = {
+        'grid_lons_orig': np.arange(-80., -60., 0.25),
+        'grid_lats_orig': np.arange(50., 30., -0.25),
+        'lons_cropped_image': np.arange(-71., -69.9, 0.25),
+        'lats_cropped_image': np.arange(40.5, 39.4, -0.25),
+        'sigma0_trip_fore': np.full((5, 5), -12.3),
+        'inc_angle_trip_fore': np.full((5, 5), 45.),
+        'azi_angle_trip_fore': 270.5,
+        'f_usable_fore': 0,
+        'start_sensing_time': '2016-01-01T00:00:00',
+    }
+    apply_dtype_policy(params, 'compact', station_lon=-70.4, station_lat=40.1)
+    assert 'grid_lons_orig' not in params and 'lats_cropped_image' not in params
+    assert params['grid_shape_orig'] == (80, 80)
+    assert params['station_index_orig'] == (40, 38)
+    assert params['station_index_cropped_image'] == (2, 2)
+    assert params['sigma0_trip_fore'].dtype == np.float32
+    assert params['inc_angle_trip_fore'].dtype == np.int16
+    assert decode_angles(params['azi_angle_trip_fore']) == pytest.approx(270.5)
+    assert params['f_usable_fore'] == 0
+
+
+def test_non_affine_grids_are_kept():
+    lons, lats = np.meshgrid(np.linspace(0., 1., 10)**2, np.linspace(60., 61., 10))
+    params = apply_dtype_policy({'grid_lons': lons, 'grid_lats': lats}, 'compact')
+    assert params['grid_lons'] is lons
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from gradients import grid_spacing_km, plane_fit, plane_gradients
+
+
+def test_plane_gradients_recover_plane():
+    lats = np.arange(45., 43.9, -0.125)
+    lons = np.arange(-65., -63.9, 0.125)
+    dy, dx = grid_spacing_km(lats, lons)
+    assert dy == pytest.approx(-13.9, abs=0.1)
+    assert dx == pytest.approx(13.9*np.cos(np.deg2rad(44.5)), abs=0.1)
+
+    # Plane of 0.02 dB/km eastward and -0.01 dB/km northward, with noise
+    rng = np.random.default_rng(0)
+    north = (lats[:, None] - lats.mean())*np.deg2rad(6371.)
+    east = (lons[None, :] - lons.mean())*np.deg2rad(6371.)*np.cos(np.deg2rad(44.5))
+    windows = -15. + 0.02*east - 0.01*north + rng.normal(0., 0.01, (50, 9, 9))
+    windows[1::2][rng.random((25, 9, 9)) < 0.3] = np.nan
+    gx, gy = plane_gradients(windows, dy, dx)
+    assert gx.shape == (50,)
+    assert np.allclose(gx, 0.02, atol=2e-3) and np.allclose(gy, -0.01, atol=2e-3)
+
+    # The batch matches the fits of single windows
+    for i in [0, 1]:
+        valid = np.isfinite(windows[i])
+        rows, cols = np.nonzero(valid)
+        A = np.stack([np.ones(rows.size), cols - 4., rows - 4.], axis=1)
+        expected = np.linalg.lstsq(A, windows[i][valid], rcond=None)[0]
+        assert plane_fit(windows[i]) == pytest.approx(expected)
+
+
+def test_plane_fit_degenerate_windows():
+    windows = np.full((3, 5, 5), np.nan)
+    windows[0, 2] = np.arange(5.)  # one row, no row gradient
+    windows[1, :2, :1] = 1.  # too few pixels
+    windows[2] = 1.
+    coefficients = plane_fit(windows)
+    assert np.isnan(coefficients[:2]).all()
+    assert coefficients[2] == pytest.approx([1., 0., 0.])
+
+    valid = np.ones((5, 5), dtype=bool)
+    valid[:, 0] = False
+    windows[2, :, 0] = 100.
+    assert plane_fit(windows[2], valid) == pytest.approx([1., 0., 0.])
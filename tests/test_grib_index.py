@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import instrumentation
+import synthetic
+import grib_index
+from grib_index import GribFile, build_index, scan_file
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture(params=[1, 2])
+def gribFile(request, tmp_path):
+    path = str(tmp_path / 'ifs_fc_20150101.grib')
+    land = np.zeros((81, 121), dtype=bool)
+    land[10:20, 30:50] = True
+    lats, lons = synthetic.write_ifs_grib(path, steps=range(6), edition=request.param, land=land)
+    return path, lats, lons, land
+
+
+def test_index(gribFile):
+    path, lats, lons, land = gribFile
+    index = build_index(path)
+    assert os.path.exists(path + '.index.csv')
+    assert len(index) == 2*6*4
+    assert list(index['name'][:4]) == ['u10', 'v10', 't2m', 'msl']
+    assert (index['offset'].diff()[1:] == index['length'][:-1].values).all()
+    row = index.iloc[-1]
+    assert row['time'] == pd.Timestamp('2015-01-01T12') and row['step'] == 5
+    assert row['valid_time'] == pd.Timestamp('2015-01-01T17')
+    assert (row['ni'], row['nj'], row['lat1'], row['lat2']) == (121, 81, 50., 30.)
+    assert row['lon1'] % 360 == 280.
+    assert (index['packing'] == 'simple').all()
+
+    # The persistent index is reused, and rebuilt when the file changes
+    assert build_index(path).equals(index)
+    with open(path, 'ab') as f:
+        f.write(b'\0'*10)
+    os.utime(path, (0, 0))
+    assert len(build_index(path)) == len(index)
+    assert (build_index(path)['file_mtime'] == 0).all()
+
+
+def test_field_and_points(gribFile):
+    path, lats, lons, land = gribFile
+    grib = GribFile(path)
+    row = grib.select(name='t2m', time=pd.Timestamp('2015-01-01T12'), step=3).iloc[0]
+    expected = np.where(land, np.nan, synthetic.ifs_surface_fields(row['time'], 3, lats, lons)['t2m'])
+    field = grib.field(row)
+    np.testing.assert_allclose(field, expected, atol=1e-3)
+    assert np.array_equal(np.isnan(field), land)
+    row_lats, row_lons = grib.coordinates(row)
+    np.testing.assert_allclose(row_lats, lats)
+    np.testing.assert_allclose((row_lons + 180) % 360 - 180, lons)
+
+    for lat, lon in [(40.1, -70.8), (30., -50.), (50., -80.), (47.6, -71.8)]:
+        j, i = np.abs(lats - lat).argmin(), np.abs(lons - lon).argmin()
+        assert grib.point(row, lat, lon) == pytest.approx(field[j, i], nan_ok=True)
+    assert np.isnan(grib.point(row, 47.6, -71.8))
+    assert np.isnan(grib.point(row, 20., -60.))
+    assert np.isnan(grib.point(row, 40., 10.))
+
+
+def test_point_values(gribFile):
+    path, lats, lons, land = gribFile
+    instrumentation.reset()
+    values = GribFile(path).point_values(40.1, -70.8, name=['u10', 'v10'], step=[0, 1, 2])
+    assert instrumentation.summary()['stages']['grib.point_values']['count'] == 1
+    assert list(values.columns) == ['name', 'level', 'time', 'step', 'valid_time', 'value']
+    assert len(values) == 2*2*3
+    assert values['name'].tolist() == ['u10']*6 + ['v10']*6
+    assert values['valid_time'].is_monotonic_increasing is False
+    j, i = np.abs(lats - 40.1).argmin(), np.abs(lons + 70.8).argmin()
+    for _, row in values.iterrows():
+        expected = synthetic.ifs_surface_fields(row['time'], row['step'], lats, lons)[row['name']]
+        assert row['value'] == pytest.approx(expected[j, i], abs=1e-3)
+
+
+def test_padding_between_messages(tmp_path):
+    lats, lons = np.array([41., 40.]), np.array([-71., -70., -69.])
+    values = np.arange(6.).reshape(2, 3)
+    path = str(tmp_path / 'padded.grib')
+    with open(path, 'wb') as f:
+        f.write(b'\0'*7)
+        f.write(synthetic.grib_message(values, lats, lons, 165, '2015-01-01', 0))
+        f.write(b'\0'*13)
+        f.write(synthetic.grib_message(values + 1, lats, lons, 228003, '2015-01-01', 1))
+    entries = scan_file(path)
+    assert [entry['offset'] for entry in entries][0] == 7
+    assert [entry['name'] for entry in entries] == ['u10', 'zust']
+    grib = GribFile(path, index_file=False)
+    assert not os.path.exists(path + '.index.csv')
+    np.testing.assert_allclose(grib.field(grib.index.iloc[1]), values + 1, atol=1e-2)
+    assert grib.point(grib.index.iloc[0], 40.2, -69.1) == pytest.approx(5., abs=1e-2)
+
+
+@pytest.mark.parametrize('edition', [1, 2])
+def test_ecmwf_samples(edition):
+    # Encoded by ecCodes (see data/make_grib_samples.py), with the ECMWF
+    # local section and 0.1 degree grid of MARS retrievals
+    grib = GribFile(os.path.join(DATA_DIR, 'ifs_fc_grib%d.grib' % edition), index_file=False)
+    simple = grib.index[grib.index['packing'] == 'simple']
+    assert len(simple) == 20
+    assert list(simple['name'][:5]) == ['u10', 'v10', 't2m', 'msl', 'swh']
+    offsets = {'u10': 5., 'v10': -3., 't2m': 280., 'msl': 101000., 'swh': 2.}
+    j, i = np.meshgrid(np.arange(4), np.arange(5), indexing='ij')
+    for _, row in simple.iterrows():
+        expected = offsets[row['name']] + row['time'].hour/12. + row['step'] + 0.5*i - 0.25*j
+        if row['name'] == 'swh':
+            expected[0, 0] = np.nan
+        np.testing.assert_allclose(grib.field(row), expected, atol=1e-3)
+        lats, lons = grib.coordinates(row)
+        np.testing.assert_allclose(lats, [40.3, 40.2, 40.1, 40.0])
+        np.testing.assert_allclose((lons + 180) % 360 - 180, [-71., -70.9, -70.8, -70.7, -70.6])
+        assert grib.point(row, 40.1, -70.8) == pytest.approx(expected[2, 2], abs=1e-3)
+    assert np.isnan(grib.point(simple.iloc[4], 40.3, -71.))
+
+    # The CCSDS packing of archived GRIB2 fields needs eccodes
+    other = grib.index[grib.index['packing'] != 'simple']
+    assert len(other) == (0 if edition == 1 else 1)
+    if edition == 2 and grib_index.eccodes is None:
+        with pytest.raises(ImportError):
+            grib.point(other.iloc[0], 40.1, -70.8)
+    elif edition == 2:
+        assert grib.point(other.iloc[0], 40.1, -70.8) == pytest.approx(280.5, abs=1e-3)
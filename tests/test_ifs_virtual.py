@@ -0,0 +1,131 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import instrumentation
+import synthetic
+import ifs_virtual
+from ifs_virtual import VirtualForecasts, build_index, read_index
+
+
+@pytest.fixture
+def ifsDir(tmp_path):
+    """ Three days of forecasts: MARS NetCDF (00/12 runs, steps 0-11),
+    cfgrib NetCDF (overlapping steps 0-17) and GRIB.
+    """
+    synthetic.write_ifs_netcdf(str(tmp_path / 'ifs_fc_20150101.nc'))
+    synthetic.write_ifs_netcdf(str(tmp_path / 'ifs_fc_20150102.nc'), date='2015-01-02',
+            layout='cfgrib', steps=range(18))
+    synthetic.write_ifs_grib(str(tmp_path / 'ifs_fc_20150103.grib'),
+            times=('2015-01-03T00', '2015-01-03T12'), steps=range(12), names=('u10', 't2m'))
+    return str(tmp_path)
+
+
+def _expected(name, valid_time, step, lat, lon):
+    lats = np.arange(50., 29.9, -0.25)
+    lons = np.arange(-80., -49.9, 0.25)
+    j, i = np.abs(lats - lat).argmin(), np.abs(lons - lon).argmin()
+    run = valid_time - pd.Timedelta(hours=step)
+    return synthetic.ifs_surface_fields(run, step, lats, lons)[name][j, i]
+
+
+def test_build_index(ifsDir, monkeypatch):
+    index_file = os.path.join(ifsDir, 'refs.json')
+    files, refs = build_index(ifsDir, index_file=index_file)
+    assert [os.path.basename(info['path']) for info in files] == [
+        'ifs_fc_20150101.nc', 'ifs_fc_20150102.nc', 'ifs_fc_20150103.grib']
+    assert files[2]['names'] == ['t2m', 'u10']
+    assert len(refs) == 24 + 2*18 + 2*12*2
+    mars = refs[refs['file'] == 0]
+    assert (mars['step'] == mars['valid_time'].dt.hour % 12).all()
+    assert (mars['time'].dt.hour == 12*(mars['valid_time'].dt.hour//12)).all()
+
+    # The index is read back as written, and unchanged files are not scanned again
+    assert read_index(index_file)[1].equals(refs)
+    scanned = []
+    scan_file = ifs_virtual.scan_file
+    monkeypatch.setattr(ifs_virtual, 'scan_file',
+            lambda path, runs: scanned.append(path) or scan_file(path, runs))
+    os.utime(files[1]['path'], (0, 0))
+    assert build_index(ifsDir, index_file=index_file)[1].equals(refs)
+    assert scanned == [files[1]['path']]
+
+
+def test_shortest_lead_time(ifsDir):
+    build_index(ifsDir, index_file=os.path.join(ifsDir, 'refs.json'))
+    ifs = VirtualForecasts(os.path.join(ifsDir, 'refs.json'))
+    assert ifs.names == ['msl', 't2m', 'u10', 'v10']
+    refs = ifs.references('u10')
+    assert refs.index.is_unique and refs.index.is_monotonic_increasing
+    assert len(refs) == 3*24
+    # 2015-01-02T12 to 17 are covered by both runs of the day, and
+    # 2015-01-03T00 to 05 by the 12 UTC run of the day before
+    assert refs.loc['2015-01-02T15', 'step'] == 3
+    assert tuple(refs.loc['2015-01-03T03', ['file', 'step']]) == (2, 3)
+    # Only the NetCDF files have v10
+    assert len(ifs.references('v10')) == 2*24 + 6
+    assert tuple(ifs.references('v10').loc['2015-01-03T03', ['file', 'step']]) == (1, 15)
+
+
+def test_points(ifsDir):
+    build_index(ifsDir, index_file=os.path.join(ifsDir, 'refs.json'))
+    ifs = VirtualForecasts(os.path.join(ifsDir, 'refs.json'))
+    instrumentation.reset()
+    values = ifs.points(40.1, -70.8, ['u10', 't2m'], start='2015-01-01T18', end='2015-01-03T23')
+    assert instrumentation.summary()['stages']['ifs.points']['count'] == 1
+    assert list(values.columns) == ['u10', 'u10_step', 't2m', 't2m_step']
+    assert len(values) == 54
+    for valid_time, row in values.iterrows():
+        for name in ['u10', 't2m']:
+            assert row[name] == pytest.approx(
+                _expected(name, valid_time, row[name + '_step'], 40.1, -70.8), abs=2e-3)
+    assert len(ifs._open) == 3
+
+    times = pd.DatetimeIndex(['2015-01-02T13:20', '2015-01-01T03:00', '2016-01-01'], tz='UTC')
+    values = ifs.points(40.1, -70.8, ['msl'], times=times, tolerance='1h')
+    assert values['msl_step'].tolist()[:2] == [1., 3.]
+    assert np.isnan(values['msl'].iloc[2]) and np.isnan(values['msl_step'].iloc[2])
+
+    field = ifs.field('t2m', '2015-01-03T07')
+    assert field.shape == (81, 121) and field.attrs['step'] == 7
+    assert instrumentation.summary()['stages']['ifs.field']['count'] == 1
+    assert float(field.sel(latitude=40., longitude=-70., method='nearest')) == pytest.approx(
+        _expected('t2m', pd.Timestamp('2015-01-03T07'), 7, 40., -70.), abs=2e-3)
+    assert ifs.field('u10', '2015-01-03T07:20', tolerance='1h').attrs['step'] == 7
+    with pytest.raises(KeyError):
+        ifs.field('t2m', '2016-01-01', tolerance='1h')
+    with pytest.raises(KeyError):
+        ifs.field('sst', '2015-01-03T07')
+    ifs.close()
+    assert not ifs._open
+
+
+def test_multi_field_grib(tmp_path):
+    # GRIB2 messages with u10 and v10, and t2m and msl
+    path = str(tmp_path / 'ifs_fc_20150103.grib2')
+    synthetic.write_ifs_grib(path, times=('2015-01-03T00', '2015-01-03T12'), steps=range(12),
+            edition=2, fields_per_message=2)
+    index_file = str(tmp_path / 'refs.json')
+    files, refs = build_index(str(tmp_path), index_file=index_file)
+    assert len(refs) == 4*24 and sorted(set(refs['field'])) == [0, 1]
+    ifs = VirtualForecasts(index_file)
+    values = ifs.points(40.1, -70.8, ['u10', 'v10', 'msl'], start='2015-01-03T02',
+            end='2015-01-03T04')
+    for valid_time, row in values.iterrows():
+        for name in ['u10', 'v10', 'msl']:
+            assert row[name] == pytest.approx(
+                _expected(name, valid_time, row[name + '_step'], 40.1, -70.8), abs=2e-2)
+    field = ifs.field('v10', '2015-01-03T07')
+    assert float(field.sel(latitude=40., longitude=-70. % 360, method='nearest')) == pytest.approx(
+        _expected('v10', pd.Timestamp('2015-01-03T07'), 7, 40., -70.), abs=2e-3)
+
+    # An index of the previous version is rebuilt
+    with open(index_file) as f:
+        index = json.load(f)
+    index['version'] = 1
+    with open(index_file, 'w') as f:
+        json.dump(index, f)
+    assert build_index(str(tmp_path), index_file=index_file)[1].equals(refs)
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import numpy as np
+
+from ascat import ascat_params_cnn
+from incremental import (Ledger, compact, extraction_spec, load_table, open_parts, spec_hash,
+        update)
+from streaming import extractor, iter_tasks
+
+
+def _obs(ascatFile, stations):
+    data_dir, filename = os.path.split(ascatFile)
+    return data_dir, {
+        'buoy_%d' % i: {'lon': [lon], 'lat': [lat], 'products': ['p'],
+            'nc_files': {'p': filename}}
+        for i, (lon, lat) in enumerate(stations)}
+
+
+def test_spec_hash():
+    spec = extraction_spec(ascat_params_cnn, nx=5, ny=5)
+    assert spec['function'] == 'ascat.ascat_params_cnn'
+    assert spec_hash(spec) == spec_hash(extraction_spec(ascat_params_cnn, ny=5, nx=5))
+    assert spec_hash(spec) != spec_hash(extraction_spec(ascat_params_cnn, nx=7, ny=7))
+
+
+def test_incremental_update(ascatFile, ascatStations, tmpDir):
+    store_dir = os.path.join(tmpDir, 'incremental_store')
+    shutil.rmtree(store_dir, ignore_errors=True)
+    spec = extraction_spec(ascat_params_cnn, nx=5, ny=5)
+    extract = extractor(ascat_params_cnn, nx=5, ny=5)
+    calls = []
+
+    def counting_extract(task):
+        calls.append(task.buoy)
+        return extract(task)
+
+    data_dir, in_situ_obs = _obs(ascatFile, ascatStations[:2])
+    counts = update(store_dir, iter_tasks(in_situ_obs, data_dir), counting_extract, spec,
+            fields=['sigma0_trip_fore'], shape=(5, 5), workers=2)
+    assert counts == {'ok': 2}
+
+    # Nothing new
+    assert update(store_dir, iter_tasks(in_situ_obs, data_dir), counting_extract, spec,
+            fields=['sigma0_trip_fore'], shape=(5, 5)) == {}
+    assert len(calls) == 2
+
+    # A new buoy and a product that fails
+    data_dir, in_situ_obs = _obs(ascatFile, ascatStations[:3])
+    in_situ_obs['broken'] = {'lon': [0.], 'lat': [0.], 'products': ['q'],
+            'nc_files': {'q': 'missing.nc'}}
+    counts = update(store_dir, iter_tasks(in_situ_obs, data_dir), counting_extract, spec,
+            fields=['sigma0_trip_fore'], shape=(5, 5), workers=0)
+    assert counts == {'ok': 1, 'failed': 1}
+    assert sorted(calls) == ['broken', 'buoy_0', 'buoy_1', 'buoy_2']
+
+    ledger = Ledger(os.path.join(store_dir, 'ledger.jsonl'))
+    assert ledger.counts(spec_hash(spec)) == {'ok': 3, 'failed': 1}
+    assert not ledger.is_done('broken', 'q', spec_hash(spec))
+
+    table = load_table(store_dir, spec)
+    assert sorted(table['buoy']) == ['buoy_0', 'buoy_1', 'buoy_2']
+    assert len(open_parts(store_dir, spec)) == 2
+
+    expected = ascat_params_cnn(ascatFile, *ascatStations[2], nx=5, ny=5)['sigma0_trip_fore']
+    compact(store_dir, spec)
+    parts = open_parts(store_dir, spec)
+    assert len(parts) == 1
+    store, = parts.values()
+    assert list(store.table['buoy']) == ['buoy_0', 'buoy_1', 'buoy_2']
+    np.testing.assert_allclose(store.arrays['sigma0_trip_fore'][2], expected, rtol=1e-6)
+
+    # A new configuration starts over
+    spec7 = extraction_spec(ascat_params_cnn, nx=7, ny=7)
+    counts = update(store_dir, iter_tasks(_obs(ascatFile, ascatStations[:1])[1], data_dir),
+            extractor(ascat_params_cnn, nx=7, ny=7), spec7)
+    assert counts == {'ok': 1}
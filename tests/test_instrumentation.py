@@ -0,0 +1,44 @@
+import json
+import os
+
+import instrumentation
+from ascat import ascat_params_cnn
+from sar import sar_params
+
+
+def test_summary(tmpDir):
+    instrumentation.reset()
+    for _ in range(3):
+        with instrumentation.timer('stage'):
+            pass
+    instrumentation.count('patches', 5)
+    instrumentation.record_cache('memo', True)
+    instrumentation.record_cache('memo', False)
+    instrumentation.record_cache('memo', True)
+
+    summary = instrumentation.summary()
+    assert summary['stages']['stage']['count'] == 3
+    assert summary['stages']['stage']['max'] >= summary['stages']['stage']['p50'] >= 0
+    assert summary['counters'] == {'patches': 5}
+    assert summary['caches']['memo'] == {'hits': 2, 'misses': 1, 'hit_rate': 2/3}
+
+    path = instrumentation.write_summary(os.path.join(tmpDir, 'metrics_{pid}.json'))
+    assert path.endswith('metrics_%d.json' % os.getpid())
+    with open(path) as f:
+        assert json.load(f)['counters'] == {'patches': 5}
+
+
+def test_extraction_stages(ascatFile, sarFile):
+    instrumentation.reset()
+    ascat_params_cnn(ascatFile, -65., 40., nx=5, ny=5)
+    sar_params(sarFile, station_lon=5.2, station_lat=64.9, x_size=5, y_size=5)
+
+    summary = instrumentation.summary()
+    for stage in ['ascat.open_dataset', 'ascat.nearest', 'ascat.crop',
+            'sar.open', 'sar.crop', 'sar.read', 'sar.calibrate', 'sar.geolocation']:
+        assert summary['stages'][stage]['count'] == 1
+    assert summary['counters']['files_opened'] == 2
+    assert summary['counters']['bytes_opened'] == (
+        os.path.getsize(ascatFile) + os.path.getsize(sarFile))
+    # Only the 5x5 window and the SAR crop are read
+    assert 0 < summary['counters']['bytes_read'] < summary['counters']['bytes_opened']/10
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from cmod import cmod5n_b0
+from nrcs_models import (IncidenceLUT, NORMALIZATION_MODELS, PR_MODELS,
+        get_normalization_model)
+
+
+def test_lut_matches_exact_models():
+    inc = np.random.default_rng(0).uniform(20., 65., 10000)
+    for model in list(NORMALIZATION_MODELS.values()):
+        np.testing.assert_allclose(model(-15., inc), model(-15., inc, exact=True), atol=1e-5)
+    for model in PR_MODELS.values():
+        np.testing.assert_allclose(model(0.01, inc), model(0.01, inc, exact=True), rtol=1e-6)
+
+
+def test_lut_nan_and_clamping():
+    lut = IncidenceLUT(lambda inc: 2.*inc, start=10., stop=20.)
+    values = lut(np.array([np.nan, 5., 12.345, 25.]))
+    assert np.isnan(values[0])
+    np.testing.assert_allclose(values[1:], [20., 24.69, 40.])
+    assert lut(15.) == pytest.approx(30.)
+
+
+def test_topouzelis_model():
+    model = get_normalization_model('topouzelis2016')
+    assert model(-20., 30.) == pytest.approx((-20. + 0.776*30. - 31.638)/2.)
+
+
+def test_cmod5n_normalization_removes_incidence_dependence():
+    inc = np.array([25., 35., 45., 55.])
+    s0 = 10.*np.log10(cmod5n_b0(8., inc))
+    s0_norm = get_normalization_model('cmod5n')(s0, inc)
+    np.testing.assert_allclose(s0_norm, 10.*np.log10(cmod5n_b0(8., 40.)), atol=1e-4)
+
+
+def test_unknown_model():
+    with pytest.raises(ValueError):
+        get_normalization_model('cmod7')
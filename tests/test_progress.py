@@ -0,0 +1,75 @@
+import io
+import json
+import os
+
+import pytest
+
+from progress import Progress, read_events, summarize_events
+
+
+def test_failure_messages():
+    progress = Progress('test_job', stream=io.StringIO(), report_every=3600.)
+    assert progress.failed('a', error='no files available')['error'] == 'no files available'
+    assert progress.failed('b', error=OSError('timeout'))['error'] == 'OSError: timeout'
+    assert progress.retry('c', attempt=2, error='HTTP 503')['error'] == 'HTTP 503'
+    assert progress.stats()['failed'] == 2
+
+
+def test_progress_events(tmpDir):
+    events_file = os.path.join(tmpDir, 'progress_events.jsonl')
+    textfile = os.path.join(tmpDir, 'progress.prom')
+    if os.path.exists(events_file):
+        os.remove(events_file)
+    stream = io.StringIO()
+
+    with Progress('test_job', total=5, events_file=events_file, stream=stream,
+            textfile=textfile, report_every=3600.) as progress:
+        progress.skipped('a', reason='already exists')
+        with progress.item('b') as fields:
+            fields['bytes'] = 1000
+        progress.started('c')
+        progress.retry('c', attempt=2, error=IOError('timeout'))
+        progress.finished('c', bytes=500)
+        with pytest.raises(ValueError):
+            with progress.item('d'):
+                raise ValueError('bad file')
+        progress.started('e')
+
+        stats = progress.stats()
+        assert stats['finished'] == 2
+        assert stats['failed'] == 1
+        assert stats['skipped'] == 1
+        assert stats['bytes'] == 1500
+        assert stats['remaining'] == 1
+        assert stats['eta'] is not None
+
+    events = read_events(events_file)
+    assert [e['event'] for e in events] == [
+        'skipped', 'started', 'finished', 'started', 'retry', 'finished',
+        'started', 'failed', 'started', 'summary']
+    assert events[2]['bytes'] == 1000 and events[2]['duration'] >= 0
+    assert events[7]['error'] == 'ValueError: bad file'
+    assert all(e['job'] == 'test_job' for e in events)
+
+    summary = summarize_events(events_file)['test_job']
+    assert summary['finished'] == 2
+    assert summary['retries'] == 1
+    assert summary['bytes'] == 1500
+    assert summary['in_progress'] == ['e']
+
+    assert '[test_job] 4/5 items (1 failed, 1 skipped)' in stream.getvalue()
+    with open(textfile) as f:
+        metrics = f.read()
+    assert 'satdata_items_total{job="test_job",outcome="finished"} 2.0' in metrics
+    assert 'satdata_bytes_total{job="test_job"} 1500.0' in metrics
+    assert '# TYPE satdata_items_expected gauge' in metrics
+
+
+def test_progress_without_events_file():
+    stream = io.StringIO()
+    progress = Progress('job', stream=stream)
+    progress.finished('a')
+    event = json.loads(stream.getvalue().splitlines()[0])
+    assert event['event'] == 'finished'
+    assert event['duration'] is None
+    assert progress.stats()['eta'] is None
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import regrid
+from regrid import apply_weights, bilinear_weights, regrid_weights
+
+
+def _linear(lat, lon):
+    return 2. + 0.5*lat - 0.25*lon
+
+
+@pytest.fixture(autouse=True)
+def clearWeights():
+    regrid._weights.clear()
+
+
+def test_bilinear_weights():
+    # ERA5 wave grid, descending latitudes
+    src_lats, src_lons = np.arange(50., 29.9, -0.5), np.arange(-80., -49.9, 0.5)
+    dst_lats, dst_lons = np.arange(31.1, 48., 0.3), np.arange(-79.9, -51., 0.7)
+    weights = bilinear_weights(src_lats, src_lons, dst_lats, dst_lons)
+    assert weights.shape == (dst_lats.size*dst_lons.size, src_lats.size*src_lons.size)
+    assert weights.getnnz(axis=1).max() <= 4
+    np.testing.assert_allclose(weights.sum(axis=1), 1.)
+
+    values = _linear(*np.meshgrid(src_lats, src_lons, indexing='ij'))
+    expected = _linear(*np.meshgrid(dst_lats, dst_lons, indexing='ij'))
+    np.testing.assert_allclose(apply_weights(weights, values, expected.shape), expected)
+
+    # Points, with longitudes in the 0-360 convention and outside the grid
+    lats, lons = np.array([40.1, 40.1, 60.]), np.array([289.2, -70.8, -70.])
+    result = apply_weights(bilinear_weights(src_lats, src_lons, lats, lons, points=True), values)
+    np.testing.assert_allclose(result[:2], _linear(40.1, -70.8))
+    assert np.isnan(result[2])
+
+
+def test_global_grid_wraps():
+    src_lats, src_lons = np.arange(90., -90.1, -0.5), np.arange(0., 360., 0.5)
+    lat, lon = np.meshgrid(src_lats, src_lons, indexing='ij')
+    values = np.cos(np.deg2rad(lon))*np.cos(np.deg2rad(lat))
+    dst_lats, dst_lons = np.array([10.2, -45.3]), np.array([359.8, -0.1, 179.9])
+    weights = bilinear_weights(src_lats, src_lons, dst_lats, dst_lons)
+    np.testing.assert_allclose(weights.sum(axis=1), 1.)
+    result = apply_weights(weights, values, (2, 3))
+    lat, lon = np.meshgrid(dst_lats, dst_lons, indexing='ij')
+    np.testing.assert_allclose(result, np.cos(np.deg2rad(lon))*np.cos(np.deg2rad(lat)), atol=1e-4)
+
+
+def test_missing_values_and_batches():
+    src_lats, src_lons = np.arange(30., 40.1, 0.25), np.arange(-80., -69.9, 0.25)
+    values = np.stack([_linear(*np.meshgrid(src_lats, src_lons, indexing='ij')) + t
+            for t in range(5)]).astype(np.float32)
+    values[:, :8, :8] = np.nan
+    dst_lats, dst_lons = np.linspace(30.1, 39.9, 17), np.linspace(-79.9, -70.1, 23)
+    weights = bilinear_weights(src_lats, src_lons, dst_lats, dst_lons)
+    result = apply_weights(weights, values, (17, 23))
+    assert result.shape == (5, 17, 23) and result.dtype == np.float32
+    for t in range(5):
+        np.testing.assert_allclose(result[t], apply_weights(weights, values[t], (17, 23)))
+    lat, lon = np.meshgrid(dst_lats, dst_lons, indexing='ij')
+    valid = np.isfinite(result[0])
+    # Points next to the missing values use the remaining valid points
+    assert (valid & ((lat < 31.75) & (lon < -78.25))).sum() == 0
+    assert valid[(lat > 32.) | (lon > -78.)].all()
+    strict = np.isfinite(apply_weights(weights, values, (17, 23), min_weight=1.)[0])
+    assert (valid & ~strict).sum() > 0 and not (strict & ~valid).any()
+    np.testing.assert_allclose(result[2][strict], (_linear(lat, lon) + 2)[strict], rtol=1e-5)
+    # Within a grid cell of the renormalized points
+    np.testing.assert_allclose(result[2][valid], (_linear(lat, lon) + 2)[valid], atol=0.5*0.25)
+
+
+def test_weights_cache(tmp_path):
+    src_lats, src_lons = np.arange(50., 29.9, -0.5), np.arange(-80., -49.9, 0.5)
+    dst_lats, dst_lons = np.arange(30., 50.1, 0.25), np.arange(-80., -49.9, 0.25)
+    weights = regrid_weights(src_lats, src_lons, dst_lats, dst_lons, cache_dir=str(tmp_path))
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and files[0].endswith('.npz')
+    assert regrid_weights(src_lats, src_lons, dst_lats, dst_lons, cache_dir=str(tmp_path)) is weights
+    regrid._weights.clear()
+    loaded = regrid_weights(src_lats, src_lons, dst_lats, dst_lons, cache_dir=str(tmp_path))
+    assert loaded is not weights and (loaded != weights).nnz == 0
+    # Other grids have other weights
+    regrid_weights(src_lats, src_lons, dst_lats[:-1], dst_lons, cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_regrid_dataset(tmp_path):
+    lats, lons = np.arange(50., 29.9, -0.5), np.arange(-80., -49.9, 0.5)
+    lat, lon = np.meshgrid(lats, lons, indexing='ij')
+    times = np.arange('2015-01-01', '2015-01-02', np.timedelta64(6, 'h'), dtype='datetime64[ns]')
+    ds = xr.Dataset({
+        'swh': (('time', 'latitude', 'longitude'), np.stack([_linear(lat, lon)]*4)),
+        'mwd': (('latitude', 'longitude', 'time'), np.stack([np.where(lon < -72.75, 348., 12.)]*4, axis=-1)),
+        'station': ('time', np.arange(4)),
+    }, coords={'time': times, 'latitude': lats, 'longitude': lons})
+
+    dst_lats, dst_lons = np.arange(31., 49., 0.125), np.arange(-79., -51., 0.125)
+    out = regrid.regrid(ds, dst_lats, dst_lons, cache_dir=str(tmp_path))
+    assert out['swh'].dims == ('time', 'latitude', 'longitude')
+    assert out['mwd'].dims == ('time', 'latitude', 'longitude')
+    # Directions across north: 348 and 12 degrees interpolate to 0, not 180
+    mwd = out['mwd'].sel(latitude=40., longitude=-72.75).values
+    np.testing.assert_allclose(np.cos(np.deg2rad(mwd)), 1.)
+    assert out['station'].equals(ds['station'])
+    np.testing.assert_allclose(out['swh'].isel(time=1),
+            _linear(*np.meshgrid(dst_lats, dst_lons, indexing='ij')))
+
+    swath_lats = np.array([[40., 40.5], [41., 41.5]])
+    swath_lons = np.array([[-70., -69.5], [-70.2, -69.7]])
+    swath = regrid.regrid(ds['swh'], swath_lats, swath_lons, cache_dir=str(tmp_path))
+    assert swath.dims == ('time', 'y', 'x')
+    np.testing.assert_allclose(swath.isel(time=0), _linear(swath_lats, swath_lons))
+    buoys = regrid.regrid(ds['swh'], [40.1, 35.], [-70.8, -60.], points=True, cache_dir=False)
+    assert buoys.dims == ('time', 'point')
+    np.testing.assert_allclose(buoys.isel(time=0), _linear(np.array([40.1, 35.]),
+            np.array([-70.8, -60.])))
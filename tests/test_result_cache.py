@@ -0,0 +1,93 @@
+import importlib
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+import ascat
+import instrumentation
+import result_cache
+from ascat import ascat_params_cnn
+from result_cache import ResultCache, cached, code_version, file_identity
+
+
+def test_result_cache(ascatFile, tmpDir):
+    cache_dir = os.path.join(tmpDir, 'result_cache')
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    cache = ResultCache(cache_dir)
+    calls = []
+
+    def extract(filename, station_lon, station_lat, nx=3):
+        calls.append(nx)
+        return ascat_params_cnn(filename, station_lon, station_lat, nx=nx, ny=nx)
+
+    instrumentation.reset()
+    first = cache.call(extract, ascatFile, -65., 40., nx=5)
+    second = ResultCache(cache_dir).call(extract, ascatFile, -65., 40., nx=5)
+    assert calls == [5]
+    np.testing.assert_array_equal(first['sigma0_trip_fore'], second['sigma0_trip_fore'])
+    assert instrumentation.summary()['caches']['result_cache'] == {
+        'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+    # Other parameters or station
+    cache.call(extract, ascatFile, -65., 40., nx=3)
+    cache.call(extract, ascatFile, -65.5, 40., nx=3)
+    assert calls == [5, 3, 3]
+
+    # Modified file
+    copy = os.path.join(tmpDir, 'result_cache_ascat.nc')
+    shutil.copy(ascatFile, copy)
+    key = cache.key(extract, copy, -65., 40.)
+    os.utime(copy, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert cache.key(extract, copy, -65., 40.) != key
+
+
+def test_eviction(tmpDir):
+    cache = ResultCache(os.path.join(tmpDir, 'result_cache_evict'), max_bytes=None)
+    cache.clear()
+    for i in range(5):
+        cache.put('%064d' % i, np.zeros(1000))
+        os.utime(cache._path('%064d' % i), (i, i))
+    entry = cache.size()//5
+    cache.get('%064d' % 0)
+    assert cache.evict(max_bytes=3*entry) == 3
+    hits = [cache.get('%064d' % i)[0] for i in range(5)]
+    assert hits == [True, False, False, False, True]
+
+
+def test_cached_wrapper_and_identity(ascatFile, tmpDir):
+    wrapped = cached(ascat_params_cnn, ResultCache(os.path.join(tmpDir, 'result_cache_wrap')))
+    assert wrapped.__name__ == 'ascat_params_cnn'
+    assert wrapped(ascatFile, -65., 40., nx=3, ny=3)['sigma0_trip_mid'].shape == (3, 3)
+    assert file_identity(ascatFile)['size'] == os.path.getsize(ascatFile)
+    assert file_identity(tmpDir)['size'] > 0
+    assert code_version(ascat_params_cnn) == code_version(ascat_params_cnn)
+
+
+def test_code_version_dependencies(tmpDir):
+    # ascat uses cmod through nrcs_models
+    assert {'nrcs_models', 'cmod'} <= set(result_cache._repository_modules(ascat))
+
+    package_dir = os.path.join(tmpDir, 'code_version_modules')
+    os.makedirs(package_dir, exist_ok=True)
+    sources = {'cv_top': 'from cv_middle import middle\n\ndef top():\n    return middle()\n',
+            'cv_middle': 'import cv_leaf\n\ndef middle():\n    return cv_leaf.leaf()\n',
+            'cv_leaf': 'def leaf():\n    return 1\n'}
+    for name, source in sources.items():
+        with open(os.path.join(package_dir, name + '.py'), 'w') as f:
+            f.write(source)
+    sys.path.insert(0, package_dir)
+    try:
+        top = importlib.import_module('cv_top')
+        version = code_version(top.top)
+        with open(os.path.join(package_dir, 'cv_leaf.py'), 'w') as f:
+            f.write('def leaf():\n    return 2\n')
+        result_cache._code_versions.clear()
+        assert code_version(top.top) != version
+    finally:
+        sys.path.remove(package_dir)
+        for name in sources:
+            sys.modules.pop(name, None)
+        result_cache._code_versions.clear()
@@ -1,6 +1,8 @@
+import numpy as np
 import pytest
 
-from sar import sar_params
+import sar
+from sar import sar_params, calc_vv, normalize_nrcs, calibrate_nrcs
 
 sar_fn = (
     '/lustre/storeB/project/IT/geout/machine-ocean/data_raw/sentinel/'
@@ -13,3 +15,43 @@ def test_sar():
     location = [5.0, 65.0]
 
     s0norm, s0, inc, az = sar_params(sar_fn, location[0], location[1])
+
+@pytest.mark.parametrize('use_numexpr', [False, True])
+@pytest.mark.parametrize('pol', ['HH', 'VV'])
+def test_calibrate_nrcs(monkeypatch, use_numexpr, pol):
+    """ Test that the blocked calibration kernel gives the same result as
+    calc_vv, conversion to dB and normalize_nrcs applied in sequence.
+    """
+    if use_numexpr:
+        pytest.importorskip('numexpr')
+    else:
+        monkeypatch.setattr(sar, 'ne', None)
+    rng = np.random.default_rng(0)
+    inc = np.linspace(30., 46., 700*40).reshape(700, 40)
+    s0 = rng.uniform(1e-3, 1e-1, inc.shape)
+
+    expected = calc_vv(s0, inc) if pol == 'HH' else s0
+    expected = 10.*np.log10(expected)
+    expected_norm = normalize_nrcs(expected, inc)
+
+    s0_db, s0_norm = calibrate_nrcs(s0, inc, pol=pol, block_rows=128)
+    np.testing.assert_allclose(s0_db, expected)
+    np.testing.assert_allclose(s0_norm, expected_norm)
+
+    # In place
+    s0_db, _ = calibrate_nrcs(s0, inc, pol=pol, normalize=False, out=s0)
+    assert s0_db is s0
+    np.testing.assert_allclose(s0, expected)
+
+def test_calibrate_nrcs_models():
+    """ Test the tabulated model path of the calibration kernel against
+    the default Topouzelis/Ren formulas, in single precision.
+    """
+    inc = np.linspace(30., 46., 300*20).reshape(300, 20).astype(np.float32)
+    s0 = np.random.default_rng(1).uniform(1e-3, 1e-1, inc.shape).astype(np.float32)
+    expected, expected_norm = calibrate_nrcs(s0, inc, pol='HH')
+    s0_db, s0_norm = calibrate_nrcs(s0, inc, pol='HH', block_rows=64,
+            norm_model='topouzelis2016', pr_model='ren2017')
+    assert s0_db.dtype == np.float32
+    np.testing.assert_allclose(s0_db, expected, atol=1e-4)
+    np.testing.assert_allclose(s0_norm, expected_norm, atol=1e-4)
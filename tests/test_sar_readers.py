@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import xarray as xr
+
+from sar import calc_vv, normalize_nrcs, sar_params
+from sar_readers import open_sar, NetCDFReader
+from sar_tiling import tile_scene
+
+
+def test_sar_params_netcdf_backend(sarFile):
+    ds = xr.open_dataset(sarFile)
+    row, col = 200, 250
+    lon, lat = ds.lon.values[row, col], ds.lat.values[row, col]
+
+    s0, s0_norm, inc, az, grid_lons, grid_lats, pol = sar_params(
+        sarFile, station_lon=lon, station_lat=lat, x_size=5, y_size=5)
+
+    assert pol == 'HH'
+    assert s0.shape == inc.shape == az.shape == grid_lons.shape == (5, 5)
+    # Same offsets as crop_sar_data_xy
+    window = (slice(row - 3, row + 2), slice(col - 3, col + 2))
+    expected_inc = ds.incidence_angle.values[window]
+    expected = 10.*np.log10(calc_vv(ds.sigma0.values[window].astype(float), expected_inc))
+    np.testing.assert_allclose(inc, expected_inc)
+    np.testing.assert_allclose(s0, expected, rtol=1e-5)
+    np.testing.assert_allclose(s0_norm, normalize_nrcs(expected, expected_inc), rtol=1e-5)
+    np.testing.assert_array_equal(grid_lats, ds.lat.values[window])
+
+
+def test_netcdf_reader_crop_and_rows(sarFile):
+    reader = open_sar(sarFile)
+    assert isinstance(reader, NetCDFReader)
+    assert reader.crop(-3, 10, 8, 6, allow_larger=True) == (0, 10, 5, 6)
+    assert reader.shape() == (6, 5)
+    full = xr.open_dataset(sarFile).incidence_angle.values
+    np.testing.assert_array_equal(reader.read('incidence_angle', rows=(2, 4)), full[12:14, :5])
+
+
+def test_tile_scene(sarFile, fncDir):
+    ds = xr.open_dataset(sarFile)
+    stations = {'buoy': (ds.lon.values[100, 120], ds.lat.values[100, 120])}
+    patches = tile_scene(sarFile, fncDir, size=32, stride=48, stations=stations,
+            station_offsets=((0, 0), (0, 16)), block_rows=64)
+    scene_dir = os.path.join(fncDir, 'synthetic_sar')
+    s0_norm = np.load(os.path.join(scene_dir, 's0_norm.npy'), mmap_mode='r')
+    assert s0_norm.shape == (len(patches), 32, 32)
+    assert s0_norm.dtype == np.float32
+
+    station = patches[patches.kind == 'station'].iloc[0]
+    assert (station.row, station.col) == (84, 104)
+    s0, expected_norm, *_ = sar_params(sarFile)
+    i = station.name
+    np.testing.assert_allclose(s0_norm[i], expected_norm[84:116, 104:136], atol=1e-4)
@@ -0,0 +1,43 @@
+import numpy as np
+
+from sar_tiling import iter_block_patches, regular_patches, station_patches, write_patches
+
+
+def test_block_patches_match_full_image_crops(fncDir):
+    rng = np.random.default_rng(0)
+    image = {field: rng.normal(size=(301, 157)).astype(np.float32)
+            for field in ['s0', 's0_norm', 'inc', 'az']}
+    reads = []
+
+    def read_rows(r0, r1):
+        reads.append((r0, r1))
+        return {field: values[r0:r1] for field, values in image.items()}
+
+    size = 16
+    corners = np.concatenate([
+        regular_patches((301, 157), size, 24),
+        station_patches(150.4, 80.6, size, offsets=((0, 0), (-8, 0), (0, 8))),
+    ])
+    assert (corners[-3] == [142, 73]).all()
+
+    arrays = write_patches(read_rows, (301, 157), corners, size, fncDir, block_rows=50)
+    for i, (r, c) in enumerate(corners):
+        for field in image:
+            np.testing.assert_array_equal(arrays[field][i], image[field][r:r + size, c:c + size])
+
+    # Each block is read once, and only rows covered by patches are read
+    assert len(reads) == len(set(reads))
+    assert max(r1 for _, r1 in reads) <= corners[:, 0].max() + size
+    assert sum(r1 - r0 for r0, r1 in reads) < 2*301
+
+
+def test_iter_block_patches_skips_rows_without_patches():
+    reads = []
+
+    def read_rows(r0, r1):
+        reads.append((r0, r1))
+        return {'s0': np.zeros((r1 - r0, 10))}
+
+    patches = list(iter_block_patches(read_rows, (1000, 10), [[900, 0], [10, 2]], 8, block_rows=100))
+    assert [i for i, _ in patches] == [1, 0]
+    assert reads == [(10, 18), (900, 908)]
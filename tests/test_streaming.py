@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import instrumentation
+import streaming
+from ascat import ascat_params, ascat_params_cnn
+from ascat_swath import ascat_swath_params_cnn
+from crop_store import CropStore
+from streaming import (Task, batched, extractor, iter_samples, iter_tasks, prefetch_map,
+        scalar_frames, write_crop_store)
+
+
+@pytest.fixture
+def collocation(ascatFile, ascatStations):
+    data_dir, filename = os.path.split(ascatFile)
+    in_situ_obs = {
+        'buoy_%d' % i: {'lon': [lon], 'lat': [lat], 'products': ['product_%d' % i],
+            'nc_files': {'product_%d' % i: filename}}
+        for i, (lon, lat) in enumerate(ascatStations)}
+    times = pd.date_range('2016-03-01T11:00', '2016-03-01T13:00', freq='10min')
+    in_situ = {buoy: pd.DataFrame({'UWr': np.arange(times.size, dtype=float)}, index=times)
+            for buoy in in_situ_obs}
+    # No observation close to the sensing time
+    in_situ['buoy_4'] = in_situ['buoy_4'].iloc[:3]
+    return data_dir, in_situ_obs, in_situ
+
+
+def test_prefetch_is_bounded():
+    pulled = []
+
+    def items():
+        for i in range(20):
+            pulled.append(i)
+            yield i
+
+    results = prefetch_map(lambda i: i*i, items(), workers=2, prefetch=3)
+    assert next(results) == (0, 0)
+    assert len(pulled) <= 4
+    assert list(results) == [(i, i*i) for i in range(1, 20)]
+
+
+def test_prefetch_errors():
+    def func(i):
+        if i == 2:
+            raise ValueError(i)
+        return i
+
+    failed = []
+    results = prefetch_map(func, range(5), workers=2, on_error=lambda i, e: failed.append(i))
+    assert [i for i, _ in results] == [0, 1, 3, 4]
+    assert failed == [2]
+    with pytest.raises(ValueError):
+        list(prefetch_map(func, range(5), workers=0))
+
+
+def _lazy_params(filename, lon, lat):
+    ds = xr.open_dataset(filename)
+    return {'sigma0_trip_mid': ds['sigma0_trip_mid'], 'lon': lon}
+
+
+def test_extractor_loads_results(ascatFile):
+    # Lazy results would be read after the NetCDF lock is released
+    params = extractor(_lazy_params)(Task('buoy', 'product', ascatFile, -70.8, 40.1, None))
+    assert params['sigma0_trip_mid'].variable._in_memory
+    assert params['lon'] == -70.8
+
+
+def test_iter_samples(collocation):
+    data_dir, in_situ_obs, in_situ = collocation
+    tasks = list(iter_tasks(in_situ_obs, data_dir))
+    assert tasks[0] == Task('buoy_0', 'product_0', os.path.join(data_dir, 'synthetic_ascat.nc'),
+            -70.8, 40.1, None)
+
+    # Extraction functions run in processes by default
+    assert streaming._default_executor(extractor(ascat_params)) == 'process'
+    assert streaming._default_executor(len) == 'thread'
+    samples = list(iter_samples(tasks, extractor(ascat_params), in_situ, workers=2))
+    instrumentation.reset()
+    threaded = list(iter_samples(tasks, extractor(ascat_params), in_situ, workers=2,
+            executor='thread'))
+    assert [s['buoy'] for s in threaded] == [s['buoy'] for s in samples]
+    stages = instrumentation.summary()['stages']
+    assert stages['streaming.extract']['count'] == stages['streaming.collocate']['count'] == 5
+    assert [s['buoy'] for s in samples] == ['buoy_0', 'buoy_1', 'buoy_2', 'buoy_3']
+    # 12:00 is the closest observation to the sensing start time
+    assert all(s['UWr'] == 6. for s in samples)
+    expected = ascat_params(tasks[1].filename, tasks[1].lon, tasks[1].lat)
+    assert samples[1]['sigma0_trip_fore'] == expected['sigma0_trip_fore']
+
+    frames = list(scalar_frames(samples, batch_size=3))
+    assert [len(f) for f in frames] == [3, 1]
+    assert 'grid_lats_orig' not in frames[0]
+    assert [len(b) for b in batched(range(5), 2)] == [2, 2, 1]
+
+
+def test_write_crop_store(collocation, tmpDir):
+    data_dir, in_situ_obs, in_situ = collocation
+    store_dir = os.path.join(tmpDir, 'streaming_store')
+    samples = iter_samples(iter_tasks(in_situ_obs, data_dir),
+            extractor(ascat_params_cnn, nx=5, ny=5), in_situ, workers=2)
+    table = write_crop_store(samples, store_dir, ['sigma0_trip_fore', 'sigma0_trip_mid'], (5, 5))
+    assert list(table['buoy']) == ['buoy_0', 'buoy_1', 'buoy_2', 'buoy_3']
+    store = CropStore(store_dir)
+    assert store.arrays['sigma0_trip_mid'].shape == (4, 5, 5)
+
+
+def test_swath_extraction(ascatFile, ascatSwathFile):
+    # Swath files are sent to the swath geometry functions
+    with xr.open_dataset(ascatSwathFile) as ds:
+        lon, lat = float(ds.lon[100, 60]) - 360., float(ds.lat[100, 60])
+    extract = extractor(ascat_params_cnn, nx=5, ny=5)
+    params = extract(Task('buoy', 'swath', ascatSwathFile, lon, lat, None))
+    expected = ascat_swath_params_cnn(ascatSwathFile, lon, lat, nx=5, ny=5)
+    np.testing.assert_array_equal(params['sigma0_trip_mid'], expected['sigma0_trip_mid'])
+    params = extract(Task('buoy', 'grid', ascatFile, -65., 40., None))
+    np.testing.assert_array_equal(params['sigma0_trip_mid'],
+            ascat_params_cnn(ascatFile, -65., 40., nx=5, ny=5)['sigma0_trip_mid'])
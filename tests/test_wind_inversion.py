@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+import derived
+import synthetic
+from ascat import ascat_params
+from cmod import cmod5n
+from wind_inversion import ascat_wind, invert_triplets
+
+
+def _triplets(n, seed=0):
+    """ NRCS triplets [dB] of random winds in the ASCAT geometry. """
+    rng = np.random.default_rng(seed)
+    speed, direction = rng.uniform(3., 25., n), rng.uniform(0., 360., n)
+    heading = rng.uniform(0., 360., (n, 1))
+    side = np.where(rng.random((n, 1)) < 0.5, -1., 1.)
+    across = rng.random((n, 1))
+    azi = (heading + side*np.array([synthetic.BEAM_AZIMUTHS[beam] for beam in synthetic.BEAMS])) % 360.
+    inc_min, inc_max = np.array([synthetic.INC_RANGES[beam] for beam in synthetic.BEAMS]).T
+    inc = inc_min + (inc_max - inc_min)*across
+    s0 = 10.*np.log10(cmod5n(speed[:, None], direction[:, None] - azi, inc))
+    return s0, inc, azi, speed, direction
+
+
+def _angle(a, b):
+    return np.abs((a - b + 180.) % 360. - 180.)
+
+
+def test_invert_triplets():
+    s0, inc, azi, speed, direction = _triplets(2000)
+    result = invert_triplets(s0.reshape(40, 50, 3), inc.reshape(40, 50, 3), azi.reshape(40, 50, 3),
+            background=direction.reshape(40, 50))
+    assert all(values.shape == (40, 50) for values in result)
+    v, d, residual = (values.ravel() for values in result)
+    assert np.percentile(np.abs(v - speed), 95) < 0.1
+    assert np.abs(v - speed).max() < 1.
+    assert np.percentile(_angle(d, direction), 95) < 3.
+    assert (_angle(d, direction) < 20.).all()
+    assert np.median(residual) < 0.05
+
+    # Without a background most, but not all, directions are right
+    d = invert_triplets(s0, inc, azi)[1]
+    assert 0.9 < (_angle(d, direction) < 20.).mean() < 1.
+
+
+def test_meteorological_direction():
+    # Background from the wind components, as for IFS
+    s0, inc, azi, speed, direction = _triplets(500, seed=2)
+    u10 = xr.DataArray(-speed*np.sin(np.deg2rad(direction)))
+    v10 = xr.DataArray(-speed*np.cos(np.deg2rad(direction)))
+    background = derived.wind_direction(u10, v10).values
+    np.testing.assert_allclose(_angle(background, direction), 0., atol=1e-6)
+    v, d, _ = invert_triplets(s0, inc, azi, background=background)
+    assert ((0. <= d) & (d < 360.)).all()
+    assert (_angle(d, direction) < 20.).all()
+    # The oceanographic direction selects the opposite solutions
+    d = invert_triplets(s0, inc, azi, background=(background + 180.) % 360.)[1]
+    assert (_angle(d, direction) > 90.).mean() > 0.9
+
+    # Wind from the north seen by a beam looking north: towards the
+    # radar, the upwind maximum of the NRCS
+    s0_north = 10.*np.log10(cmod5n(10., 0. - 0., 45.))
+    s0_south = 10.*np.log10(cmod5n(10., 180. - 0., 45.))
+    assert s0_north > s0_south
+
+
+def test_missing_beams():
+    s0, inc, azi, speed, direction = _triplets(4, seed=1)
+    s0[1, 0] = np.nan
+    s0[2, :2] = np.nan
+    inc[3, 1] = 80.
+    v, d, residual = invert_triplets(s0, inc, azi, background=direction)
+    assert np.isnan(v[2]) and np.isnan(d[2]) and np.isnan(residual[2])
+    np.testing.assert_allclose(v[[0, 1, 3]], speed[[0, 1, 3]], atol=0.5)
+    assert np.isnan(invert_triplets(s0, inc, azi, min_beams=3)[0][[1, 2, 3]]).all()
+    with pytest.raises(ValueError):
+        invert_triplets(s0, inc[:, :2], azi)
+
+
+def test_ascat_wind(ascatFile):
+    ds = xr.open_dataset(ascatFile)
+    triplets = [np.stack([ds[prefix + beam].values for beam in synthetic.BEAMS], axis=-1)
+            for prefix in ['sigma0_trip_', 'inc_angle_trip_', 'azi_angle_trip_']]
+    speed, direction, residual = invert_triplets(*triplets, background=ds['wind_dir_model'].values)
+    in_swath = np.isfinite(ds['sigma0_trip_mid'].values)
+    assert np.array_equal(np.isfinite(speed), in_swath)
+    # The NRCS has about 0.2 dB of noise
+    error = np.abs(speed - ds['wind_speed_model'].values)[in_swath]
+    assert np.median(error) < 0.5 and np.percentile(error, 95) < 2.
+    assert np.median(_angle(direction, ds['wind_dir_model'].values)[in_swath]) < 10.
+
+    # Collocations, with the model wind direction at the pixel as background
+    points = [(-65., 40.), (-70.8, 40.1), (-60., 35.)]
+    pixels = [(np.abs(ds.lat.values - lat).argmin(), np.abs(ds.lon.values - lon).argmin())
+            for lon, lat in points]
+    collocations = []
+    for (lon, lat), (j, i) in zip(points, pixels):
+        params = ascat_params(ascatFile, lon, lat)
+        params['ifs_wind_dir'] = float(ds['wind_dir_model'][j, i])
+        collocations.append(params)
+    params = ascat_wind(collocations, background='ifs_wind_dir')
+    for (j, i), (_, row) in zip(pixels, params.iterrows()):
+        assert row['wind_speed_cmod5n'] == pytest.approx(speed[j, i], abs=1e-6, nan_ok=True)
+        assert row['wind_dir_cmod5n'] == pytest.approx(direction[j, i], abs=1e-6, nan_ok=True)
+        assert row['cmod5n_residual'] == pytest.approx(residual[j, i], abs=1e-6, nan_ok=True)
+
+    params = ascat_wind(collocations[0], background=collocations[0]['ifs_wind_dir'])
+    assert isinstance(params['wind_speed_cmod5n'], float)
+    assert params['wind_speed_cmod5n'] == pytest.approx(speed[pixels[0]], abs=1e-6)
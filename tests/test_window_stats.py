@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from window_stats import integral_images, size_suffix, window_bounds, window_stats
+
+
+def test_window_stats_match_crop_statistics():
+    rng = np.random.default_rng(0)
+    values = -15. + rng.normal(size=(40, 30))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[:5] = np.nan
+    sizes = [1, 3, 5, 7, 9, 15, (3, 7), 40]
+    for row, col in [(20, 15), (0, 0), (39, 29), (3, 27)]:
+        stats = window_stats(values, row, col, sizes)
+        for size in sizes:
+            r0, c0, r1, c1 = window_bounds(values.shape, row, col, size)
+            crop = values[r0:r1, c0:c1]
+            mean, std, count = stats[size if np.ndim(size) == 0 else tuple(size)]
+            assert count == np.isfinite(crop).sum()
+            if count == 0:
+                assert np.isnan(mean) and np.isnan(std)
+                continue
+            assert mean == pytest.approx(np.nanmean(crop), abs=1e-12)
+            assert std == pytest.approx(np.nanstd(crop), abs=1e-9)
+
+
+def test_window_stats_valid_mask():
+    values = np.arange(25.).reshape(5, 5)
+    valid = values % 2 == 0
+    mean, std, count = window_stats(values, 2, 2, [3], valid)[3]
+    crop = values[1:4, 1:4][valid[1:4, 1:4]]
+    assert count == crop.size
+    assert (mean, std) == pytest.approx((crop.mean(), crop.std()))
+
+    sums, squares, counts, shift = integral_images(values, valid)
+    assert sums.shape == (6, 6)
+    assert counts[-1, -1] == valid.sum()
+    assert size_suffix(5) == '_5x5'
+    assert size_suffix((3, 7)) == '_3x7'
@@ -0,0 +1,359 @@
+""" Wind retrieval from ASCAT NRCS triplets by inversion of CMOD5.N.
+
+CMOD5.N is tabulated once on a regular (incidence angle, relative wind
+direction, wind speed) grid in dB. The wind of a triplet is the speed
+and direction minimizing the distance between the observed NRCS and the
+model NRCS of the beams
+
+    D(v, dir) = sum over beams of (s0_obs - cmod5n(v, dir - azi, inc))**2
+
+with the NRCS in dB. The search runs over blocks of samples at once, in
+two stages: a coarse grid (0.4 to 1 m/s, 10 degrees) over all winds, at
+the nearest incidence angle of the table, then the full resolution of
+the table around the local minima over the directions of the coarse
+search (the ambiguous solutions), with a parabolic refinement of the
+minima. The table is interpolated linearly in incidence angle, and the
+relative direction rounded to the table. Without a background wind
+direction (e.g. of IFS or of the buoy) the best fitting solution is
+returned, else the closest to the background of those fitting about as
+well.
+
+    params = ascat_wind(ascat_params(ascat_fn, station_lon, station_lat))
+    speed, direction, residual = invert_triplets(sigma0, inc_angle, azi_angle,
+            background=ifs_direction)
+
+Wind directions follow the meteorological convention of the buoys and
+of `derived.wind_direction` (wdir): the direction the wind is blowing
+from, clockwise from north, in [0, 360). The azi_angle_trip_<beam> of
+the EUMETSAT products is the azimuth of the look direction of the beam,
+from the satellite towards the node, clockwise from north. A wind
+blowing from that azimuth blows towards the radar, which is upwind (0)
+in `cmod5n`, so the relative direction of CMOD5.N is
+`direction - azi_angle`. Backgrounds in another convention, e.g. the
+oceanographic (blowing towards) direction, select the wrong ambiguous
+solution.
+"""
+import numpy as np
+import pandas as pd
+
+from cmod import cmod5n
+from instrumentation import count, timer
+
+BEAMS = ['fore', 'mid', 'aft']
+
+# Grids of the lookup table: wind speed [m/s], wind direction relative
+# to the look direction [degrees] (CMOD5.N is symmetric about 0) and
+# incidence angle [degrees]
+SPEED_START = 0.2
+SPEED_STOP = 40.
+SPEED_STEP = 0.2
+PHI_STEP = 1.
+INC_START = 16.
+INC_STOP = 68.
+INC_STEP = 0.5
+
+# Grid of the coarse search: wind speeds [m/s], finer at low speeds
+# where the NRCS varies fastest, and step of the directions in table
+# steps. Half widths of the fine search around the coarse minima, in
+# table steps, and largest number of moves of the fine search.
+COARSE_SPEEDS = np.concatenate([np.arange(0.2, 4., 0.4), np.arange(4., 40.1, 1.)])
+COARSE_DIRECTION = 10
+FINE_SPEED = 5
+FINE_DIRECTION = 6
+FINE_PASSES = 4
+
+# Local minima of the coarse search refined at full resolution, the
+# ambiguous solutions of a triplet
+CANDIDATES = 4
+
+# Largest excess of the RMS difference to the model NRCS [dB] of a
+# solution over the best one, to be chosen by a background direction
+AMBIGUITY_RESIDUAL = 0.4
+
+# Least number of valid beams of a triplet
+MIN_BEAMS = 2
+
+# Samples per block of the search, which bounds the memory use
+CHUNK_SIZE = 256
+
+_lut = {}
+
+
+def lut_speeds():
+    """ Wind speeds [m/s] of the lookup table. """
+    return SPEED_START + SPEED_STEP*np.arange(round((SPEED_STOP - SPEED_START)/SPEED_STEP) + 1)
+
+
+def lut_incidences():
+    """ Incidence angles [degrees] of the lookup table. """
+    return INC_START + INC_STEP*np.arange(round((INC_STOP - INC_START)/INC_STEP) + 1)
+
+
+def cmod5n_lut():
+    """ CMOD5.N NRCS [dB] on the grid of the lookup table, computed once.
+
+    Returns
+    =======
+    lut : float32 array, shape (n_inc, n_phi, n_speed)
+        Relative wind directions from 0 to 180 degrees.
+    """
+    if 'cmod5n' not in _lut:
+        speeds, incs = lut_speeds(), lut_incidences()
+        phis = PHI_STEP*np.arange(round(180./PHI_STEP) + 1)
+        with timer('wind_inversion.lut'):
+            s0 = cmod5n(speeds[None, None, :], phis[None, :, None], incs[:, None, None])
+            _lut['cmod5n'] = (10.*np.log10(s0)).astype(np.float32)
+    return _lut['cmod5n']
+
+
+def _phi_index(direction, azi):
+    """ Index in the lookup table of the direction of the wind relative to
+    the look direction, folded to 0-180 degrees.
+    """
+    phi = np.abs((direction - azi + 180.) % 360. - 180.)
+    return np.rint(phi/PHI_STEP).astype(np.intp)
+
+
+def _distances(table, sigma0, azi, i0, w, valid, directions, start=None):
+    """ Distances between the observed and the model NRCS of a block of
+    samples on a grid of winds.
+
+    Parameters
+    ==========
+    table : array, shape (n_inc, n_phi, n_speed)
+    sigma0, azi, i0, w, valid : arrays, shape (n, n_beams)
+        Observed NRCS [dB], azimuth angles, index of the incidence angle
+        in the table and weight of the next one (None for the nearest
+        incidence angle), and valid beams (1 or 0).
+    directions : array, shape (n, n_dir)
+        Wind directions [degrees] of each sample.
+    start : array, shape (n,), optional
+        Index in `table` of the first of the 2*FINE_SPEED + 1 speeds of
+        each sample, by default all speeds.
+
+    Returns
+    =======
+    distance : float32 array, shape (n, n_dir, n_v)
+    """
+    n_inc, n_phi, n_speed = table.shape
+    rows = table.reshape(n_inc*n_phi, n_speed)
+    if start is not None:
+        # Windows of contiguous speeds
+        rows = np.lib.stride_tricks.sliding_window_view(rows, 2*FINE_SPEED + 1, axis=1)
+    distance = None
+    for k in range(sigma0.shape[1]):
+        row = i0[:, k, None]*n_phi + _phi_index(directions, azi[:, k, None])
+        index = (row,) if start is None else (row, start[:, None])
+        model = rows[index]
+        if w is not None:
+            high = rows[(row + n_phi,) + index[1:]]
+            high -= model
+            high *= w[:, k, None, None]
+            model += high
+        model -= sigma0[:, k, None, None]
+        model *= model
+        model *= valid[:, k, None, None]
+        if distance is None:
+            distance = model
+        else:
+            distance += model
+    return distance
+
+
+def _parabola(below, centre, above, inner):
+    """ Offset [steps] of the minimum of the parabola through three
+    equally spaced values, within half a step, and the change of the
+    minimum value. Zero where not `inner`.
+    """
+    curvature = below - 2.*centre + above
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(inner & (curvature > 0), 0.5*(below - above)/curvature, 0.)
+    offset = np.clip(offset, -0.5, 0.5)
+    return offset, 0.5*(above - below)*offset + 0.5*curvature*offset**2
+
+
+def invert_triplets(sigma0, inc_angle, azi_angle, background=None, min_beams=MIN_BEAMS,
+        chunk_size=CHUNK_SIZE):
+    """ Wind speed and direction of NRCS triplets by inversion of CMOD5.N.
+
+    Parameters
+    ==========
+    sigma0 : array, shape (..., n_beams)
+        NRCS [dB] of the beams (e.g. fore, mid and aft).
+    inc_angle, azi_angle : arrays, shape (..., n_beams)
+        Incidence angles and azimuths of the look directions (from the
+        satellite towards the node, clockwise from north) [degrees] of
+        the beams.
+    background : float or array, shape (...), optional
+        Background wind direction [degrees], meteorological convention
+        (e.g. `derived.wind_direction` of the IFS wind or the buoy wind
+        direction), which removes the direction ambiguity, NaN for none.
+    min_beams : int, optional
+        Least number of beams with a finite NRCS and an incidence angle
+        within the table, NaN wind below.
+    chunk_size : int, optional
+        Samples per block of the search.
+
+    Returns
+    =======
+    speed : array, shape (...)
+        Equivalent neutral wind speed at 10 m [m/s].
+    direction : array, shape (...)
+        Wind direction [degrees], blowing from, clockwise from north.
+    residual : array, shape (...)
+        Root mean square difference between the observed and the model
+        NRCS [dB] of the valid beams.
+    """
+    sigma0 = np.asarray(sigma0, dtype=float)
+    inc_angle = np.asarray(inc_angle, dtype=float)
+    azi_angle = np.asarray(azi_angle, dtype=float)
+    if not sigma0.shape == inc_angle.shape == azi_angle.shape:
+        raise ValueError('NRCS %s, incidence %s and azimuth %s angles differ in shape'
+                % (sigma0.shape, inc_angle.shape, azi_angle.shape))
+    shape, n_beams = sigma0.shape[:-1], sigma0.shape[-1]
+    if background is not None:
+        background = np.broadcast_to(np.asarray(background, dtype=float), shape).ravel()
+    sigma0, inc_angle, azi_angle = (a.reshape(-1, n_beams) for a in (sigma0, inc_angle, azi_angle))
+
+    table = cmod5n_lut()
+    speeds = lut_speeds()
+    coarse_speeds = np.abs(speeds[:, None] - COARSE_SPEEDS).argmin(axis=0)
+    if 'cmod5n_coarse' not in _lut:
+        _lut['cmod5n_coarse'] = np.ascontiguousarray(table[:, :, coarse_speeds])
+    coarse = _lut['cmod5n_coarse']
+    n_inc, n_speed = table.shape[0], table.shape[2]
+    coarse_directions = PHI_STEP*np.arange(0, round(360./PHI_STEP), COARSE_DIRECTION)
+    fine_directions = PHI_STEP*np.arange(-FINE_DIRECTION, FINE_DIRECTION + 1)
+
+    position = (inc_angle - INC_START)/INC_STEP
+    with np.errstate(invalid='ignore'):
+        valid = (np.isfinite(sigma0) & np.isfinite(azi_angle)
+                & (position >= 0) & (position <= n_inc - 1))
+    position = np.where(valid, position, 0.)
+    i0 = np.minimum(np.floor(position), n_inc - 2).astype(np.intp)
+    nearest = np.rint(position).astype(np.intp)
+    w = (position - i0).astype(np.float32)
+    sigma0 = np.where(valid, sigma0, 0.).astype(np.float32)
+    azi_angle = np.where(valid, azi_angle, 0.)
+    n_valid = valid.sum(axis=1)
+    valid = valid.astype(np.float32)
+
+    speed = np.full(sigma0.shape[0], np.nan)
+    direction, residual = speed.copy(), speed.copy()
+    solved = np.flatnonzero(n_valid >= max(min_beams, 1))
+    count('wind_inversion.samples', solved.size)
+    with timer('wind_inversion.search'):
+        for start in range(0, solved.size, chunk_size):
+            block = solved[start:start + chunk_size]
+            n = block.size
+
+            # Coarse search over all winds, at the nearest incidence angle
+            distance = _distances(coarse, sigma0[block], azi_angle[block], nearest[block], None,
+                    valid[block], np.broadcast_to(coarse_directions, (n, coarse_directions.size)))
+            profile = distance.min(axis=2)
+            v = distance.argmin(axis=2)
+
+            # Up to CANDIDATES local minima of the distance over the
+            # directions, the best first and repeated if there are fewer
+            minima = (profile <= np.roll(profile, 1, axis=1)) & (profile <= np.roll(profile, -1, axis=1))
+            order = np.argsort(np.where(minima, profile, np.inf), axis=1)[:, :CANDIDATES]
+            order = np.where(np.take_along_axis(minima, order, axis=1), order, order[:, :1])
+            v = np.take_along_axis(v, order, axis=1)
+
+            # Full resolution of the table around each candidate, moved
+            # again around the minimum while it is on the edge of the window
+            candidates = np.repeat(block, CANDIDATES)
+            rows = np.arange(candidates.size)
+            centre = coarse_directions[order].ravel()
+            first = np.clip(coarse_speeds[v.ravel()] - FINE_SPEED, 0, n_speed - 2*FINE_SPEED - 1)
+            distance = np.empty((candidates.size, fine_directions.size, 2*FINE_SPEED + 1), np.float32)
+            moved = rows
+            for _ in range(FINE_PASSES):
+                directions = centre[moved, None] + fine_directions
+                sample = candidates[moved]
+                part = _distances(table, sigma0[sample], azi_angle[sample], i0[sample],
+                        w[sample], valid[sample], directions, first[moved])
+                distance[moved] = part
+                d, v = np.unravel_index(part.reshape(moved.size, -1).argmin(axis=1), part.shape[1:])
+                edge = ((d == 0) | (d == 2*FINE_DIRECTION)
+                        | ((v == 0) & (first[moved] > 0))
+                        | ((v == 2*FINE_SPEED) & (first[moved] < n_speed - 2*FINE_SPEED - 1)))
+                moved, d, v = moved[edge], d[edge], v[edge]
+                if not moved.size:
+                    break
+                centre[moved] = centre[moved] + fine_directions[d]
+                first[moved] = np.clip(first[moved] + v - FINE_SPEED, 0, n_speed - 2*FINE_SPEED - 1)
+            directions = centre[:, None] + fine_directions
+            d, v = np.unravel_index(distance.reshape(candidates.size, -1).argmin(axis=1),
+                    distance.shape[1:])
+            minimum = distance[rows, d, v]
+
+            # Minimum between the steps of the table, so that the
+            # candidates compare by more than the resolution of the table
+            below, above = np.maximum(d - 1, 0), np.minimum(d + 1, 2*FINE_DIRECTION)
+            d_offset, d_change = _parabola(distance[rows, below, v], minimum,
+                    distance[rows, above, v], (d > 0) & (d < 2*FINE_DIRECTION))
+            below, above = np.maximum(v - 1, 0), np.minimum(v + 1, 2*FINE_SPEED)
+            v_offset, v_change = _parabola(distance[rows, d, below], minimum,
+                    distance[rows, d, above], (v > 0) & (v < 2*FINE_SPEED))
+            minimum = np.maximum(minimum + d_change + v_change, 0.)
+
+            candidate = (directions[rows, d] + PHI_STEP*d_offset) % 360.
+            minimum = minimum.reshape(n, CANDIDATES)
+            best = minimum.argmin(axis=1)
+            if background is not None:
+                # Closest to the background of the candidates fitting
+                # about as well as the best one
+                rms = np.sqrt(minimum/n_valid[block, None])
+                fits = rms <= rms.min(axis=1, keepdims=True) + AMBIGUITY_RESIDUAL
+                difference = np.abs((candidate.reshape(n, CANDIDATES)
+                        - background[block, None] + 180.) % 360. - 180.)
+                closest = np.where(fits, difference, np.inf).argmin(axis=1)
+                best = np.where(np.isfinite(background[block]), closest, best)
+            minimum = minimum[np.arange(n), best]
+            best = best + CANDIDATES*np.arange(n)
+            direction[block] = candidate[best]
+            speed[block] = speeds[first[best] + v[best]] + SPEED_STEP*v_offset[best]
+            residual[block] = np.sqrt(minimum/n_valid[block])
+    return speed.reshape(shape), direction.reshape(shape), residual.reshape(shape)
+
+
+def ascat_wind(ascat_params_dict, background=None, min_beams=MIN_BEAMS):
+    """ Add the CMOD5.N wind of the triplets to the output of the
+    `ascat_params*` functions.
+
+    Parameters
+    ==========
+    ascat_params_dict : dictionary, DataFrame or list of dictionaries
+        With the keys sigma0_trip_<beam>, inc_angle_trip_<beam> and
+        azi_angle_trip_<beam>, scalars or arrays. A list (e.g. of the
+        dictionaries of many collocations) is inverted as a DataFrame.
+    background : string, float or array, optional
+        Background wind direction [degrees], meteorological convention,
+        or its key.
+    min_beams : int, optional
+        See `invert_triplets`.
+
+    Returns
+    =======
+    ascat_params_dict : dictionary or DataFrame
+        The input with the additional keys
+        wind_speed_cmod5n : wind speed [m/s].
+        wind_dir_cmod5n : wind direction [degrees], blowing from,
+            clockwise from north.
+        cmod5n_residual : RMS difference to the model NRCS [dB].
+    """
+    if isinstance(ascat_params_dict, list):
+        ascat_params_dict = pd.DataFrame(ascat_params_dict)
+
+    def triplets(prefix):
+        return np.stack([np.asarray(ascat_params_dict[prefix + beam], dtype=float)
+                for beam in BEAMS], axis=-1)
+
+    if isinstance(background, str):
+        background = np.asarray(ascat_params_dict[background], dtype=float)
+    wind = invert_triplets(triplets('sigma0_trip_'), triplets('inc_angle_trip_'),
+            triplets('azi_angle_trip_'), background, min_beams)
+    for name, values in zip(['wind_speed_cmod5n', 'wind_dir_cmod5n', 'cmod5n_residual'], wind):
+        ascat_params_dict[name] = values.item() if np.ndim(values) == 0 else values
+    return ascat_params_dict